@@ -2,17 +2,40 @@
 _pitz_frags ()
 {
     local cur="${COMP_WORDS[COMP_CWORD]}"
-    COMPREPLY=( $(compgen -W "`pitz-frags`" -- ${cur}) )
+    COMPREPLY=( $(pitz-frags -- "${cur}") )
+}
+
+# Same thing, but only for tasks.
+_pitz_task_frags ()
+{
+    local cur="${COMP_WORDS[COMP_CWORD]}"
+    COMPREPLY=( $(pitz-frags --tasks -- "${cur}") )
+}
+
+# pitz-assign-task takes a task and then a person.
+_pitz_assign_frags ()
+{
+    local cur="${COMP_WORDS[COMP_CWORD]}"
+
+    if [ "${COMP_CWORD}" -eq 1 ]; then
+        COMPREPLY=( $(pitz-frags --tasks -- "${cur}") )
+    else
+        COMPREPLY=( $(pitz-frags --people -- "${cur}") )
+    fi
 }
 
 # Wire up a few scripts to use tab completion on fragments.
 complete -o default -o nospace -F _pitz_frags pitz-show
 complete -o default -o nospace -F _pitz_frags pitz-edit
-complete -o default -o nospace -F _pitz_frags pitz-finish-task
-complete -o default -o nospace -F _pitz_frags pitz-start-task
-complete -o default -o nospace -F _pitz_frags pitz-abandon-task
-complete -o default -o nospace -F _pitz_frags pitz-claim-task
-complete -o default -o nospace -F _pitz_frags pitz-assign-task
-complete -o default -o nospace -F _pitz_frags pitz-unassign-task
-complete -o default -o nospace -F _pitz_frags pitz-prioritize-above
-complete -o default -o nospace -F _pitz_frags pitz-prioritize-below
+complete -o default -o nospace -F _pitz_frags pitz-destroy
+complete -o default -o nospace -F _pitz_frags pitz-comment
+complete -o default -o nospace -F _pitz_task_frags pitz-finish-task
+complete -o default -o nospace -F _pitz_task_frags pitz-start-task
+complete -o default -o nospace -F _pitz_task_frags pitz-pause-task
+complete -o default -o nospace -F _pitz_task_frags pitz-abandon-task
+complete -o default -o nospace -F _pitz_task_frags pitz-claim-task
+complete -o default -o nospace -F _pitz_assign_frags pitz-assign-task
+complete -o default -o nospace -F _pitz_task_frags pitz-unassign-task
+complete -o default -o nospace -F _pitz_task_frags pitz-estimate-task
+complete -o default -o nospace -F _pitz_task_frags pitz-prioritize-above
+complete -o default -o nospace -F _pitz_task_frags pitz-prioritize-below
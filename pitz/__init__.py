@@ -8,9 +8,8 @@ which is a grab bag of fanciness.
 """
 
 import logging
-import logging.config
 import os
-import subprocess
+import sys
 
 # Read http://semver.org for an explanation of how semantic versioning
 # works.
@@ -18,8 +17,64 @@ __version__ = "1.2.4"
 
 log = logging.getLogger('pitz')
 
+class LazyModule(object):
+    """
+    I stand in for a module and only import it the first time somebody
+    looks up an attribute on me.
+
+    Every pitz-* script imports the same modules, and most of them
+    never touch jinja2 or yaml, so there's no sense paying for those
+    imports up front.
+
+    >>> textwrap = LazyModule('textwrap')
+    >>> textwrap.fill('abc')
+    'abc'
+    """
+
+    def __init__(self, name):
+        self.__dict__['_name'] = name
+        self.__dict__['_module'] = None
+
+    def _load(self):
+
+        if self.__dict__['_module'] is None:
+            __import__(self._name)
+            self.__dict__['_module'] = sys.modules[self._name]
+
+        return self.__dict__['_module']
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    # Setting an attribute on me sets it on the real module, so stuff
+    # like mock.patch('clepy.edit_with_editor') keeps working.
+    def __setattr__(self, attr, value):
+        setattr(self._load(), attr, value)
+
+    def __delattr__(self, attr):
+        delattr(self._load(), attr)
+
+    def __repr__(self):
+        return "<LazyModule %s (%s)>" % (self._name,
+            'loaded' if self.__dict__['_module'] else 'not loaded')
+
+
+def lazy_import(name):
+    """
+    Return the module if somebody already imported it, otherwise return
+    a LazyModule that will import it later.
+    """
+
+    if name in sys.modules:
+        return sys.modules[name]
+
+    return LazyModule(name)
+
+
 def setup_logging(level=logging.INFO):
 
+    import logging.config
+
     logging.config.fileConfig(os.path.join(os.path.dirname(__file__),
         'logging.cfg'))
 
@@ -136,6 +191,12 @@ class ProjectNotFound(PitzException):
     Could not find a project.
     """
 
+class PitzdirLocked(PitzException):
+    """
+    Another pitz process holds a lock that conflicts with the one I
+    asked for.
+    """
+
 class OtherTaskStarted(PitzException):
     """
     Happens when you start a second task while another one is already
@@ -174,12 +235,46 @@ def build_filter(args):
     return d
 
 
+# The args that join filters together on the command line, like
+# pitz-tasks status=started '|' owner=matt.
+bag_operators = ('|', '&', '-')
+
+
+def split_on_operators(args):
+    """
+    Break args into groups of filter args, each with the operator that
+    joins it to the groups before it.
+
+    >>> split_on_operators(['a=1', '|', 'b=2', '-', 'c=3'])
+    [(None, ['a=1']), ('|', ['b=2']), ('-', ['c=3'])]
+
+    A leading operator joins the first group to everything:
+
+    >>> split_on_operators(['-', 'status=finished'])
+    [(None, []), ('-', ['status=finished'])]
+    """
+
+    groups = [(None, [])]
+
+    for a in args:
+
+        if a in bag_operators:
+            groups.append((a, []))
+
+        else:
+            groups[-1][1].append(a)
+
+    return groups
+
+
 def run_hook(pitzdir, hookscript):
 
     """
     Run pitzdir/hooks/hookscript, passing in the pitzdir as $1.
     """
 
+    import subprocess
+
     try:
         subprocess.call(
             [os.path.join(pitzdir, 'hooks', hookscript), pitzdir])
@@ -0,0 +1,197 @@
+# vim: set expandtab ts=4 sw=4 filetype=python:
+
+"""
+The cold tier of a pitzdir: tasks that got finished or abandoned a
+while ago, along with their comments and activities.
+
+I'm just a pack (see pitz.packfile) with my own filenames, so the
+project can leave me on disk until something really needs what's in
+me, like a query for finished tasks or a frag that isn't in the hot
+set.
+
+Next to the pack index I keep one more small file, with one line per
+pointer held by an archived entity::
+
+    <source uuid> <attribute> <target uuid>
+
+That's enough for the project to keep counting archived tasks toward
+their milestones and components, and to know when a question about
+some entity has an answer in here, without reading any yaml.
+"""
+
+from __future__ import with_statement
+
+import os
+
+from pitz.packfile import PackFile
+from pitz.refindex import targets
+
+import pitz
+
+uuid = pitz.lazy_import('uuid')
+yaml = pitz.lazy_import('yaml')
+
+
+class Archive(PackFile):
+    """
+    Read and write the entities archived out of a pitzdir.
+
+    >>> import tempfile
+    >>> from pitz.entity import Entity
+    >>> a = Archive(tempfile.mkdtemp())
+    >>> t = Entity(title='archived entity')
+    >>> c = Entity(title='archived comment', entity=t)
+    >>> offsets = a.append_many([t, c])
+    >>> index_path = a.save_index()
+    >>> a.referrers(t, 'entity') == set([c.uuid])
+    True
+    >>> Archive(a.pathname).referrers(t.uuid, 'entity') == set([c.uuid])
+    True
+    """
+
+    data_filename = 'archive.pack'
+    index_filename = 'archive.idx'
+    refs_filename = 'archive.refs'
+
+    def __init__(self, pathname):
+
+        self.refs_path = os.path.join(pathname, self.refs_filename)
+
+        # source uuid -> attribute -> set of target uuids.
+        self.pointers = dict()
+
+        # target uuid -> attribute -> set of source uuids.
+        self.pointed_at = dict()
+
+        super(Archive, self).__init__(pathname)
+
+        if os.path.isfile(self.refs_path):
+            self.load_refs()
+
+        elif self.offsets:
+            self.rebuild_refs()
+
+    def _point(self, source, attr, target):
+
+        self.pointers.setdefault(source, dict())\
+        .setdefault(attr, set()).add(target)
+
+        self.pointed_at.setdefault(target, dict())\
+        .setdefault(attr, set()).add(source)
+
+    def _unpoint(self, source):
+
+        for attr, ts in self.pointers.pop(source, dict()).items():
+
+            for t in ts:
+
+                by_attr = self.pointed_at.get(t, dict())
+                by_attr.get(attr, set()).discard(source)
+
+                if attr in by_attr and not by_attr[attr]:
+                    del by_attr[attr]
+
+                if t in self.pointed_at and not by_attr:
+                    del self.pointed_at[t]
+
+    def _remember_pointers(self, e):
+
+        self._unpoint(e.uuid)
+
+        for attr in e:
+
+            if attr == 'uuid':
+                continue
+
+            for t in targets(e.get(attr)):
+                self._point(e.uuid, attr, t)
+
+    def _forget(self, u):
+
+        super(Archive, self)._forget(u)
+        self._unpoint(uuid.UUID(u))
+
+    def append_many(self, entities):
+
+        entities = list(entities)
+        offsets = super(Archive, self).append_many(entities)
+
+        for e in entities:
+            self._remember_pointers(e)
+
+        return offsets
+
+    def type_of(self, key):
+        """
+        Return the type of the archived entity with uuid or frag key.
+        """
+
+        return self.offsets[self._uuid_for(key)][1]
+
+    def referrers(self, e, attr):
+        """
+        Return the uuids of archived entities whose attr points at e.
+        """
+
+        return self.pointed_at.get(getattr(e, 'uuid', e), dict())\
+        .get(attr, set())
+
+    def load_refs(self):
+
+        self.pointers.clear()
+        self.pointed_at.clear()
+
+        with open(self.refs_path) as f:
+            for line in f:
+                if line.strip():
+                    source, attr, target = line.split()
+                    self._point(uuid.UUID(source), attr, uuid.UUID(target))
+
+        return self
+
+    def rebuild_refs(self):
+        """
+        Read every archived record to find out what it points at.  This
+        is slow, but I only need it when the refs file went missing.
+        """
+
+        self.pointers.clear()
+        self.pointed_at.clear()
+
+        for u, type, data in self._walk_records():
+
+            d = yaml.load(data) or dict()
+
+            for attr, val in d.items():
+
+                if attr != 'uuid':
+                    for t in targets(val):
+                        self._point(uuid.UUID(u), attr, t)
+
+        return self
+
+    def save_index(self):
+        """
+        Write out the pack index and my refs file.
+        """
+
+        index_path = super(Archive, self).save_index()
+
+        tmp_path = self.refs_path + '.tmp'
+
+        with open(tmp_path, 'w') as f:
+            for source, by_attr in sorted(self.pointers.items()):
+                for attr, ts in sorted(by_attr.items()):
+                    for t in sorted(ts):
+                        f.write('%s %s %s\n' % (source, attr, t))
+
+        os.rename(tmp_path, self.refs_path)
+
+        return index_path
+
+    def remove(self):
+
+        super(Archive, self).remove()
+
+        if os.path.exists(self.refs_path):
+            os.unlink(self.refs_path)
@@ -7,19 +7,19 @@ Bags and Bag subclasses.
 from __future__ import with_statement
 
 import collections
-import csv
+import functools
+import heapq
 import logging
 import os
-import subprocess
-from uuid import UUID, uuid4
-from urllib import quote_plus
-
-import clepy
-import jinja2
-import tempita
+from datetime import datetime
 
 import pitz
 
+# These are slow to import and lots of scripts never touch them.
+clepy = pitz.lazy_import('clepy')
+jinja2 = pitz.lazy_import('jinja2')
+tempita = pitz.lazy_import('tempita')
+
 log = logging.getLogger('pitz.bag')
 
 # Not too happy about this code, but I don't know how to make this work
@@ -30,6 +30,214 @@ else:
     BagSuperclass = object
 
 
+def argv_chunks(cmd, args, max_length=None):
+    """
+    Yield lists of args, so that cmd plus each list fits on one command
+    line.
+
+    >>> list(argv_chunks(['grep', 'x'], ['a', 'b', 'c'], 45))
+    [['a', 'b'], ['c']]
+    """
+
+    if max_length is None:
+
+        try:
+            arg_max = os.sysconf('SC_ARG_MAX')
+        except (AttributeError, ValueError, OSError):
+            arg_max = 131072
+
+        # The environment lives in the same space as the arguments, and
+        # I'd rather be safe than sorry, so only use half.
+        max_length = arg_max / 2 - sum(
+            len(k) + len(v) + 2 + 8 for k, v in os.environ.items())
+
+    # Every argument costs its length, a NUL, and a pointer.
+    def cost(a):
+        return len(a) + 1 + 8
+
+    base = sum(cost(a) for a in cmd)
+
+    chunk, length = [], base
+
+    for a in args:
+
+        if chunk and length + cost(a) > max_length:
+            yield chunk
+            chunk, length = [], base
+
+        chunk.append(a)
+        length += cost(a)
+
+    if chunk:
+        yield chunk
+
+
+def number_of_cpus():
+
+    try:
+        return max(1, os.sysconf('SC_NPROCESSORS_ONLN'))
+    except (AttributeError, ValueError, OSError):
+        return 1
+
+
+def grep_files(cmd, files, workers=None, ordered=False):
+    """
+    Run cmd (something like grep -l) against files, split into chunks
+    that fit on a command line, with up to workers chunks running at
+    once.
+
+    I'm a generator, and I yield each line of output as soon as it
+    shows up.  If you stop early, call close() on me so I can kill the
+    processes still running.
+
+    Set ordered to True to get the lines in the same order as files.
+    grep works through each chunk in order, so I pass along the lines
+    from the oldest chunk still running right away, and only hold back
+    the ones from later chunks until it finishes.
+    """
+
+    import select
+    import subprocess
+
+    chunks = argv_chunks(cmd, files)
+    workers = workers or number_of_cpus()
+
+    # Maps file descriptors to (process, leftover partial line, chunk
+    # number).
+    running = dict()
+
+    # When ordered, the lines from chunks after the oldest one running,
+    # and the chunks that finished, by chunk number.
+    held = dict()
+    finished = set()
+    started = oldest = 0
+
+    try:
+
+        while True:
+
+            while len(running) < workers:
+
+                chunk = next(chunks, None)
+
+                if chunk is None:
+                    break
+
+                p = subprocess.Popen(cmd + chunk, stdout=subprocess.PIPE)
+                running[p.stdout.fileno()] = (p, '', started)
+                held[started] = []
+                started += 1
+
+            if not running:
+                break
+
+            for fd in select.select(list(running), [], [])[0]:
+
+                p, leftover, n = running[fd]
+                data = os.read(fd, 65536)
+
+                if data:
+                    lines = (leftover + data).split('\n')
+                    running[fd] = (p, lines.pop(), n)
+
+                else:
+
+                    lines = [leftover] if leftover else []
+
+                    p.stdout.close()
+                    p.wait()
+                    del running[fd]
+
+                if not ordered or n == oldest:
+
+                    for line in lines:
+                        yield line
+
+                else:
+                    held[n].extend(lines)
+
+                if not data:
+
+                    finished.add(n)
+
+                    while oldest in finished:
+
+                        del held[oldest]
+                        oldest += 1
+
+                        for line in held.get(oldest, ()):
+                            yield line
+
+                        if oldest in held:
+                            held[oldest] = []
+
+    finally:
+
+        for p, leftover, n in running.values():
+
+            if p.poll() is None:
+                p.kill()
+
+            p.stdout.close()
+            p.wait()
+
+
+def chunked(pieces, size=8192):
+    """
+    Gather pieces of text, like the ones a jinja2 template's generate
+    method yields, into utf8 strings of about size bytes.
+
+    >>> list(chunked([u'ab', u'cd', u'e'], size=4))
+    ['abcd', 'e']
+    """
+
+    buf, length = [], 0
+
+    for piece in pieces:
+
+        if isinstance(piece, unicode):
+            piece = piece.encode('utf8')
+
+        buf.append(piece)
+        length += len(piece)
+
+        if length >= size:
+            yield ''.join(buf)
+            buf, length = [], 0
+
+    if buf:
+        yield ''.join(buf)
+
+
+def merge_ordered(xs, ys, cmp):
+    """
+    Merge two lists already sorted with cmp into one sorted list, in
+    one pass.
+
+    >>> merge_ordered([1, 4, 6], [2, 3, 7], cmp)
+    [1, 2, 3, 4, 6, 7]
+    """
+
+    merged = []
+    i = j = 0
+
+    while i < len(xs) and j < len(ys):
+
+        # Ties go to xs, like a stable sort of xs + ys would do.
+        if cmp(ys[j], xs[i]) < 0:
+            merged.append(ys[j])
+            j += 1
+
+        else:
+            merged.append(xs[i])
+            i += 1
+
+    merged.extend(xs[i:])
+    merged.extend(ys[j:])
+
+    return merged
+
+
 class Bag(BagSuperclass):
     """
     Bags act like lists with a few extra methods.
@@ -53,11 +261,25 @@ class Bag(BagSuperclass):
 
         self._elements = list()
 
+        # What _stamp said and the order method I used when I last
+        # sorted myself.  See top.
+        self._ordered = None
+
+        # Maps uuids to positions in _elements.  Anything that moves
+        # entities around sets this to None, and index rebuilds it.
+        self._positions = None
+
+        # Bumped by note_change, so anybody caching what I look like
+        # can tell when to throw it out.
+        self.generation = 0
+        self.last_change = datetime.utcnow()
+
         if uuid:
             self.uuid = uuid
 
         # Make a unique uuid if we didn't get one.
         if not uuid:
+            from uuid import uuid4
             self.uuid = uuid4()
 
         # These will get populated in self.append.
@@ -65,6 +287,11 @@ class Bag(BagSuperclass):
         self.entities_by_frag = dict()
         self.entities_by_yaml_filename = dict()
 
+        # Maps (class, title) to an entity.  Entity.__new__ looks in
+        # here so two bags can hold different entities with the same
+        # title.
+        self.entities_by_title = dict()
+
         for e in entities:
             self.append(e, rerun_sort_after_append=False)
 
@@ -75,15 +302,142 @@ class Bag(BagSuperclass):
         self._setup_jinja()
 
     def __add__(self, other):
+        """
+        Same as self | other, but with the old title.
+        """
+
+        b = self | other
+        b.title = "%s and %s" % (self.title, other.title)
+
+        return b
+
+    # Every change to any entity, anywhere, bumps this.  Entities only
+    # tell their own project when they change, so a plain bag or a
+    # view can't count on its generation to notice that a task in it
+    # got a new pscore.
+    entity_changes = 0
+
+    @classmethod
+    def note_entity_change(cls):
+        Bag.entity_changes += 1
+
+    def _stamp(self):
+        return self.generation, Bag.entity_changes
+
+    def _mark_ordered(self, order_method=None):
+        """
+        Remember that my list is in order by order_method, or else my
+        own order_method, until anything changes.
+        """
+
+        self._ordered = self._stamp(), order_method or self.order_method
+
+    def _is_ordered(self, order_method=None):
+        """
+        Return True if nothing changed since I last sorted myself with
+        order_method, or else my own order_method.
+
+        >>> from pitz.entity import Entity
+        >>> e1, e2 = Entity(title='stamp 1', pscore=1), Entity(title='stamp 2')
+        >>> b = Bag(entities=[e1, e2])
+        >>> b._is_ordered()
+        True
+        >>> e2['pscore'] = 2
+        >>> b._is_ordered()
+        False
+        """
+
+        return getattr(self, '_ordered', None) \
+        == (self._stamp(), order_method or self.order_method)
+
+    def _combined(self, title, entities, ordered):
+        """
+        Return a new bag like me holding entities.  If ordered is True,
+        entities are already in my order, so I skip the sort.
+        """
+
+        b = Bag(title=title, pathname=self.pathname,
+            order_method=self.order_method, shell_mode=self.shell_mode)
+
+        for e in entities:
+            b.append(e, rerun_sort_after_append=False)
+
+        if ordered:
+            b._mark_ordered()
+
+        else:
+            b.order()
+
+        return b
+
+    def __or__(self, other):
+        """
+        Return a new bag with everything in me or in other, in my
+        order.
+
+        When we're both already sorted my way, I just merge our lists
+        instead of sorting them all over again.
+
+        >>> from pitz.entity import Entity
+        >>> by_title = pitz.by_whatever('by_title', 'title')
+        >>> a, b, c = [Entity(title='or %s' % x) for x in 'abc']
+        >>> b1 = Bag(entities=[a, c], order_method=by_title)
+        >>> b2 = Bag(entities=[b, c], order_method=by_title)
+        >>> [e.title for e in b1 | b2]
+        ['or a', 'or b', 'or c']
+        """
 
         if not isinstance(other, Bag):
-            raise TypeError("Can't add %s" % other)
+            raise TypeError("Can't combine %s with %s" % (self, other))
+
+        extra = [e for e in other._elements if e not in self]
 
-        title = "%s and %s" % (self.title, other.title)
+        ordered = self._is_ordered() and other._is_ordered(self.order_method)
+
+        if ordered:
+            entities = merge_ordered(self._elements, extra,
+                self.order_method)
+
+        else:
+            entities = self._elements + extra
 
-        return Bag(
-            title=title,
-            entities=(list(self) + list(other)))
+        return self._combined("%s or %s" % (self.title, other.title),
+            entities, ordered)
+
+    def __and__(self, other):
+        """
+        Return a new bag with just what's in me and also in other.
+
+        >>> from pitz.entity import Entity
+        >>> a, b, c = [Entity(title='and %s' % x) for x in 'abc']
+        >>> [e.title for e in Bag(entities=[a, b]) & Bag(entities=[b, c])]
+        ['and b']
+        """
+
+        if not isinstance(other, Bag):
+            raise TypeError("Can't combine %s with %s" % (self, other))
+
+        # A subsequence of a sorted list is still sorted.
+        return self._combined("%s and also %s" % (self.title, other.title),
+            [e for e in self._elements if e in other],
+            self._is_ordered())
+
+    def __sub__(self, other):
+        """
+        Return a new bag with what's in me but not in other.
+
+        >>> from pitz.entity import Entity
+        >>> a, b, c = [Entity(title='sub %s' % x) for x in 'abc']
+        >>> [e.title for e in Bag(entities=[a, b]) - Bag(entities=[b, c])]
+        ['sub a']
+        """
+
+        if not isinstance(other, Bag):
+            raise TypeError("Can't combine %s with %s" % (self, other))
+
+        return self._combined("%s without %s" % (self.title, other.title),
+            [e for e in self._elements if e not in other],
+            self._is_ordered())
 
     def walk_through_elements(self):
         for el in self._elements:
@@ -93,21 +447,65 @@ class Bag(BagSuperclass):
         return self.walk_through_elements()
 
     def __contains__(self, element):
-        return element in self._elements
+
+        e = self.entities_by_uuid.get(getattr(element, 'uuid', None))
+
+        return e is not None and (e is element or e == element)
 
     def index(self, value):
-        return self._elements.index(value)
+        """
+        Return where value is in me.  After anything moves, the first
+        call costs one pass over me, and then they're all free until
+        something moves again.
+
+        >>> from pitz.entity import Entity
+        >>> by_title = pitz.by_whatever('by_title', 'title')
+        >>> e1, e2 = Entity(title='index 1'), Entity(title='index 2')
+        >>> b = Bag(entities=[e1, e2], order_method=by_title)
+        >>> b.index(e2)
+        1
+        >>> b.index(Entity(title='not in the bag')) # doctest: +ELLIPSIS
+        Traceback (most recent call last):
+            ...
+        ValueError: <pitz.Entity ... not in the bag> isn't in this bag
+        """
+
+        if value not in self:
+            raise ValueError("%s isn't in this bag" % value)
+
+        positions = getattr(self, '_positions', None)
+
+        if positions is None:
+
+            positions = self._positions = dict(
+                (e.uuid, i) for i, e in enumerate(self._elements))
+
+        return positions[value.uuid]
 
     def _setup_jinja(self):
 
+        # Building the environment means importing jinja2, so I wait
+        # until somebody asks for self.e.
+        self._e = None
+
+    @property
+    def e(self):
+
+        if getattr(self, '_e', None) is None:
+            self._e = self._build_jinja_environment()
+
+        return self._e
+
+    def _build_jinja_environment(self):
+
         # Figure out the path to the jinja2templates.
         jinja2dir = os.path.join(
             os.path.dirname(__file__), 'jinja2templates')
 
-        self.e = jinja2.Environment(
+        e = jinja2.Environment(
             loader=jinja2.FileSystemLoader(jinja2dir))
 
-        self.e.globals.update({
+        e.globals.update({
             'clepy': clepy,
             'isinstance': isinstance,
             'hasattr': hasattr,
@@ -118,6 +516,8 @@ class Bag(BagSuperclass):
             'looper':tempita.looper,
         })
 
+        return e
+
 
     def to_csv(self, filepath, *columns):
         """
@@ -125,6 +525,8 @@ class Bag(BagSuperclass):
         AND the UUID at the very end.
         """
 
+        import csv
+
         columns = columns + ('uuid', )
 
         w = csv.writer(open(filepath, 'w'))
@@ -151,12 +553,15 @@ class Bag(BagSuperclass):
             return self.by_uuid(i)
 
     def __delitem__(self, element):
+        self._ordered = self._positions = None
         return self._elements.__delitem__(element)
 
     def __setitem__(self, index, element):
+        self._ordered = self._positions = None
         return self._elements.__setitem__(index, element)
 
     def insert(self, index, element):
+        self._ordered = self._positions = None
         return self._elements.insert(index, element)
 
     def __len__(self):
@@ -164,15 +569,12 @@ class Bag(BagSuperclass):
 
     def __getslice__(self, i, j):
 
-        entities = self._elements.__getslice__(i, j)
-
-        return Bag(title='slice from %s' % self.title,
-            pathname=self.pathname, entities=entities,
-            order_method=self.order_method, load_yaml_files=False,
-            jinja_template=self.jinja_template,
-            shell_mode=self.shell_mode)
+        return BagView(self, self._elements.__getslice__(i, j),
+            title='slice from %s' % self.title,
+            ordered=self._is_ordered())
 
     def sort(self, cmp=None, key=None, reverse=False):
+        self._positions = None
         return self._elements.sort(cmp, key, reverse)
 
     def order(self, order_method=None):
@@ -187,10 +589,65 @@ class Bag(BagSuperclass):
         if not self.order_method:
             raise ValueError("I need a method to order entities!")
 
-        self.sort(cmp=self.order_method)
+        # Sort a copy and swap it in, because list.sort empties the list
+        # while it works, and webapp threads might be reading me.
+        self._elements = sorted(self._elements, cmp=self.order_method)
+        self._mark_ordered()
+        self._positions = None
 
         return self
 
+    def top(self, k, order_method=None, predicate=None):
+        """
+        Return a new bag with the first k entities, ordered by
+        order_method or else by my own order_method.  If you pass a
+        predicate, I skip the entities it says no to.
+
+        When nothing changed since I last sorted myself the same way,
+        I just read off the front of my list.  Otherwise I keep a heap
+        of k entities, so I never sort the whole bag to hand back a few
+        things.
+
+        >>> from pitz.entity import Entity
+        >>> b = Bag(entities=[Entity(title='top %d' % i, pscore=i)
+        ...     for i in range(10)])
+        >>> [e['pscore'] for e in b.top(3)]
+        [9, 8, 7]
+        >>> [e['pscore'] for e in b.top(2, predicate=lambda e: e['pscore'] % 2)]
+        [9, 7]
+        """
+
+        order_method = order_method or self.order_method
+
+        if not order_method:
+            raise ValueError("I need a method to order entities!")
+
+        if self._is_ordered(order_method):
+
+            best = []
+
+            for e in self._elements:
+
+                if len(best) >= k:
+                    break
+
+                if predicate is None or predicate(e):
+                    best.append(e)
+
+        else:
+
+            candidates = self._elements
+
+            if predicate is not None:
+                candidates = (e for e in candidates if predicate(e))
+
+            best = heapq.nsmallest(k, candidates,
+                key=functools.cmp_to_key(order_method))
+
+        return Bag(title='top %d from %s' % (k, self.title),
+            pathname=self.pathname, entities=best,
+            order_method=order_method, shell_mode=self.shell_mode)
+
     def matches_dict(self, **d):
         """
         Return a new bag by filtering this bag based on key-value pairs
@@ -211,23 +668,35 @@ class Bag(BagSuperclass):
         False
         """
 
-        matches = [e for e in self if e.matches_dict(**d)]
-
-        return Bag(title='subset of %s' % self.title,
-            pathname=self.pathname, entities=matches,
-            order_method=self.order_method, load_yaml_files=False,
-            jinja_template=self.jinja_template,
-            shell_mode=self.shell_mode)
+        return BagView(self, [e for e in self if e.matches_dict(**d)],
+            title='subset of %s' % self.title,
+            ordered=self._is_ordered(),
+            filters=[('matches_dict', d)])
 
     def does_not_match_dict(self, **d):
 
-        matches = [e for e in self if e.does_not_match_dict(**d)]
+        return BagView(self,
+            [e for e in self if e.does_not_match_dict(**d)],
+            title='subset of %s' % self.title,
+            ordered=self._is_ordered(),
+            filters=[('does_not_match_dict', d)])
 
-        return Bag(title='subset of %s' % self.title,
-            pathname=self.pathname, entities=matches,
-            order_method=self.order_method, load_yaml_files=False,
-            jinja_template=self.jinja_template,
-            shell_mode=self.shell_mode)
+    def pointing_at(self, e, attr, archived=True, **d):
+        """
+        Return a new bag of the entities whose attr points at e and
+        that match d.  Bags don't have archives, so I ignore archived,
+        but see Project.pointing_at.
+
+        >>> from pitz.entity import Entity
+        >>> t = Entity(title='pointed at')
+        >>> c = Entity(title='pointer', entity=t)
+        >>> Bag(entities=[t, c]).pointing_at(t, 'entity').length
+        1
+        """
+
+        d[attr] = e
+
+        return self.matches_dict(**d)
 
     def __call__(self, **d):
         """
@@ -273,23 +742,117 @@ class Bag(BagSuperclass):
         if e.uuid not in self.entities_by_uuid:
 
             self._elements.append(e)
+
+            if getattr(self, '_positions', None) is not None:
+                self._positions[e.uuid] = len(self._elements) - 1
+
             self.entities_by_uuid[e.uuid] = e
             self.entities_by_frag[e.frag] = e
             self.entities_by_yaml_filename[e.yaml_filename] = e
+            self.entities_by_title.setdefault((e.__class__, e.title), e)
+
+            self.note_change(e)
 
             if rerun_sort_after_append:
                 self.sort(self.order_method)
+                self._mark_ordered()
 
         return self
 
     def pop(self, index=-1):
 
         e = self._elements.pop(index)
+
+        # Popping off the end doesn't move anybody else.
+        if getattr(self, '_positions', None) is not None \
+        and index in (-1, len(self._elements)):
+
+            self._positions.pop(e.uuid, None)
+
+        else:
+            self._positions = None
+
+        self._unindex(e)
+
+        return e
+
+    def _unindex(self, e):
+
         self.entities_by_uuid.pop(e.uuid)
         self.entities_by_frag.pop(e.frag)
         self.entities_by_yaml_filename.pop(e.yaml_filename)
 
-        return e
+        key = e.__class__, e.title
+
+        if self.entities_by_title.get(key) is e:
+            del self.entities_by_title[key]
+
+        self.note_change(e)
+
+    def remove_many(self, entities):
+        """
+        Take all of entities out of me with one pass over my list, and
+        return the ones I really had.  Whatever's left stays in the
+        same order.
+
+        >>> from pitz.entity import Entity
+        >>> by_title = pitz.by_whatever('by_title', 'title')
+        >>> es = [Entity(title='remove many %d' % i) for i in range(4)]
+        >>> b = Bag(entities=es, order_method=by_title)
+        >>> len(b.remove_many([es[0], es[2], Entity(title='stranger')]))
+        2
+        >>> [e.title for e in b]
+        ['remove many 1', 'remove many 3']
+        """
+
+        doomed, uuids = [], set()
+
+        for e in entities:
+            if e in self and e.uuid not in uuids:
+                doomed.append(e)
+                uuids.add(e.uuid)
+
+        if not doomed:
+            return doomed
+
+        was_ordered = self._is_ordered()
+
+        self._elements = [e for e in self._elements if e.uuid not in uuids]
+        self._positions = None
+
+        for e in doomed:
+            self._unindex(e)
+
+        if was_ordered:
+            self._mark_ordered()
+
+        return doomed
+
+    def retitle(self, e, old_title):
+        """
+        Update my title lookups after e's title changes from old_title.
+        """
+
+        old_key = e.__class__, old_title
+
+        if self.entities_by_title.get(old_key) is e:
+            del self.entities_by_title[old_key]
+
+        self.entities_by_title.setdefault((e.__class__, e.title), e)
+
+    def note_change(self, e=None):
+        """
+        Record that I, or entity e inside me, changed.
+
+        >>> b = Bag()
+        >>> g = b.generation
+        >>> b.note_change()
+        >>> b.generation == g + 1
+        True
+        """
+
+        self.generation = getattr(self, 'generation', 0) + 1
+        self.last_change = datetime.utcnow()
 
     @property
     def title_underline(self):
@@ -302,6 +865,8 @@ class Bag(BagSuperclass):
     @property
     def html_filename(self):
 
+        from urllib import quote_plus
+
         return self._html_filename \
         or "%s.html" % quote_plus(self.title.lower())
 
@@ -317,34 +882,111 @@ class Bag(BagSuperclass):
     def shell_mode(self):
         return getattr(self, '_shell_mode', False)
 
-    @property
-    def colorized_detailed_view(self):
+    # Maps the views that come out of a template to the template and
+    # whether it uses color.  These are the views stream can yield a
+    # piece at a time.
+    template_views = dict(
+        detailed_view=('bag_detailed_view.txt', False),
+        colorized_detailed_view=('colorized_bag_detailed_view.txt', True),
+    )
+
+    def _view_template(self, view):
+        """
+        Return the template for view and everything to render it with.
+        """
+
+        if view == 'html':
+            return self.e.get_template(self.jinja_template), \
+            self._html_context()
 
         self.order()
 
         self._setup_jinja()
 
-        t = self.e.get_template('colorized_bag_detailed_view.txt')
+        filename, color = self.template_views[view]
 
-        return t.render(bag=self,
-            color=True,
+        return self.e.get_template(filename), dict(bag=self,
             entities=self,
+            color=color,
             shell_mode=self.shell_mode,
             entity_view='summarized_view')
 
+    @property
+    def colorized_detailed_view(self):
+
+        t, context = self._view_template('colorized_detailed_view')
+        return t.render(**context)
+
     @property
     def detailed_view(self):
 
+        t, context = self._view_template('detailed_view')
+        return t.render(**context)
+
+    def stream(self, view='detailed_view', chunk_size=8192):
+        """
+        Yield the same text as getattr(self, view), in utf8 chunks of
+        about chunk_size bytes, so the webapp can start sending a big
+        bag before it's done drawing it.
+
+        >>> from pitz.entity import Entity
+        >>> b = Bag(title='streamed', entities=[Entity(title='a')])
+        >>> ''.join(b.stream()) == b.detailed_view.encode('utf8')
+        True
+        """
+
+        if view == 'html' or view in self.template_views:
+            t, context = self._view_template(view)
+            pieces = t.generate(**context)
+
+        else:
+            pieces = [getattr(self, view)]
+
+        return chunked(pieces, chunk_size)
+
+    def page(self, offset=0, limit=None):
+        """
+        Return a bag with at most limit of my entities, starting at
+        offset.
+
+        >>> from pitz.entity import Entity
+        >>> b = Bag(title='numbers', entities=[
+        ...     Entity(title='page %d' % i) for i in range(5)])
+        >>> b.page(1, 2).title
+        'numbers (2-3 of 5)'
+        >>> len(b.page(4, 10))
+        1
+
+        Asking for everything gets me back.
+
+        >>> b.page() is b
+        True
+
+        Pages draw themselves with my template.
+
+        >>> b.jinja_template = 'project.html'
+        >>> b.page(1, 2).jinja_template
+        'project.html'
+        """
+
+        if not offset and limit is None:
+            return self
+
         self.order()
 
-        self._setup_jinja()
+        end = None if limit is None else offset + limit
+        entities = self._elements[offset:end]
+
+        b = Bag(
+            title='%s (%d-%d of %d)' % (self.title, offset + 1,
+                offset + len(entities), len(self)),
+            pathname=self.pathname, entities=entities,
+            order_method=self.order_method,
+            shell_mode=self.shell_mode)
 
-        t = self.e.get_template('bag_detailed_view.txt')
+        b.jinja_template = self.jinja_template
 
-        return t.render(bag=self, entities=self,
-            color=False,
-            shell_mode=self.shell_mode,
-            entity_view='summarized_view')
+        return b
 
     def custom_view(self, entity_view='summarized_view', color=False):
         """
@@ -465,42 +1107,108 @@ class Bag(BagSuperclass):
             [(e, c) for e, c in dd.items()],
             key=lambda t: t[1], reverse=True)
 
-    def grep(self, phrase, ignore_case=False):
+    @property
+    def textindex(self):
         """
-        Return a new bag, filtering the entities in this bag by the ones
-        that match the results of::
+        Return the text index for the project that my entities belong
+        to, or None.
+        """
+
+        for e in self:
+
+            # Entities put straight into a plain bag think the bag is
+            # their project, and asking me again would never end.
+            if e.project is not self:
+                return getattr(e.project, 'textindex', None)
+
+    def grep(self, phrase, ignore_case=False, limit=None):
+        """
+        Return a new bag with just the entities in this bag that match
+        phrase.  If you give me a limit, I return the first that many
+        in my order.
+
+        When the project has a text index (see pitz.textindex) I use
+        it, which means I look at titles, descriptions, and comments,
+        and match whole words, "quoted phrases", and prefix* words.
+
+        Otherwise, I filter the entities by the ones that match the
+        results of::
 
             $ grep phrase <files>
 
         where <files> are the files for all the entities in this bag.
-
-        This function depends (of course) on files living in the
-        filesystem and on a command-line program named grep.
+        That depends (of course) on files living in the filesystem and
+        on a command-line program named grep.  See grep_files for how
+        I keep the command lines short.  With a limit, I hand grep the
+        files in my order, and stop once I have enough.
         """
 
+        ti = self.textindex
+
+        if ti is not None:
+
+            matches = ti.search(phrase, ignore_case)
+
+            entities = [e for e in self if str(e.uuid) in matches]
+
+            if limit:
+                entities = self._first(entities, limit)
+
+            return Bag(title="entities matching grep %s" % phrase,
+                pathname=self.pathname,
+                order_method=self.order_method,
+                entities=entities)
+
         if not self.pathname:
             raise ValueError("Sorry, I need a pathname first.")
 
-        files = [os.path.join(self.pathname, f) for f in
-            self.entities_by_yaml_filename]
+        if limit and not self._is_ordered():
+            candidates = sorted(self._elements, cmp=self.order_method)
+
+        else:
+            candidates = self._elements
+
+        files = [os.path.join(self.pathname, e.yaml_filename)
+            for e in candidates]
 
         if not files:
             return self
 
         if ignore_case:
-            cmd = ['grep', '-l', '-i', phrase]
+            cmd = ['grep', '-l', '-i', '-e', phrase]
         else:
-            cmd = ['grep', '-l', phrase]
+            cmd = ['grep', '-l', '-e', phrase]
+
+        entities = []
+
+        matching_files = grep_files(cmd, files, ordered=bool(limit))
+
+        try:
+
+            for filepath in matching_files:
 
-        cmd.extend(files)
+                entities.append(self.entities_by_yaml_filename[
+                    os.path.basename(filepath)])
+
+                if limit and len(entities) >= limit:
+                    break
+
+        finally:
+            matching_files.close()
 
         return Bag(title="entities matching grep %s" % phrase,
             pathname=self.pathname,
             order_method=self.order_method,
+            entities=entities)
+
+    def _first(self, entities, k):
+        """
+        Return the first k of entities in my order, without sorting
+        all of them.
+        """
 
-            entities=[
-                self.entities_by_yaml_filename[os.path.basename(s.strip())]
-                for s in subprocess.Popen(cmd, stdout=subprocess.PIPE).stdout])
+        return heapq.nsmallest(k, entities,
+            key=functools.cmp_to_key(self.order_method))
 
     def to_html(self, filepath):
         """
@@ -512,14 +1220,19 @@ class Bag(BagSuperclass):
 
     def __getstate__(self):
 
-        if hasattr(self, 'e'):
-            delattr(self, 'e')
+        self.__dict__.pop('_e', None)
+        self.__dict__.pop('_positions', None)
 
         return self.__dict__
 
     def __setstate__(self, d):
 
         self.__dict__.update(d)
+
+        # Pickles from before Bags had title lookups.
+        if 'entities_by_title' not in d:
+            self.entities_by_title = dict()
+
         self._setup_jinja()
 
     @property
@@ -528,9 +1241,14 @@ class Bag(BagSuperclass):
         Return a string containing this bag formatted as HTML.
         """
 
-        tmpl = self.e.get_template(self.jinja_template)
+        t, context = self._view_template('html')
+        return t.render(**context)
+
+    def _html_context(self):
 
-        return tmpl.render(title=self.title, bag=self,
+        from uuid import UUID
+
+        return dict(title=self.title, bag=self,
             isinstance=isinstance, UUID=UUID)
 
     @property
@@ -549,3 +1267,262 @@ class Bag(BagSuperclass):
 
         return self.e.get_template(
             'by_owner_view.txt').render(bag=self)
+
+
+class BagView(Bag):
+    """
+    A read-only selection out of another bag.
+
+    I hold a list of some of my parent's entities and nothing else.
+    Lookups by uuid or frag go through my parent's dictionaries, and I
+    render with my parent's jinja environment, so making me costs one
+    pass over the selection.
+
+    The first time anybody adds or removes an entity, I turn into a
+    real Bag with my own dictionaries, and my parent never notices.
+    Sorting only moves my own list around, so I stay a view.
+
+    When I came from filters, I remember them, so that a filter on me
+    that makes a project load its archive (see Project.wants_archive)
+    can pick me out of the project again, archived entities and all.
+
+    >>> from pitz.entity import Entity
+    >>> a, b = Entity(title='view a'), Entity(title='view b')
+    >>> parent = Bag(entities=[a, b])
+    >>> v = parent.matches_dict(title='view a')
+    >>> type(v).__name__, a in v, b in v
+    ('BagView', True, False)
+    >>> v.by_uuid(b.uuid) is b.uuid
+    True
+    >>> v.append(b) is v
+    True
+    >>> type(v).__name__, b in v, len(parent)
+    ('Bag', True, 2)
+    """
+
+    def __init__(self, parent, entities, title='', ordered=False,
+        filters=None):
+
+        # Views of views still share the dictionaries of the real bag
+        # underneath.
+        if isinstance(parent, BagView):
+
+            if parent.filters is None:
+                filters = None
+
+            elif filters is not None:
+                filters = parent.filters + filters
+
+            parent = parent.parent
+
+        self.parent = parent
+
+        # (method name, dictionary) pairs that pick me out of my
+        # parent, or None when I'm a slice or something else.
+        self.filters = filters
+
+        self.title = title
+        self.pathname = parent.pathname
+        self.order_method = parent.order_method
+        self._html_filename = None
+        self._shell_mode = parent.shell_mode
+
+        self._elements = list(entities)
+        self._uuids = set(e.uuid for e in self._elements)
+
+        self._ordered = None
+        self._positions = None
+        self.generation = 0
+        self.last_change = datetime.utcnow()
+
+        from uuid import uuid4
+        self.uuid = uuid4()
+
+        if ordered:
+            self._mark_ordered()
+
+        else:
+            self.order()
+
+    def _setup_jinja(self):
+        pass
+
+    @property
+    def e(self):
+        return self.parent.e
+
+    def __contains__(self, element):
+        return getattr(element, 'uuid', None) in self._uuids
+
+    def matches_dict(self, **d):
+
+        wants_archive = getattr(self.parent, 'wants_archive', None)
+
+        if self.filters is not None and wants_archive is not None \
+        and wants_archive(d):
+
+            self.parent.load_archive()
+
+            b = self.parent
+
+            for name, f in self.filters:
+                b = getattr(b, name)(**f)
+
+            view = b.matches_dict(**d)
+            view.title = 'subset of %s' % self.title
+
+            return view
+
+        return super(BagView, self).matches_dict(**d)
+
+    def by_uuid(self, obj):
+
+        # Not self.parent.by_uuid, because a project would go digging
+        # through its archive for something that can't be in me anyway.
+        found = Bag.by_uuid(self.parent, obj)
+
+        return found if found in self else obj
+
+    def by_frag(self, frag):
+
+        found = Bag.by_frag(self.parent, frag)
+
+        if found not in self:
+            raise KeyError(frag)
+
+        return found
+
+    def _lookup(self, name, key):
+
+        d = self.__dict__.get(name)
+
+        if d is None:
+            d = self.__dict__[name] = dict((key(e), e) for e in self)
+
+        return d
+
+    # Only for code that reads these dictionaries directly; my own
+    # methods use my parent's.
+
+    @property
+    def entities_by_uuid(self):
+        return self._lookup('_by_uuid', lambda e: e.uuid)
+
+    @property
+    def entities_by_frag(self):
+        return self._lookup('_by_frag', lambda e: e.frag)
+
+    @property
+    def entities_by_yaml_filename(self):
+        return self._lookup('_by_yaml_filename', lambda e: e.yaml_filename)
+
+    @property
+    def entities_by_title(self):
+
+        # Titles change, so I don't hang on to this one.
+        d = dict()
+
+        for e in self:
+            d.setdefault((e.__class__, e.title), e)
+
+        return d
+
+    def materialize(self):
+        """
+        Turn me into a plain Bag with my own dictionaries, and return
+        me.
+        """
+
+        elements, ordered = self._elements, self._is_ordered()
+
+        for attr in ('parent', 'filters', '_uuids', '_by_uuid',
+            '_by_frag', '_by_yaml_filename'):
+
+            self.__dict__.pop(attr, None)
+
+        self.__class__ = Bag
+
+        self._elements = list()
+        self.entities_by_uuid = dict()
+        self.entities_by_frag = dict()
+        self.entities_by_yaml_filename = dict()
+        self.entities_by_title = dict()
+
+        for e in elements:
+            self.append(e, rerun_sort_after_append=False)
+
+        if ordered:
+            self._mark_ordered()
+
+        Bag._setup_jinja(self)
+
+        return self
+
+    def append(self, e, rerun_sort_after_append=True):
+        return self.materialize().append(e, rerun_sort_after_append)
+
+    def pop(self, index=-1):
+        return self.materialize().pop(index)
+
+    def remove_many(self, entities):
+        return self.materialize().remove_many(entities)
+
+    def __delitem__(self, element):
+        return self.materialize().__delitem__(element)
+
+    def __setitem__(self, index, element):
+        return self.materialize().__setitem__(index, element)
+
+    def insert(self, index, element):
+        return self.materialize().insert(index, element)
+
+    def retitle(self, e, old_title):
+        pass
+
+    def __getstate__(self):
+        return self.materialize().__getstate__()
+
+
+class SearchResults(Bag):
+    """
+    A bag of entities in order by how well they matched a search, with
+    a snippet of the matching text for each one.
+    """
+
+    def __init__(self, scores=None, snippets=None, **kwargs):
+
+        # Both of these map entity uuids to stuff.
+        self.scores = scores or dict()
+        self.snippets = snippets or dict()
+
+        kwargs.setdefault('order_method', self.by_score)
+
+        super(SearchResults, self).__init__(**kwargs)
+
+    def by_score(self, e1, e2):
+        """
+        Best matches first.
+        """
+
+        return cmp(self.scores.get(e2.uuid, 0), self.scores.get(e1.uuid, 0))
+
+    def snippets_view(self, entity_view='summarized_view', color=False):
+        """
+        Show each entity with entity_view, with its snippet underneath.
+        """
+
+        lines = [self.title, '=' * len(self.title), '']
+
+        for e in self:
+
+            lines.append(e.custom_view(entity_view, color=color))
+
+            if self.snippets.get(e.uuid):
+                lines.append('    %s' % self.snippets[e.uuid])
+
+            lines.append('')
+
+        if not self:
+            lines.append('(nothing matched)')
+
+        return '\n'.join(lines)
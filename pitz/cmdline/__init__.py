@@ -3,6 +3,7 @@
 from __future__ import with_statement
 
 import logging
+import operator
 import optparse
 import os
 import sys
@@ -10,26 +11,33 @@ import warnings
 
 warnings.simplefilter('ignore', DeprecationWarning)
 
-import clepy
-
 import pitz
+from pitz.lock import lock_pitzdir, unlock_pitzdir
 from pitz.project import Project
 
 from pitz.entity import Component, Entity, Estimate, Milestone, \
 Person, Status, Tag, Task
 
+clepy = pitz.lazy_import('clepy')
+
 log = logging.getLogger('pitz.cmdline')
 
+# See PitzScript.apply_filter_and_grep.
+bag_operations = {'|': operator.or_, '&': operator.and_, '-': operator.sub}
+
 class PitzHelp(object):
 
     def add_to_list_of_scripts(self, f):
 
         if not hasattr(self, 'scripts'):
             self.scripts = {}
+            self.commands = {}
 
         self.scripts[f.script_name] = f.__doc__.strip() \
         if f.__doc__ else 'No description'
 
+        self.commands[f.script_name] = f
+
         return f
 
     def __call__(self):
@@ -55,6 +63,14 @@ class PitzScript(object):
     This is the generic script class.
     """
 
+    # Set this to True on scripts that only read the project.  Those
+    # scripts will ask a running pitz-daemon to do the work.
+    daemon_safe = False
+
+    # Scripts that write files on their own, rather than through
+    # save_proj, need to set this so they get an exclusive lock.
+    writes_files = False
+
     def __init__(self, title=None, save_proj=True, script_name=None,
         doc=None, **filter):
 
@@ -91,17 +107,31 @@ class PitzScript(object):
         """
         Return a new bag after filtering and grepping the bag b passed
         in.
+
+        Filters separated by '|', '&' or '-' pick out separate bags,
+        which I combine from left to right.
         """
 
-        filter = pitz.build_filter(args)
+        results = None
+
+        for op, group in pitz.split_on_operators(args):
+
+            filter = pitz.build_filter(group)
 
-        results = b
+            matches = b(**filter) if filter else b
 
-        if filter:
-            results = results(**filter)
+            if op is None:
+                results = matches
+
+            else:
+                results = bag_operations[op](results, matches)
 
         if getattr(options, 'grep', False):
-            results = results.grep(options.grep)
+
+            # grep stops once it has the first limit matches, in
+            # order.
+            results = results.grep(options.grep,
+                limit=getattr(options, 'limit', None))
 
         return results
 
@@ -185,21 +215,29 @@ class PitzScript(object):
         return glued_args
 
 
-    def setup_options_and_args(self, p):
+    def setup_options_and_args(self, p, argv=None):
 
-        options, args = p.parse_args()
+        options, args = p.parse_args(argv)
         return options, self.maybe_glue_args_together(args)
 
 
+    @property
+    def read_only(self):
+        """
+        Read-only scripts share the lock on the pitzdir.
+        """
+
+        return not (self.save_proj or self.writes_files)
+
     def setup_proj(self, p, options, args):
 
         pitzdir = Project.find_pitzdir(options.pitzdir)
-        pidfile = write_pidfile_or_die(pitzdir)
+        lockfile = lock_pitzdir_or_die(pitzdir, shared=self.read_only)
         proj = Project.from_pitzdir(pitzdir)
 
         log.debug("Loaded project from %s" % proj.loaded_from)
 
-        proj.pidfile = pidfile
+        proj.lockfile = lockfile
         proj.find_me()
 
         return proj
@@ -208,7 +246,7 @@ class PitzScript(object):
     def add_grep_option(self, p):
 
         p.add_option('-g', '--grep',
-            help='Filter to entities matching a regex')
+            help='Filter to entities matching words, "a phrase", or prefix*')
 
         return p
 
@@ -281,8 +319,58 @@ class PitzScript(object):
 
         return p
 
+    def ask_daemon(self):
+        """
+        Return True if a running pitz-daemon handled this command line.
+        """
+
+        from pitz import daemon
+
+        p = self.setup_p()
+        self.handle_p(p)
+        options, args = self.setup_options_and_args(p)
+
+        if options.pdb:
+            return
+
+        try:
+            pitzdir = Project.find_pitzdir(options.pitzdir)
+
+        except (IOError, pitz.ProjectNotFound):
+            return
+
+        reply = daemon.ask(pitzdir, self.script_name, sys.argv[1:])
+
+        if reply is None:
+            return
+
+        if reply['output']:
+            clepy.send_through_pager(
+                reply['output'].encode('utf-8'),
+                clepy.figure_out_pager(os.environ))
+
+        if reply['status']:
+            raise SystemExit(reply['status'])
+
+        return True
+
+    def run_in_daemon(self, argv, proj):
+        """
+        Run this script against a project that pitz-daemon already
+        loaded.
+        """
+
+        p = self.setup_p()
+        self.handle_p(p)
+        options, args = self.setup_options_and_args(p, argv)
+        self.handle_options_and_args(p, options, args)
+        self.handle_proj(p, options, args, proj)
+
     def __call__(self):
 
+        if self.daemon_safe and self.ask_daemon():
+            return
+
         with clepy.spinning_distraction():
 
             p = self.setup_p()
@@ -308,7 +396,7 @@ class PitzScript(object):
         if self.save_proj:
             proj.save_entities_to_yaml_files()
 
-        os.remove(proj.pidfile)
+        unlock_pitzdir(proj.lockfile)
 
 
 class MyTodo(PitzScript):
@@ -317,6 +405,7 @@ class MyTodo(PitzScript):
     """
 
     script_name = 'pitz-my-todo'
+    daemon_safe = True
 
     def handle_p(self, p):
         self.add_grep_option(p)
@@ -358,6 +447,7 @@ class PitzEverything(PitzScript):
     """
 
     script_name = 'pitz-everything'
+    daemon_safe = True
 
     def handle_p(self, p):
         self.add_grep_option(p)
@@ -392,6 +482,7 @@ class PitzTodo(PitzScript):
     """
 
     script_name = 'pitz-todo'
+    daemon_safe = True
 
     def handle_p(self, p):
         self.add_grep_option(p)
@@ -485,26 +576,22 @@ def pid_is_running(pid):
         return pid
 
 
-def write_pidfile_or_die(pitzdir):
-
-    pidfile = os.path.join(pitzdir, 'pitz.pid')
-
-    if os.path.exists(pidfile):
-
-        pid = int(open(pidfile).read())
-
-        if pid_is_running(pid):
-
-            print("Sorry, found a pidfile!  Kill process %s." % pid)
+def lock_pitzdir_or_die(pitzdir, shared=False):
+    """
+    Return a file holding a lock on pitzdir, or exit if another pitz
+    process holds a conflicting lock.
 
-            raise SystemExit
+    Scripts that only read should ask for a shared lock.
+    """
 
-        else:
+    try:
+        return lock_pitzdir(pitzdir, shared)
 
-            os.remove(pidfile)
+    except pitz.PitzdirLocked, ex:
+        print(ex)
+        raise SystemExit
 
-    open(pidfile, 'w').write(str(os.getpid()))
-    return pidfile
+write_pidfile_or_die = lock_pitzdir_or_die
 
 
 def pitz_shell():
@@ -522,7 +609,7 @@ def pitz_shell():
 
     pitzdir = Project.find_pitzdir(options.pitzdir)
 
-    pidfile = write_pidfile_or_die(pitzdir)
+    lockfile = lock_pitzdir_or_die(pitzdir)
 
     proj = Project.from_pitzdir(pitzdir)
     proj._shell_mode = True
@@ -546,8 +633,7 @@ def pitz_shell():
         proj.to_pickle()
         proj.save_entities_to_yaml_files()
 
-    # Remove the pidfile.
-    os.remove(pidfile)
+    unlock_pitzdir(lockfile)
 
 pitz_shell.script_name = 'pitz-shell'
 f(pitz_shell)
@@ -575,6 +661,7 @@ class PitzShow(PitzScript):
     """
 
     script_name = 'pitz-show'
+    daemon_safe = True
 
     def handle_p(self, p):
         p.set_usage("%prog frag")
@@ -605,20 +692,63 @@ class PitzShow(PitzScript):
             print("Sorry, couldn't find %s" % args[0])
 
 
+class PitzSearch(PitzScript):
+    """
+    Entities that best match some words, best first
+    """
+
+    script_name = 'pitz-search'
+    daemon_safe = True
+
+    def handle_p(self, p):
+        p.set_usage('%prog [options] words "a phrase" prefix*')
+        self.add_view_options(p)
+
+    def handle_options_and_args(self, p, options, args):
+        if not args:
+            p.print_usage()
+            raise SystemExit
+
+    def handle_proj(self, p, options, args, proj):
+
+        color = self.figure_out_colorization(options.color,
+            proj.me.use_colorization if proj.me else None)
+
+        if color:
+            highlight = '%s%%s%s' % (pitz.colors['yellow'],
+                pitz.colors['clear'])
+        else:
+            highlight = '*%s*'
+
+        results = proj.search(' '.join(args), options.limit or 10,
+            highlight=highlight)
+
+        clepy.send_through_pager(
+            results.snippets_view(
+                options.custom_view or 'summarized_view', color),
+            clepy.figure_out_pager(os.environ))
+
+
 def pitz_html():
     """
     Write out a bunch of HTML files.
     """
 
+    from pitz.htmlexport import HtmlExport
+
     with clepy.spinning_distraction():
 
         p = setup_options()
         p.set_usage('%prog [options] directory')
         p.add_option('--force',
-            help='Ignore timestamps and regenerate all files',
+            help='Ignore what changed and regenerate all files',
             action='store_true',
             default=False)
 
+        p.add_option('-j', '--jobs',
+            help='How many processes render pages (default is one per CPU)',
+            type='int', action='store', default=None)
+
         options, args = p.parse_args()
 
         if options.version:
@@ -636,21 +766,10 @@ def pitz_html():
 
         htmldir = args[0]
 
-        proj.to_html(htmldir)
-
-        proj.todo.to_html(htmldir)
-        proj.milestones.to_html(htmldir)
-        proj.tasks.to_html(htmldir)
-        proj.components.to_html(htmldir)
+        export = HtmlExport(proj, htmldir, workers=options.jobs,
+            force=options.force).run()
 
-        print("Wrote %d html files out of %d entities in project."
-            % (
-                len([e for e in proj
-                    if e.to_html_file(htmldir, options.force)]),
-                len(proj)))
-
-        # Record that we rebuilt all the HTML files.
-        proj.save_entities_to_yaml_files()
+    print(export.report)
 
 
 def pitz_add_milestone():
@@ -666,7 +785,7 @@ def pitz_add_milestone():
 
     pitzdir = Project.find_pitzdir(options.pitzdir)
 
-    pidfile = write_pidfile_or_die(pitzdir)
+    lockfile = lock_pitzdir_or_die(pitzdir)
 
     proj = Project.from_pitzdir(pitzdir)
     proj.find_me()
@@ -683,7 +802,7 @@ def pitz_add_milestone():
     print("Added %s to the project." % m.summarized_view)
     proj.save_entities_to_yaml_files()
 
-    os.remove(pidfile)
+    unlock_pitzdir(lockfile)
 
 
 def pitz_add_person():
@@ -995,7 +1114,7 @@ class PitzStartTask(PitzScript):
 
             if options.pause_other_tasks:
                 for tsk in proj.me.my_todo(status='started'):
-                    tsk['status'] = Status(title='paused')
+                    tsk['status'] = Status(proj, title='paused')
 
             try:
                 t.start(options.ignore_other_started_tasks)
@@ -1014,11 +1133,99 @@ class RefreshPickle(PitzScript):
     """
 
     script_name = 'pitz-refresh-pickle'
+    writes_files = True
 
     def hande_project(self, p, options, args, proj, results):
         proj.to_pickle()
 
 
+class PitzPack(PitzScript):
+    """
+    Move every yaml file in the pitzdir into one packed file
+    """
+
+    script_name = 'pitz-pack'
+    writes_files = True
+
+    def handle_proj(self, p, options, args, proj):
+
+        print("Packed %d entities into %s."
+            % (proj.pack(), proj.packfile.data_path))
+
+
+class PitzUnpack(PitzScript):
+    """
+    Turn a packed pitzdir back into one yaml file per entity
+    """
+
+    script_name = 'pitz-unpack'
+    writes_files = True
+
+    def handle_proj(self, p, options, args, proj):
+
+        if proj.packfile is None:
+            print("Sorry, %s isn't packed." % proj.pathname)
+            raise SystemExit
+
+        print("Wrote %d yaml files into %s."
+            % (proj.unpack(), proj.pathname))
+
+
+class PitzArchive(PitzScript):
+    """
+    Archive tasks that were closed a while ago
+    """
+
+    script_name = 'pitz-archive'
+    writes_files = True
+
+    def handle_p(self, p):
+
+        p.add_option('--days', type='int', default=30,
+            help='Archive tasks finished or abandoned and left alone '
+                'this many days (default 30)')
+
+    def handle_proj(self, p, options, args, proj):
+
+        n = proj.archive_closed_tasks(options.days)
+
+        if n:
+            print("Archived %d entities into %s."
+                % (n, proj.archive.data_path))
+
+        else:
+            print("Nothing has been closed for %d days." % options.days)
+
+
+class PitzCompactActivities(PitzScript):
+    """
+    Merge and roll up old activities
+    """
+
+    script_name = 'pitz-compact-activities'
+    writes_files = True
+
+    def handle_p(self, p):
+
+        p.add_option('--window', type='int', default=10,
+            help='Merge changes to the same attribute by the same person '
+                'this many minutes apart (default 10)')
+
+        p.add_option('--keep', type='int', default=90,
+            help='Roll activities older than this many days into daily '
+                'summaries (default 90)')
+
+    def handle_proj(self, p, options, args, proj):
+
+        from datetime import timedelta
+
+        before, after = proj.journal.compact(
+            timedelta(minutes=options.window),
+            timedelta(days=options.keep))
+
+        print("Compacted %d activities into %d." % (before, after))
+
+
 class PitzPauseTask(PitzScript):
 
     """
@@ -1276,11 +1483,25 @@ def pitz_frags():
     """
     Prints all the frags in this project.
 
-    I wrote this for command-line tab completion on fragments.
+    I wrote this for command-line tab completion on fragments, so I
+    only read the frag index that gets written every time the project
+    gets saved.
     """
 
+    from pitz.fragindex import matching_frags
+
     p = setup_options()
-    p.set_usage("%prog")
+    p.set_usage("%prog [options] [prefix]")
+
+    p.add_option('--tasks', action='append_const', const='task',
+        dest='types', help='Only list frags for tasks')
+
+    p.add_option('--people', action='append_const', const='person',
+        dest='types', help='Only list frags for people')
+
+    p.add_option('--type', action='append', dest='types',
+        help='Only list frags for entities of this type')
+
     options, args = p.parse_args()
 
     if options.version:
@@ -1289,10 +1510,8 @@ def pitz_frags():
 
     pitzdir = Project.find_pitzdir(options.pitzdir)
 
-    print('\n'.join([
-        x.split('-')[1][:6]
-        for x in os.listdir(pitzdir)
-        if '-' in x]))
+    print('\n'.join(matching_frags(pitzdir, options.types,
+        args[0] if args else None)))
 
 
 # These scripts change stuff.
@@ -1304,6 +1523,10 @@ pitz_unassign_task = f(PitzUnassignTask())
 pitz_prioritize_above = f(PitzPrioritizeAbove())
 pitz_prioritize_below = f(PitzPrioritizeBelow())
 pitz_refresh_pickle = f(RefreshPickle(save_proj=False))
+pitz_pack = f(PitzPack(save_proj=False))
+pitz_unpack = f(PitzUnpack(save_proj=False))
+pitz_archive = f(PitzArchive(save_proj=False))
+pitz_compact_activities = f(PitzCompactActivities(save_proj=False))
 pitz_add_task = f(PitzAddTask())
 pitz_add = pitz_add_task
 
@@ -1357,6 +1580,8 @@ pitz_people = f(
 
 pitz_show = f(PitzShow(save_proj=False))
 
+pitz_search = f(PitzSearch(save_proj=False))
+
 from pitz.cmdline.pitzcomment import PitzComment
 pitz_comment = f(PitzComment())
 
@@ -1369,4 +1594,7 @@ pitz_setup = f(pitz_setup)
 from pitz.cmdline.pitzaddtag import PitzAddTag
 pitz_add_tag = f(PitzAddTag())
 
-from pitz.cmdline.webapp import pitz_webapp
+from pitz.cmdline.webapp import pitz_webapp, pitz_webapp_load
+
+from pitz.cmdline.pitzdaemon import pitz_daemon
+pitz_daemon = f(pitz_daemon)
@@ -2,11 +2,12 @@
 
 import logging
 
-import clepy
-
+import pitz
 from pitz.entity import Tag
 from pitz.cmdline import PitzScript
 
+clepy = pitz.lazy_import('clepy')
+
 log = logging.getLogger('pitz.cmdline.pitzaddtag')
 
 class PitzAddTag(PitzScript):
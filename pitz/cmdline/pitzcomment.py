@@ -2,10 +2,11 @@
 
 import sys
 
-import clepy
-
+import pitz
 from pitz.cmdline import PitzScript
 
+clepy = pitz.lazy_import('clepy')
+
 
 class PitzComment(PitzScript):
     """
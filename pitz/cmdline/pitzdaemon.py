@@ -0,0 +1,42 @@
+# vim: set expandtab ts=4 sw=4 filetype=python:
+
+import logging
+
+import pitz
+from pitz.cmdline import pitz_help, print_version, setup_options
+from pitz.project import Project
+
+
+def pitz_daemon():
+
+    """
+    Keep the project in memory for read-only scripts
+    """
+
+    p = setup_options()
+
+    options, args = p.parse_args()
+    pitz.setup_logging(getattr(logging, options.log_level))
+
+    if options.version:
+        print_version()
+        return
+
+    from pitz.daemon import PitzDaemon
+
+    pitzdir = Project.find_pitzdir(options.pitzdir)
+
+    d = PitzDaemon(pitzdir, pitz_help.commands)
+
+    print("Listening on %s..." % d.server_address)
+
+    try:
+        d.serve_forever()
+
+    except KeyboardInterrupt:
+        pass
+
+    finally:
+        d.server_close()
+
+pitz_daemon.script_name = 'pitz-daemon'
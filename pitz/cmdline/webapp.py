@@ -2,15 +2,15 @@
 
 import logging
 import os
-from wsgiref.simple_server import make_server
+import signal
+import sys
 
 import pitz
-from pitz.cmdline import setup_options
+from pitz.cmdline import lock_pitzdir_or_die, print_version, \
+setup_options
+from pitz.lock import unlock_pitzdir
 from pitz.project import Project
 
-from pitz import webapp
-from pitz.webapp import handlers
-
 def pitz_webapp():
 
     """
@@ -22,6 +22,19 @@ def pitz_webapp():
     p.add_option('-p', '--port', help='HTTP port (default is 9876)',
        type='int', action='store', default=9876)
 
+    p.add_option('-t', '--threads',
+        help='Handle this many requests at once (default is 8)',
+        type='int', action='store', default=8)
+
+    p.add_option('--save-every',
+        help='Save web edits after this many seconds (default is 5)',
+        type='float', action='store', default=5.0)
+
+    p.add_option('--save-batch',
+        help='Save web edits sooner once this many entities changed '
+        '(default is 20)',
+        type='int', action='store', default=20)
+
     options, args = p.parse_args()
     pitz.setup_logging(getattr(logging, options.log_level))
 
@@ -29,13 +42,27 @@ def pitz_webapp():
         print_version()
         return
 
+    # Every pitz-* script imports this module, so wait until now to
+    # pull in the webapp and wsgiref.
+    from pitz import webapp
+    from pitz.webapp import handlers
+    from pitz.webapp.server import make_server
+    from pitz.webapp.writebehind import WriteBehind
+
     pitzdir = Project.find_pitzdir(options.pitzdir)
 
+    # Every save writes out the whole project as I hold it, so nobody
+    # else gets to change the pitzdir until I quit.
+    lockfile = lock_pitzdir_or_die(pitzdir)
+
     proj = Project.from_pitzdir(pitzdir)
     proj.find_me()
 
     app = webapp.SimpleWSGIApp(proj)
 
+    write_behind = WriteBehind(proj, app.lock, options.save_every,
+        options.save_batch).start()
+
     # Remember that the order that you add handlers matters.  When a
     # request arrives, the app starts with the first handler added and
     # asks it if wants to handle that request.  So, the default handler
@@ -50,12 +77,57 @@ def pitz_webapp():
     app.handlers.append(handlers.FaviconHandler(static_files))
     app.handlers.append(handlers.StaticHandler(static_files))
     app.handlers.append(handlers.HelpHandler(proj))
-    app.handlers.append(handlers.Update(proj))
+    app.handlers.append(handlers.Update(proj, write_behind))
     app.handlers.append(handlers.ByFragHandler(proj))
     app.handlers.append(handlers.EditAttributes(proj))
     app.handlers.append(handlers.Project(proj))
     app.handlers.append(handlers.Team(proj))
 
-    httpd = make_server('', options.port, app)
-    print "Serving on port %d..." % options.port
-    httpd.serve_forever()
+    httpd = make_server('', options.port, app, options.threads)
+    print "Serving on port %d with %d threads..." % (
+        options.port, max(1, options.threads))
+
+    # Make kill act like control-C, so the last edits get saved.
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    try:
+        httpd.serve_forever()
+
+    except KeyboardInterrupt:
+        pass
+
+    finally:
+        httpd.server_close()
+        write_behind.stop()
+        unlock_pitzdir(lockfile)
+
+
+def pitz_webapp_load():
+
+    """
+    Send lots of GETs to a running pitz-webapp and report the latency
+    percentiles.
+    """
+
+    from optparse import OptionParser
+
+    p = OptionParser(usage='%prog [options] [path ...]')
+
+    p.add_option('-u', '--url', default='http://localhost:9876',
+        help='Where pitz-webapp is running (default is %default)')
+
+    p.add_option('-n', '--requests', type='int', default=1000,
+        help='How many requests to send (default is %default)')
+
+    p.add_option('-c', '--concurrency', type='int', default=10,
+        help='How many requests to have going at once '
+        '(default is %default)')
+
+    options, args = p.parse_args()
+
+    from pitz.webapp.loadtest import LoadTest
+
+    urls = [options.url.rstrip('/') + path
+        for path in (args or ['/', '/team', '/Task/all'])]
+
+    print LoadTest(urls, options.requests, options.concurrency).run().report
@@ -0,0 +1,235 @@
+# vim: set expandtab ts=4 sw=4 filetype=python:
+
+"""
+A little local server that keeps a project loaded in memory.
+
+Run pitz-daemon in a terminal (or in the background) and the read-only
+scripts, like pitz-todo and pitz-show, will send their command lines
+over the unix socket at pitzdir/pitz.sock instead of loading the
+project themselves.
+
+When no daemon is listening, the scripts just load the project like
+they always did.
+"""
+
+from __future__ import with_statement
+
+import contextlib
+import json
+import logging
+import os
+import socket
+import SocketServer
+import StringIO
+import sys
+
+import clepy
+
+from pitz.lock import lock_pitzdir, unlock_pitzdir
+
+log = logging.getLogger('pitz.daemon')
+
+socket_filename = 'pitz.sock'
+
+
+def socket_path(pitzdir):
+    return os.path.join(pitzdir, socket_filename)
+
+
+@contextlib.contextmanager
+def capturing_output(buf):
+    """
+    Send everything that would go to stdout or through the pager into
+    buf instead.
+    """
+
+    def send_through_pager(s, pager=None):
+        buf.write(s)
+        buf.write('\n')
+
+    originals = (sys.stdout, clepy.send_through_pager,
+        clepy.figure_out_pager)
+
+    sys.stdout = buf
+    clepy.send_through_pager = send_through_pager
+    clepy.figure_out_pager = lambda environ: None
+
+    try:
+        yield buf
+
+    finally:
+        sys.stdout, clepy.send_through_pager, clepy.figure_out_pager = \
+        originals
+
+
+class PitzRequestHandler(SocketServer.StreamRequestHandler):
+    """
+    Reads one line of JSON like::
+
+        {"script": "pitz-todo", "argv": ["--limit", "5"]}
+
+    and writes back one line of JSON like::
+
+        {"status": 0, "output": "..."}
+    """
+
+    def handle(self):
+
+        request = json.loads(self.rfile.readline())
+
+        log.debug("Got request %s" % request)
+
+        reply = self.server.run_script(
+            request['script'],
+            request.get('argv', []))
+
+        self.wfile.write(json.dumps(reply))
+        self.wfile.write('\n')
+
+
+class PitzDaemon(SocketServer.UnixStreamServer):
+    """
+    Holds one project in memory and runs scripts against it.
+    """
+
+    def __init__(self, pitzdir, scripts):
+
+        self.pitzdir = pitzdir
+
+        # Maps script names to PitzScript instances.
+        self.scripts = scripts
+
+        self.proj = None
+        self.loaded_at = None
+
+        path = socket_path(pitzdir)
+
+        if os.path.exists(path):
+
+            if ask(pitzdir, None, []) is not None:
+                raise ValueError("A daemon is already listening on %s"
+                    % path)
+
+            os.unlink(path)
+
+        SocketServer.UnixStreamServer.__init__(self, path,
+            PitzRequestHandler)
+
+        self.load_project()
+
+    def newest_change(self):
+        """
+        Every save rewrites project.pickle, and adding or deleting an
+        entity file touches the pitzdir itself, so these two timestamps
+        tell me when my copy is out of date.
+        """
+
+        pickle_path = os.path.join(self.pitzdir, 'project.pickle')
+
+        return max(
+            os.stat(self.pitzdir).st_mtime,
+            os.stat(pickle_path).st_mtime
+            if os.path.exists(pickle_path) else 0)
+
+    def load_project(self):
+
+        from pitz.project import Project
+
+        # Wait for any writer to finish before reading.
+        lockfile = lock_pitzdir(self.pitzdir, shared=True, blocking=True)
+
+        try:
+            self.loaded_at = self.newest_change()
+            self.proj = Project.from_pitzdir(self.pitzdir)
+            self.proj.find_me()
+
+        finally:
+            unlock_pitzdir(lockfile)
+
+        log.debug("Loaded project from %s" % self.proj.loaded_from)
+
+        return self.proj
+
+    def maybe_reload_project(self):
+
+        if self.newest_change() > self.loaded_at:
+            log.info("Files changed, so reloading project")
+            self.load_project()
+
+        return self.proj
+
+    def run_script(self, script_name, argv):
+
+        # A request for no script is just a ping.
+        if script_name is None:
+            return dict(status=0, output='')
+
+        script = self.scripts.get(script_name)
+
+        if not getattr(script, 'daemon_safe', False):
+            return dict(status=1,
+                output="Sorry, the daemon won't run %s." % script_name)
+
+        proj = self.maybe_reload_project()
+
+        buf = StringIO.StringIO()
+        status = 0
+
+        with capturing_output(buf):
+
+            try:
+                script.run_in_daemon(argv, proj)
+
+            except SystemExit, ex:
+                status = ex.code or 0
+
+            except Exception, ex:
+                log.exception(ex)
+                status = 1
+                buf.write("%s: %s\n" % (ex.__class__.__name__, ex))
+
+        return dict(status=status, output=buf.getvalue())
+
+    def server_close(self):
+
+        SocketServer.UnixStreamServer.server_close(self)
+
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+
+
+def ask(pitzdir, script_name, argv):
+    """
+    Send a request to the daemon for pitzdir.
+
+    Returns the decoded reply, or None if nothing is listening.
+    """
+
+    path = socket_path(pitzdir)
+
+    if not os.path.exists(path):
+        return
+
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+    try:
+
+        try:
+            s.connect(path)
+
+        except socket.error, ex:
+            log.debug("Couldn't connect to %s: %s" % (path, ex))
+            return
+
+        s.sendall(json.dumps(dict(script=script_name, argv=argv)))
+        s.sendall('\n')
+
+        f = s.makefile()
+        line = f.readline()
+        f.close()
+
+        if line:
+            return json.loads(line)
+
+    finally:
+        s.close()
@@ -13,28 +13,28 @@ except ImportError:
 import logging
 import os
 import re
-import uuid
 import weakref
 from datetime import datetime
 from types import NoneType
 
-import jinja2
-import yaml
-from docutils.core import publish_parts
-from docutils.utils import SystemMessage
-import clepy
-
 import pitz
 from pitz import NoProject, by_descending_created_time
 from pitz import by_whatever, PitzException
 from pitz.bag import Bag
 
+clepy = pitz.lazy_import('clepy')
+jinja2 = pitz.lazy_import('jinja2')
+uuid = pitz.lazy_import('uuid')
+yaml = pitz.lazy_import('yaml')
+
 log = logging.getLogger('pitz.entity')
 
 class MC(type):
     """
     This metaclass adds a dictionary named already_instantiated to the
-    cls.
+    cls.  It only holds weak references, so an entity goes away once
+    nothing else wants it.  Projects keep their own lookup table in
+    Bag.entities_by_title.
     """
 
     def __init__(cls, name, bases, d):
@@ -63,6 +63,12 @@ class Entity(dict):
     >>> ie3 = Entity(p, title="b")
     >>> id(ie1) == id(ie3)
     False
+
+    Another project gets its own entity, even with the same title.
+
+    >>> p2 = Project(title="Blah 2")
+    >>> Entity(p2, title="a") is ie1
+    False
     """
 
     plural_name = 'entities'
@@ -111,6 +117,10 @@ class Entity(dict):
         title.  If we do, then we just return that.
 
         If we don't have it, we make it and return it.
+
+        When I get a project, I only look inside it, so loading two
+        projects in one process doesn't mix up their entities.  See
+        by_title.
         """
 
         if 'title' not in kwargs:
@@ -119,7 +129,7 @@ class Entity(dict):
         title = kwargs['title']
 
         try:
-            return cls.by_title(title)
+            return cls.by_title(title, project)
 
         except EntityDoesNotExist:
             self = super(Entity, cls).__new__(cls, project, **kwargs)
@@ -223,40 +233,84 @@ class Entity(dict):
     project = property(_get_project, _set_project)
 
     @classmethod
-    def all(cls):
+    def all(cls, project=None):
         """
         Return all the already instantiated instances of this class,
-        wrapped up in a pretty little bag.
+        wrapped up in a pretty little bag.  Pass a project to only get
+        the ones in it.
         """
 
+        if getattr(project, 'entities_by_title', None) is not None:
+
+            entities = [e for (c, title), e
+                in project.entities_by_title.items() if c is cls]
+
+        else:
+            entities = cls.already_instantiated.values()
+
         return Bag(
             title='All %s' % cls.plural_name,
-            entities=cls.already_instantiated.values())
+            entities=entities)
 
     @classmethod
-    def by_title(cls, title):
+    def by_title(cls, title, project=None):
+        """
+        Return the instance of this class with this title.
 
-        if title in cls.already_instantiated:
+        With a project, I look in that project, and then at entities
+        that don't belong to any project yet.  Without one, I look
+        through every instance that's still alive.
+        """
+
+        registry = getattr(project, 'entities_by_title', None)
+
+        if registry is not None:
+
+            e = registry.get((cls, title))
+
+            if e is None:
+
+                e = cls.already_instantiated.get(title)
+
+                if e is not None and e.project is not None:
+                    e = None
+
+            if e is not None:
+                return e
+
+        elif title in cls.already_instantiated:
             return cls.already_instantiated[title]
 
-        else:
-            raise EntityDoesNotExist(
-                "Couldn't find a %s with title %s"
-                % (cls.__name__, title))
+        raise EntityDoesNotExist(
+            "Couldn't find a %s with title %s"
+            % (cls.__name__, title))
 
     def _setup_jinja(self):
 
+        # Don't build the environment until somebody asks for self.e.
+        self._e = None
+
+    @property
+    def e(self):
+
+        if getattr(self, '_e', None) is None:
+            self._e = self._build_jinja_environment()
+
+        return self._e
+
+    def _build_jinja_environment(self):
+
         # Figure out the path to the jinja2templates.
         jinja2dir = os.path.join(
             os.path.split(os.path.dirname(__file__))[0],
             'jinja2templates')
 
         # Set up a template loader.
-        self.e = jinja2.Environment(
+        e = jinja2.Environment(
             extensions=['jinja2.ext.loopcontrols'],
             loader=jinja2.FileSystemLoader(jinja2dir))
 
-        self.e.globals = {
+        e.globals = {
             'enumerate': enumerate,
             'clepy': clepy,
             'datetime': datetime,
@@ -266,6 +320,8 @@ class Entity(dict):
             'colors': pitz.colors,
         }
 
+        return e
+
     def __setitem__(self, attr, val):
         """
         Make sure that the value is allowed for this attr before going
@@ -319,8 +375,25 @@ class Entity(dict):
         self.maybe_update_modified_time(attr)
         self.maybe_record_activity(attr, val)
 
+        old_val = self.get(attr)
+
         # Finally, do the setitem.
         super(Entity, self).__setitem__(attr, val)
+        Bag.note_entity_change()
+
+        self.maybe_note_change(attr)
+        self.maybe_update_indexes(attr, old_val)
+
+    def pop(self, attr, *default):
+        """
+        Like dict.pop, but my project's indexes hear about it.
+        """
+
+        val = super(Entity, self).pop(attr, *default)
+        Bag.note_entity_change()
+        self.maybe_update_indexes(attr, val)
+
+        return val
 
     def __hash__(self):
         """
@@ -355,6 +428,52 @@ class Entity(dict):
             super(Entity, self).__setitem__(
                 'modified_time', datetime.now())
 
+    def maybe_note_change(self, attr):
+        """
+        Tell my project I changed, so it can throw out anything it
+        rendered from the old me.  I skip the same updates that don't
+        change my modified_time.
+        """
+
+        if self.update_modified_time \
+        and self.project \
+        and attr not in self.do_not_update_modified_time_for_these_keys:
+
+            self.project.note_change(self)
+
+    def maybe_update_indexes(self, attr, old_val=None):
+        """
+        Let my project's title lookups, rollups, and reference index
+        catch up with the attribute I just changed.
+        """
+
+        if attr == 'title' and old_val != self['title']:
+
+            cls = self.__class__
+
+            if cls.already_instantiated.get(old_val) is self:
+                del cls.already_instantiated[old_val]
+
+            cls.already_instantiated[self['title']] = self
+
+        p = self.project
+
+        if p is None or self.uuid not in p.entities_by_uuid:
+            return
+
+        if attr == 'title' and old_val != self['title']:
+            p.retitle(self, old_val)
+
+        rollups = getattr(p, 'rollups', None)
+
+        if rollups is not None and attr in rollups.watched:
+            rollups.update(self)
+
+        references = getattr(p, 'references', None)
+
+        if references is not None:
+            references.update(self, attr)
+
     def maybe_record_activity(self, attr, val):
 
         if getattr(self, 'record_activity_on_changes', False) \
@@ -362,18 +481,8 @@ class Entity(dict):
         and self.project.me \
         and attr not in self.do_not_track_activity_for_these_keys:
 
-            old_val = self.get(attr)
-
-            activity_title = "%s set %s from %s to %s on %s" \
-            % (self.project.me.abbr, attr,
-                clepy.maybe_add_ellipses(str(old_val), 16),
-                clepy.maybe_add_ellipses(str(val), 16),
-                self.frag)
-
-            return Activity(self.project, entity=self.uuid,
-                title=activity_title,
-                who_did_it=self.project.me,
-                description='')
+            return self.project.journal.record(self, attr,
+                self.get(attr), val, self.project.me)
 
     def prioritize_above(self, other):
         """
@@ -423,7 +532,7 @@ class Entity(dict):
         Return all comments on this entity.
         """
 
-        b = self.project(type='comment', entity=self)
+        b = self.project.pointing_at(self, 'entity', type='comment')
         b.title = 'Comments on %(title)s' % self
 
         return b.order(by_descending_created_time)
@@ -434,9 +543,17 @@ class Entity(dict):
         Return all activities on this entity.
         """
 
-        b = self.project(type='activity', entity=self)
+        b = self.project.pointing_at(self, 'entity', type='activity')
         b.title = 'Activity on %(title)s' % self
 
+        journal = getattr(self.project, 'journal', None)
+
+        if journal is not None:
+            for a in Activity.from_records(self.project,
+                journal.for_entity(self)):
+
+                b.append(a, rerun_sort_after_append=False)
+
         return b.order(by_whatever(
             'created_time (reversed)',
             'created_time', reverse=True))
@@ -612,6 +729,18 @@ class Entity(dict):
 
         return results
 
+    def _titled(self, cls, title):
+        """
+        Return the cls in my project with this title, or None.
+        """
+
+        try:
+            return cls.by_title(title, self.project)
+
+        # Lists and such can't be titles.
+        except (EntityDoesNotExist, TypeError):
+            return
+
     def what_they_really_mean(self, a, v):
         """
         Try to convert strings, UUIDs, and frags to more interesting
@@ -648,11 +777,11 @@ class Entity(dict):
         if isinstance(at, list):
             inner_at = at[0]
 
-            # When v is a title, look up an entity.
-            if isinstance(v, basestring) \
-            and v in inner_at.already_instantiated:
+            titled = self._titled(inner_at, v)
 
-                return inner_at(title=v)
+            # When v is a title, look up an entity.
+            if titled is not None:
+                return titled
 
             # When v is a list, go through each element inside.
             elif isinstance(v, list):
@@ -672,14 +801,16 @@ class Entity(dict):
                 new_list = []
                 for vv in v:
 
+                    titled = self._titled(at, vv)
+
                     if isinstance(vv, Entity):
                         new_list.append(vv)
 
                     elif isinstance(vv, uuid.UUID) and self.project:
                         new_list.append(self.project.by_uuid(vv))
 
-                    elif vv in at.already_instantiated:
-                        new_list.append(at(title=vv))
+                    elif titled is not None:
+                        new_list.append(titled)
 
                     elif isinstance(vv, basestring) and self.project \
                     and vv in self.project.entities_by_frag:
@@ -693,8 +824,10 @@ class Entity(dict):
 
             else:
 
-                if v in at.already_instantiated:
-                    return at(title=v)
+                titled = self._titled(at, v)
+
+                if titled is not None:
+                    return titled
 
                 else:
                     return v
@@ -912,18 +1045,21 @@ class Entity(dict):
     @property
     def yaml(self):
 
-        self.replace_objects_with_pointers()
+        # Work on a copy, with pointers where the objects are, rather
+        # than swapping them in and out of me, since the webapp might be
+        # reading me on another thread.
+        d = dict()
 
-        d = dict(self)
-        d.pop('frag')
+        for attr, val in dict(self).iteritems():
 
-        y = yaml.dump(d, default_flow_style=False)
+            if isinstance(val, (tuple, list)):
+                val = [getattr(e, 'uuid', e) for e in val]
 
-        # Now switch the pointers with the objects.
-        if self.project:
-            self.replace_pointers_with_objects()
+            d[attr] = getattr(val, 'uuid', val)
+
+        d.pop('frag')
 
-        return y
+        return yaml.dump(d, default_flow_style=False)
 
     def __getstate__(self):
 
@@ -937,14 +1073,15 @@ class Entity(dict):
         self.replace_pointers_with_objects()
         return d
 
-    def to_yaml_file(self, pathname):
+    def to_yaml_file(self, pathname, force=False):
         """
         Returns the path of the file saved, IFF one got saved.
 
-        The pathname specifies where to save it.
+        The pathname specifies where to save it.  If force is True, then
+        I ignore the timestamps.
         """
 
-        if self.stale_yaml:
+        if force or self.stale_yaml:
 
             self['yaml_file_saved'] = datetime.now()
 
@@ -955,6 +1092,20 @@ class Entity(dict):
 
             return fp
 
+    def to_packfile(self, packfile):
+        """
+        Just like to_yaml_file, but appends a record to a
+        pitz.packfile.PackFile instead.
+
+        Returns the offset of the record saved, IFF one got saved.
+        """
+
+        if self.stale_yaml:
+
+            self['yaml_file_saved'] = datetime.now()
+
+            return packfile.append(self)
+
     def save_attachment(self, filepath):
         """
         Save the file in filepath in the pitzdir.
@@ -1010,7 +1161,11 @@ class Entity(dict):
             if isinstance(val, uuid.UUID):
                 self[attr] = self.project.by_uuid(val)
 
-            if isinstance(val, (list, tuple)):
+            # Every new bag calls this on everything inside it, so don't
+            # write anything unless there's a pointer to replace.
+            if isinstance(val, (list, tuple)) \
+            and any(isinstance(x, uuid.UUID) for x in val):
+
                 self[attr] = [self.project.by_uuid(x) for x in val]
 
         self.update_modified_time = True
@@ -1071,20 +1226,19 @@ class Entity(dict):
 
     @property
     def description_as_html(self):
+        """
+        Render the description as HTML, using my project's cache (see
+        pitz.rstcache), or the one everybody else shares.
+        """
 
-        try:
-            return publish_parts(self['description'],
-                writer_name='html')['html_body']
-
-        except SystemMessage, ex:
+        from pitz import rstcache
 
-            log.error(
-                "Couldn't render %(frag)s description as HTML"
-                % self)
+        cache = getattr(self.project, 'rst_cache', None)
 
-            log.exception(ex)
+        if cache is None:
+            cache = rstcache.cache
 
-            return """<pre>%(description)s</pre>""" % self
+        return cache.render(self['description'])
 
     @property
     def html(self):
@@ -1121,32 +1275,95 @@ class Entity(dict):
 
     def self_destruct(self, proj):
         """
-        Remove this entity from the project.  Delete a yaml file if it
-        exists.
+        Remove this entity from the project, along with its comments
+        and activities, and theirs, and so on, archived or not.  Delete
+        their yaml files if they exist.
 
         Return a list of yaml files deleted.
         """
 
-        # Remove this entity from the project.
-        i = proj.index(self)
-        proj.pop(i)
+        # I might have already gone along with whatever I was about.
+        if self not in proj:
+            return []
+
+        # Find everybody first, then take them all out in one pass, so
+        # this costs the same no matter how big the project is.
+        doomed = [self]
+        seen = set([self.uuid])
+
+        for e in doomed:
+
+            for child in proj.pointing_at(e, 'entity', archived=False):
+
+                if child['type'] in ('comment', 'activity') \
+                and child.uuid not in seen:
+
+                    seen.add(child.uuid)
+                    doomed.append(child)
+
+        proj.remove_many(doomed)
+
+        journal = getattr(proj, 'journal', None)
+
+        if journal is not None:
+            for e in doomed:
+                journal.forget(e)
 
         files_deleted = []
 
-        # Delete any yaml file.
+        # Delete any yaml files.
         if proj.pathname and os.path.isdir(proj.pathname):
 
-            absolute_path = os.path.join(proj.pathname, self.yaml_filename)
+            packfile = getattr(proj, 'packfile', None)
+            packed = False
+
+            for e in doomed:
+
+                absolute_path = os.path.join(proj.pathname, e.yaml_filename)
+
+                if os.path.exists(absolute_path):
+                    os.unlink(absolute_path)
+                    files_deleted.append(absolute_path)
 
-            if os.path.exists(absolute_path):
-                os.unlink(absolute_path)
-                files_deleted.append(absolute_path)
+                if packfile is not None and packfile.delete(e):
+                    packed = True
+                    files_deleted.append(
+                        '%s#%s' % (packfile.data_path, e.uuid))
 
-            for a in self.activities:
-                files_deleted.extend(a.self_destruct(proj))
+            if packed:
+                packfile.save_index()
 
-            for c in self.comments:
-                files_deleted.extend(c.self_destruct(proj))
+        # Comments and activities that went into the archive point at
+        # us too, and they shouldn't outlive what they're about.
+        archive = getattr(proj, 'archive', None)
+
+        if archive:
+
+            uuids = [e.uuid for e in doomed]
+            seen = set(uuids)
+
+            for u in uuids:
+
+                for r in archive.referrers(u, 'entity'):
+
+                    if r not in seen \
+                    and archive.type_of(r) in ('comment', 'activity'):
+
+                        seen.add(r)
+                        uuids.append(r)
+
+            archived = [u for u in uuids if u in archive]
+
+            for u in archived:
+
+                archive.delete(u)
+                files_deleted.append('%s#%s' % (archive.data_path, u))
+
+                if journal is not None:
+                    journal.forget(u)
+
+            if archived:
+                archive.save_index()
 
         return files_deleted
 
@@ -1253,7 +1470,7 @@ class Estimate(Entity):
             raise NoProject("Need a self.project for this!")
 
         else:
-            return self.project.tasks(estimate=self)
+            return self.project.pointing_at(self, 'estimate', type='task')
 
     @property
     def points(self):
@@ -1316,7 +1533,27 @@ class Status(Entity):
             raise NoProject("Need a self.project for this!")
 
         else:
-            return self.project.tasks(status=self)
+            return self.project.pointing_at(self, 'status', type='task')
+
+    @classmethod
+    def by_titles(cls, project, *titles):
+        """
+        Return the statuses in project with these titles, with None
+        standing in for any that don't exist.  Unlike Status(title=...),
+        I never make a new status just to filter on it.
+        """
+
+        found = []
+
+        for title in titles:
+
+            try:
+                found.append(cls.by_title(title, project))
+
+            except EntityDoesNotExist:
+                found.append(None)
+
+        return found
 
     @classmethod
     def setup_defaults(cls, proj):
@@ -1374,37 +1611,47 @@ class Milestone(Entity):
         if not self.project:
             raise NoProject("I need a project before I can look up tasks!")
 
-        tasks = self.project(type='task', milestone=self)
+        tasks = self.project.pointing_at(self, 'milestone', type='task')
         tasks.title = 'Tasks in %(title)s' % self
         return tasks
 
     @property
     def todo(self):
 
-        unfinished = self.tasks.does_not_match_dict(
-            status=Status(title='finished'))\
-        .does_not_match_dict(status=Status(title='abandoned'))
+        finished, abandoned = Status.by_titles(self.project,
+            'finished', 'abandoned')
+
+        # Archived tasks are all closed, so leave the archive alone.
+        unfinished = self.project.pointing_at(self, 'milestone',
+            archived=False, type='task')\
+        .does_not_match_dict(status=finished)\
+        .does_not_match_dict(status=abandoned)
 
         unfinished.title = "Unfinished tasks in %(title)s" % self
         return unfinished
 
+    @property
+    def rollup(self):
+        """
+        Running tallies of my tasks by status and estimate.
+        """
+
+        if not self.project:
+            raise NoProject("I need a project before I can count tasks!")
+
+        return self.project.rollups[self]
+
     @property
     def summarized_view(self):
         """
         One-line description of the milestone
         """
 
-        started = Status(title='started')
-        finished = Status(title='finished')
-        unstarted = Status(title='unstarted')
-
-        a = self.tasks(status=finished).length
-        b = self.tasks(status=[finished, started, unstarted]).length
+        started, finished, unstarted = Status.by_titles(self.project,
+            'started', 'finished', 'unstarted')
 
-        if b is not 0:
-            pct_complete = 100 * (float(a) / b)
-        else:
-            pct_complete = 0.0
+        a, b, pct_complete = self.rollup.progress(finished,
+            [finished, started, unstarted])
 
         d = {
             'frag': self['frag'],
@@ -1431,7 +1678,7 @@ class Tag(Entity):
             raise NoProject(
                 "I need a project before I can look up tasks!")
 
-        tasks = self.project(type='task', tags=self)
+        tasks = self.project.pointing_at(self, 'tags', type='task')
         tasks.title = 'Tasks in %(title)s' % self
 
         return tasks
@@ -1450,7 +1697,7 @@ class Component(Entity):
             raise NoProject(
                 "I need a project before I can look up tasks!")
 
-        tasks = self.project(type='task', components=self)
+        tasks = self.project.pointing_at(self, 'components', type='task')
         tasks.title = 'Tasks in %(title)s' % self
 
         return tasks
@@ -1458,13 +1705,29 @@ class Component(Entity):
     @property
     def todo(self):
 
-        unfinished = self.tasks.does_not_match_dict(
-            status=Status(title='finished'))\
-        .does_not_match_dict(status=Status(title='abandoned'))
+        finished, abandoned = Status.by_titles(self.project,
+            'finished', 'abandoned')
+
+        # Archived tasks are all closed, so leave the archive alone.
+        unfinished = self.project.pointing_at(self, 'components',
+            archived=False, type='task')\
+        .does_not_match_dict(status=finished)\
+        .does_not_match_dict(status=abandoned)
 
         unfinished.title = "Unfinished tasks in %(title)s" % self
         return unfinished
 
+    @property
+    def rollup(self):
+        """
+        Running tallies of my tasks by status and estimate.
+        """
+
+        if not self.project:
+            raise NoProject("I need a project before I can count tasks!")
+
+        return self.project.rollups[self]
+
 
 class Comment(Entity):
     """
@@ -1545,6 +1808,76 @@ class Activity(Entity):
         entity=Entity,
     )
 
+    @classmethod
+    def from_records(cls, project, records):
+        """
+        Return an activity for each pitz.journal.Record.
+
+        These belong to project, so they can look up the entity and the
+        person, but project doesn't hold them.  Since they don't join
+        the project or go through __new__, lots of them are cheap.
+        """
+
+        activities = []
+
+        for r in records:
+
+            who = project.by_uuid(r.who_did_it)
+            e = project.by_uuid(r.entity)
+
+            u = r.uuid
+
+            if r.is_summary:
+
+                attrs = ', '.join(r.attrs)
+
+                if r.unlisted:
+                    attrs += ' and %d more' % r.unlisted
+
+                title = "%s made %d change%s to %s on %s" \
+                % (getattr(who, 'abbr', who), r.how_many,
+                    '' if r.how_many == 1 else 's',
+                    attrs, str(r.entity)[:6])
+
+            else:
+
+                title = u"%s set %s from %s to %s on %s" \
+                % (getattr(who, 'abbr', who), r.attr,
+                    r.old.decode('utf8', 'replace'),
+                    r.new.decode('utf8', 'replace'),
+                    str(r.entity)[:6])
+
+            a = dict.__new__(cls)
+
+            dict.update(a,
+                title=title,
+                description='',
+                pscore=0,
+                who_did_it=who,
+                entity=e,
+                type='activity',
+                uuid=u,
+                frag=str(u)[:6],
+                created_time=r.created_time,
+                modified_time=r.created_time)
+
+            a._project = project
+            a._setup_jinja()
+            a.update_modified_time = False
+            a.record_activity_on_changes = False
+
+            activities.append(a)
+
+        return activities
+
+    @classmethod
+    def all(cls, project=None):
+
+        if getattr(project, 'journal', None) is not None:
+            return project.activities
+
+        return super(Activity, cls).all(project)
+
     @property
     def time_ago(self):
         return clepy.time_ago(self.created_time)
@@ -2,10 +2,10 @@
 
 import os
 
-import yaml
-
 import pitz
-from pitz.entity import Entity
+from pitz.entity import Entity, Status
+
+yaml = pitz.lazy_import('yaml')
 
 
 class Person(Entity):
@@ -42,7 +42,15 @@ class Person(Entity):
         if not self.project:
             return
 
-        b = self.project.todo(owner=self)
+        finished, abandoned = Status.by_titles(self.project,
+            'finished', 'abandoned')
+
+        # Only look at my own tasks, instead of the whole to-do list.
+        b = self.project.pointing_at(self, 'owner', archived=False,
+            type='task')\
+        .does_not_match_dict(status=finished)\
+        .does_not_match_dict(status=abandoned)
+
         b.title = "To-do list for %(title)s" % self
 
         b.order_method = pitz.by_whatever('xxx', 'milestone', 'status',
@@ -56,7 +64,7 @@ class Person(Entity):
         if not self.project:
             return
 
-        return self.my_todo[0]
+        return self.my_todo.top(1)[0]
 
     def __str__(self):
         return getattr(self, 'abbr', self.title)
@@ -67,7 +75,7 @@ class Person(Entity):
         if not self.project:
             return
 
-        first_four_tasks = self.my_todo[:4]
+        first_four_tasks = self.my_todo.top(4)
         first_four_tasks.title = 'First four tasks from to-do list'
         return first_four_tasks
 
@@ -79,16 +87,37 @@ class Person(Entity):
     def setup_defaults(cls, proj):
         cls(proj, title='no owner', pscore=-100, is_a_default=True)
 
-    @property
-    def my_activities(self):
+    def newest_activities(self, how_many=None):
+        """
+        Return a bag with my how_many newest activities, or all of them.
+        I only turn that many journal records into activities.
+        """
+
+        from pitz.entity import Activity
 
-        all_my_activities = self.project.activities(who_did_it=self)
+        b = self.project.pointing_at(self, 'who_did_it', type='activity')
 
-        return all_my_activities.order(pitz.by_descending_created_time)
+        journal = getattr(self.project, 'journal', None)
+
+        if journal is not None:
+
+            records = journal.for_person(self)
+
+            if how_many is not None:
+                records = records[-how_many:]
+
+            for a in Activity.from_records(self.project, records):
+                b.append(a, rerun_sort_after_append=False)
+
+        return b.order(pitz.by_descending_created_time)
+
+    @property
+    def my_activities(self):
+        return self.newest_activities()
 
     @property
     def four_recent_activities(self):
 
-        four_recent_activities = self.my_activities[:4]
+        four_recent_activities = self.newest_activities(4).top(4)
         four_recent_activities.title = 'Four most recent activities'
         return four_recent_activities
@@ -3,9 +3,6 @@
 import logging
 import textwrap
 
-import clepy
-import jinja2
-
 from pitz.entity import (
     Component, Entity, Estimate, Person,
     Milestone, Status, Tag, Comment,
@@ -13,6 +10,9 @@ from pitz.entity import (
 
 import pitz
 
+clepy = pitz.lazy_import('clepy')
+jinja2 = pitz.lazy_import('jinja2')
+
 log = logging.getLogger('entity.task')
 
 class Task(Entity):
@@ -287,7 +287,7 @@ class Task(Entity):
         Return some (specified by how_many) activities.
         """
 
-        b = self.activities[:how_many]
+        b = self.activities.top(how_many)
         b.title = 'Recent activity'
 
         return b
@@ -302,7 +302,7 @@ class Task(Entity):
 
         if self['status'].title in ['unstarted', 'started']:
 
-            self['status'] = Status(title='abandoned')
+            self['status'] = Status(self.project, title='abandoned')
 
             if 'owner' in self:
                 self.pop('owner')
@@ -336,18 +336,18 @@ class Task(Entity):
                     "pause those (with -z) before starting this one."
                     % other_started_tasks.length)
 
-        self['status'] = Status(title='started')
+        self['status'] = Status(self.project, title='started')
 
         return self
 
 
     def pause(self):
-        self['status'] = Status(title='paused')
+        self['status'] = Status(self.project, title='paused')
 
 
     def finish(self):
 
-        self['status'] = Status(title='finished')
+        self['status'] = Status(self.project, title='finished')
 
         return self
 
@@ -0,0 +1,166 @@
+# vim: set expandtab ts=4 sw=4 filetype=python:
+
+"""
+A tiny index of every frag in the pitzdir, so that pitz-frags (which
+runs on every tab completion) never has to list the directory or load
+the project.
+
+Each line looks like this::
+
+    <frag> <type> <title>
+
+The project rewrites the whole file every time it saves.
+"""
+
+from __future__ import with_statement
+
+import os
+import re
+
+frag_index_filename = 'frags.idx'
+
+# Matches the names of yaml files written by Entity.to_yaml_file.
+entity_filename = re.compile(
+    r'^([a-z]+)-([0-9a-f]{8}-[0-9a-f-]+)\.yaml$')
+
+
+def frag_index_path(pitzdir):
+    return os.path.join(pitzdir, frag_index_filename)
+
+
+def frag_index_lines(entities, archived=None):
+    """
+    Return the lines of a frag index for entities, in frag order.
+
+    Pass in the offsets of an Archive (see pitz.archive) to list the
+    archived entities too.  I don't know their titles without reading
+    them, so their lines leave the title off, unless they're among
+    entities.
+
+    >>> from pitz.entity import Entity
+    >>> frag_index_lines([Entity(title='line in the frag index')])[0][6:]
+    ' entity line in the frag index\\n'
+    >>> frag_index_lines([], {'abcdef-0': ('abcdef', 'task', 0, 10)})
+    ['abcdef task \\n']
+    """
+
+    rows = []
+    seen = set()
+
+    for e in entities:
+
+        title = e.title
+
+        if isinstance(title, unicode):
+            title = title.encode('utf8')
+
+        # Titles with newlines in them would break the one line per
+        # entity rule.
+        rows.append((e.frag, e['type'], ' '.join(title.split())))
+        seen.add(str(e.uuid))
+
+    for uuid, (frag, type, offset, length) in (archived or {}).items():
+
+        if uuid not in seen:
+            rows.append((frag, type, ''))
+
+    return ['%s %s %s\n' % row for row in sorted(rows)]
+
+
+def write_frag_index(pitzdir, entities=(), lines=None):
+    """
+    Write out a line for every entity, using a rename so that readers
+    never see half an index.  If you already have the lines from
+    frag_index_lines, pass them in instead of the entities.
+
+    >>> import tempfile
+    >>> from pitz.entity import Entity
+    >>> pitzdir = tempfile.mkdtemp()
+    >>> e = Entity(title='indexed entity')
+    >>> index_path = write_frag_index(pitzdir, [e])
+    >>> read_frag_index(pitzdir) == [(e.frag, 'entity', 'indexed entity')]
+    True
+    """
+
+    if lines is None:
+        lines = frag_index_lines(entities)
+
+    path = frag_index_path(pitzdir)
+    tmp_path = path + '.tmp'
+
+    with open(tmp_path, 'w') as f:
+        f.writelines(lines)
+
+    os.rename(tmp_path, path)
+
+    return path
+
+
+def read_frag_index(pitzdir):
+    """
+    Return a list of (frag, type, title) tuples, or None if there is no
+    index.
+    """
+
+    path = frag_index_path(pitzdir)
+
+    if not os.path.isfile(path):
+        return
+
+    rows = []
+
+    with open(path) as f:
+
+        for line in f:
+
+            parts = line.rstrip('\n').split(' ', 2)
+
+            if len(parts) == 3:
+                rows.append(tuple(parts))
+
+    return rows
+
+
+def scan_pitzdir(pitzdir):
+    """
+    Build (frag, type, title) tuples by looking at file names when
+    there's no index yet.  I can't know the titles without loading the
+    files, so they're all empty.
+    """
+
+    from pitz.packfile import PackFile
+
+    rows = []
+
+    for filename in os.listdir(pitzdir):
+
+        m = entity_filename.match(filename)
+
+        if m:
+            rows.append((m.group(2)[:6], m.group(1), ''))
+
+    if PackFile.exists(pitzdir):
+
+        for frag, type, offset, length in \
+        PackFile(pitzdir).offsets.values():
+
+            rows.append((frag, type, ''))
+
+    return rows
+
+
+def matching_frags(pitzdir, types=None, prefix=None):
+    """
+    Return the sorted frags in the pitzdir, maybe limited to entities
+    of some types or to frags that start with prefix.
+    """
+
+    rows = read_frag_index(pitzdir)
+
+    if rows is None:
+        rows = scan_pitzdir(pitzdir)
+
+    return sorted(set(
+        frag for frag, type, title in rows
+        if (not types or type in types)
+        and (not prefix or frag.startswith(prefix))))
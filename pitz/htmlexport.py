@@ -0,0 +1,273 @@
+# vim: set expandtab ts=4 sw=4 filetype=python:
+
+"""
+Write the whole project out as a static HTML site, only rendering the
+pages that changed, and spreading the work over a process pool.
+
+Every page gets a signature built from the entities that show up on
+it.  An entity page depends on the entity, everything it points to
+(milestone, status, owner, ...), and everything that points to it
+(comments, activities, the tasks in a milestone, ...).  A bag page
+depends on every entity in the bag.
+
+The signatures from the last run live in a state file in the htmldir,
+so changing one task only regenerates that task's page, the pages of
+the entities it's connected to, and the bag pages that list it.
+"""
+
+from __future__ import with_statement
+
+import cPickle as pickle
+import hashlib
+import logging
+import os
+import time
+
+import pitz
+
+log = logging.getLogger('pitz.htmlexport')
+
+state_filename = 'pitz-html-state.pickle'
+
+# These are the project properties that get their own page, besides the
+# project itself.
+bag_pages = ['todo', 'milestones', 'tasks', 'components']
+
+# The forked workers find the project here.
+_proj = None
+_htmldir = None
+
+
+def pointers(e):
+    """
+    Yield every entity that e points to.
+    """
+
+    from pitz.entity import Entity
+
+    for v in e.itervalues():
+
+        if isinstance(v, Entity):
+            yield v
+
+        elif isinstance(v, (list, tuple)):
+
+            for vv in v:
+                if isinstance(vv, Entity):
+                    yield vv
+
+
+def stamp(e):
+    return '%s %s' % (e.uuid, e.get('modified_time'))
+
+
+def signature(entities, *extra):
+    """
+    Return a hash that changes whenever any of entities get modified.
+    """
+
+    h = hashlib.sha1(pitz.__version__)
+
+    for x in extra:
+        h.update(str(x))
+
+    for s in sorted(stamp(e) for e in entities):
+        h.update(s)
+
+    return h.hexdigest()
+
+
+def render_page(key):
+    """
+    Write out one page, using the project this process inherited.
+
+    Keys look like ('entity', uuid) or ('bag', 'todo').
+    """
+
+    kind, name = key
+
+    if kind == 'entity':
+
+        # Entity.to_html_file would bump the modified time, and then
+        # every page that shows this entity would look stale next time.
+        e = _proj.entities_by_uuid[name]
+
+        with open(os.path.join(_htmldir, e.html_filename), 'w') as f:
+            f.write(e.html)
+
+    elif name == 'proj':
+        _proj.to_html(_htmldir)
+
+    else:
+        getattr(_proj, name).to_html(_htmldir)
+
+    return key
+
+
+class HtmlExport(object):
+    """
+    Renders the pages of proj that changed into htmldir.
+    """
+
+    def __init__(self, proj, htmldir, workers=None, force=False):
+
+        self.proj = proj
+        self.htmldir = htmldir
+        self.workers = workers
+        self.force = force
+
+        self.rendered = 0
+        self.skipped = 0
+        self.elapsed = 0.0
+
+    @property
+    def state_path(self):
+        return os.path.join(self.htmldir, state_filename)
+
+    def load_state(self):
+
+        if os.path.isfile(self.state_path) and not self.force:
+
+            try:
+                with open(self.state_path, 'rb') as f:
+                    return pickle.load(f)
+
+            except Exception, ex:
+                log.warning("Ignoring bad state file: %s" % ex)
+
+        return dict()
+
+    def save_state(self, state):
+
+        tmp_path = self.state_path + '.tmp'
+
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(state, f, pickle.HIGHEST_PROTOCOL)
+
+        os.rename(tmp_path, self.state_path)
+
+    def dependencies(self):
+        """
+        Return a dictionary that maps every entity uuid to the set of
+        entities whose changes show up on that entity's page.
+        """
+
+        deps = dict((e.uuid, set([e])) for e in self.proj)
+
+        for e in self.proj:
+
+            for other in pointers(e):
+
+                deps[e.uuid].add(other)
+
+                if other.uuid in deps:
+                    deps[other.uuid].add(e)
+
+        return deps
+
+    def pages(self):
+        """
+        Return a list of (key, filename, signature) tuples for every page
+        in the site.
+        """
+
+        pages = []
+
+        for name in ['proj'] + bag_pages:
+
+            b = self.proj if name == 'proj' else getattr(self.proj, name)
+
+            pages.append((('bag', name), b.html_filename,
+                signature(b, name, b.title)))
+
+        for uuid, entities in self.dependencies().iteritems():
+
+            e = self.proj.entities_by_uuid[uuid]
+
+            pages.append((('entity', uuid), e.html_filename,
+                signature(entities)))
+
+        return pages
+
+    def stale_pages(self, pages, state):
+
+        for key, filename, sig in pages:
+
+            if state.get(filename) == sig \
+            and os.path.exists(os.path.join(self.htmldir, filename)):
+
+                continue
+
+            yield key, filename, sig
+
+    def render(self, keys):
+        """
+        Render the pages for keys, using a pool of processes when there
+        are enough of them to be worth it.
+        """
+
+        global _proj, _htmldir
+
+        _proj, _htmldir = self.proj, self.htmldir
+
+        try:
+
+            workers = self.workers
+
+            if workers is None:
+                from pitz.bag import number_of_cpus
+                workers = number_of_cpus()
+
+            if workers <= 1 or len(keys) < 2 * workers:
+                return [render_page(k) for k in keys]
+
+            import multiprocessing
+
+            # The workers get forked off right here, so they already
+            # have the project.
+            pool = multiprocessing.Pool(workers)
+
+            try:
+                return list(pool.imap_unordered(render_page, keys,
+                    chunksize=max(1, len(keys) / (workers * 4))))
+
+            finally:
+                pool.close()
+                pool.join()
+
+        finally:
+            _proj = _htmldir = None
+
+    def run(self):
+        """
+        Render whatever changed and return myself.
+        """
+
+        t = time.time()
+
+        if not os.path.isdir(self.htmldir):
+            os.makedirs(self.htmldir)
+
+        state = self.load_state()
+        pages = self.pages()
+
+        stale = list(self.stale_pages(pages, state))
+
+        self.render([key for key, filename, sig in stale])
+
+        # Start over from the current pages, so deleted entities drop
+        # out of the state file.
+        self.save_state(dict((filename, sig)
+            for key, filename, sig in pages))
+
+        self.rendered = len(stale)
+        self.skipped = len(pages) - len(stale)
+        self.elapsed = time.time() - t
+
+        return self
+
+    @property
+    def report(self):
+
+        return ("Rendered %d pages and skipped %d unchanged pages "
+            "in %.2f seconds." % (self.rendered, self.skipped, self.elapsed))
@@ -0,0 +1,610 @@
+# vim: set expandtab ts=4 sw=4 filetype=python:
+
+"""
+An append-only journal of activities.
+
+Every time somebody changes an attribute, pitz used to make a whole
+Activity entity, with its own uuid and yaml file, and sort it into the
+project.  Now I just append one fixed-size record::
+
+    created_time    8 bytes, a double, seconds since the epoch
+    entity         16 bytes, the uuid of the entity that changed
+    who_did_it     16 bytes, the uuid of the person, or all zeros
+    attr           24 bytes, the attribute that changed
+    old            20 bytes, what it used to be
+    new            20 bytes, what it is now
+
+Strings get padded out with NULs, so every record is 104 bytes.  Old
+and new values get cut to 16 characters plus an ellipsis, just like
+activity titles always did, so they fit.
+
+Records go in numbered segment files in pitzdir/journal.  When a
+segment holds records_per_segment records, I start the next one, so
+old segments can get rewritten without touching the one being
+written.
+
+An entity that gets destroyed gets a tombstone record, with an empty
+attr, and I drop every record before it for that entity.
+
+Compacting (see Journal.compact and pitz-compact-activities) merges
+quick runs of changes into one record, and rolls old records up into
+one summary per entity, person, and day.  A summary's attr starts with
+a *, followed by the attributes that changed, and its old value holds
+how many changes it stands for.  Status changes never get merged or
+rolled up, so the history of every status transition stays put.
+
+I don't read the segments until somebody asks for activities, and
+then I index the records by entity and by person.
+"""
+
+from __future__ import with_statement
+
+import collections
+import glob
+import os
+import shutil
+import struct
+import time
+from datetime import datetime, timedelta
+
+import pitz
+
+clepy = pitz.lazy_import('clepy')
+hashlib = pitz.lazy_import('hashlib')
+uuid = pitz.lazy_import('uuid')
+
+NOBODY = '\x00' * 16
+
+
+class Record(collections.namedtuple('Record',
+    'created_time entity who_did_it attr old new')):
+    """
+    One activity.  entity and who_did_it are uuids, or who_did_it is
+    None.
+    """
+
+    layout = struct.Struct('<d16s16s24s20s20s')
+
+    @classmethod
+    def unpack(cls, raw):
+
+        ts, entity, who, attr, old, new = cls.layout.unpack(raw)
+
+        return cls(
+            datetime.fromtimestamp(ts),
+            uuid.UUID(bytes=entity),
+            None if who == NOBODY else uuid.UUID(bytes=who),
+            attr.rstrip('\x00'),
+            old.rstrip('\x00'),
+            new.rstrip('\x00'))
+
+    @property
+    def packed(self):
+
+        ts = time.mktime(self.created_time.timetuple()) \
+        + self.created_time.microsecond / 1e6
+
+        return self.layout.pack(
+            ts,
+            self.entity.bytes,
+            self.who_did_it.bytes if self.who_did_it else NOBODY,
+            self.attr[:24],
+            self.old[:20],
+            self.new[:20])
+
+    @property
+    def uuid(self):
+        """
+        Records don't store a uuid, so make one out of the bytes.  The
+        same record always gets the same one.
+        """
+
+        return uuid.UUID(bytes=hashlib.md5(self.packed).digest())
+
+    @property
+    def is_tombstone(self):
+        return not self.attr
+
+    @property
+    def is_summary(self):
+        return self.attr.startswith('*')
+
+    @property
+    def attrs(self):
+        """
+        The attributes this record is about.  Summaries that ran out of
+        room end with +N instead of the last N names (see
+        summary_attr), so I can't list those.
+        """
+
+        if self.is_summary:
+            return [a for a in self.attr[1:].split(',')
+                if a and not a.startswith('+')]
+
+        return [self.attr]
+
+    @property
+    def unlisted(self):
+        """
+        How many attributes a summary had no room to name.
+        """
+
+        if self.is_summary and '+' in self.attr:
+            return int(self.attr.rsplit('+', 1)[1])
+
+        return 0
+
+    @property
+    def how_many(self):
+        """
+        How many changes this record stands for.
+        """
+
+        if self.is_summary:
+            return int(self.old)
+
+        return 1
+
+
+def squeeze(val, width=20):
+    """
+    Turn an attribute value into the short utf8 string a record holds,
+    never more than width bytes, and never with half a character on
+    the end.
+
+    >>> squeeze('a really really long value')
+    'a really really ...'
+    >>> squeeze(None)
+    'None'
+    >>> squeeze(u'\u263a' * 20).decode('utf8') == u'\u263a' * 6
+    True
+    """
+
+    if not isinstance(val, unicode):
+        val = str(val).decode('utf8', 'replace')
+
+    s = clepy.maybe_add_ellipses(val, 16).encode('utf8')
+
+    # Wide characters can still overflow the field, so back up to the
+    # last whole character that fits.
+    if len(s) > width:
+        s = s[:width].decode('utf8', 'ignore').encode('utf8')
+
+    return s
+
+
+# Changes to these never get merged or rolled up.
+never_compacted = set(['status'])
+
+
+def merge_runs(records, window):
+    """
+    Merge every change into the change before it on the same entity,
+    if the same person changed the same attribute within window.  The
+    merged record keeps the first old value and the last new value.
+
+    Records go in and come out oldest first.
+
+    >>> e = uuid.uuid4()
+    >>> t = datetime(2010, 1, 1)
+    >>> records = [Record(t + timedelta(minutes=m), e, None, 'pscore',
+    ...     str(m), str(m + 1)) for m in (0, 1, 2, 30)]
+    >>> [(r.old, r.new) for r in merge_runs(records, timedelta(minutes=5))]
+    [('0', '3'), ('30', '31')]
+    """
+
+    merged = []
+
+    # Maps each entity to the position of its newest record in merged.
+    newest = dict()
+
+    for r in records:
+
+        i = newest.get(r.entity)
+        prev = merged[i] if i is not None else None
+
+        if prev is not None \
+        and not r.is_summary and not prev.is_summary \
+        and r.attr not in never_compacted \
+        and (prev.who_did_it, prev.attr) == (r.who_did_it, r.attr) \
+        and r.created_time - prev.created_time <= window:
+
+            merged[i] = prev._replace(created_time=r.created_time,
+                new=r.new)
+
+        else:
+            newest[r.entity] = len(merged)
+            merged.append(r)
+
+    merged.sort(key=lambda r: r.created_time)
+
+    return merged
+
+
+def summary_attr(attrs, width=24):
+    """
+    Return the attr for a summary of changes to attrs, with as many
+    whole names as fit in width, and +N for the N that don't.
+
+    >>> summary_attr(['pscore', 'title'])
+    '*pscore,title'
+    >>> summary_attr(['description', 'milestone', 'components'])
+    '*description,+2'
+    """
+
+    for n in xrange(len(attrs), -1, -1):
+
+        names = attrs[:n]
+
+        if n < len(attrs):
+            names = names + ['+%d' % (len(attrs) - n)]
+
+        attr = '*' + ','.join(names)
+
+        if len(attr) <= width:
+            return attr
+
+
+def roll_up_days(records, before):
+    """
+    Replace every record older than before with one summary per
+    entity, person, and day, except for status changes.
+
+    >>> e = uuid.uuid4()
+    >>> t = datetime(2010, 1, 1)
+    >>> records = [Record(t + timedelta(hours=h), e, None, attr, '', '')
+    ...     for h, attr in [(1, 'pscore'), (2, 'title'), (3, 'status'),
+    ...         (4, 'pscore'), (30, 'pscore')]]
+    >>> [(r.attr, r.how_many) for r in roll_up_days(records, t +
+    ...     timedelta(days=7))]
+    [('status', 1), ('*pscore,title', 3), ('*pscore', 1)]
+    """
+
+    kept = []
+    days = collections.OrderedDict()
+
+    for r in records:
+
+        if r.created_time >= before or r.attr in never_compacted:
+            kept.append(r)
+
+        else:
+            days.setdefault(
+                (r.created_time.date(), r.entity, r.who_did_it),
+                []).append(r)
+
+    for (day, entity, who), rs in days.iteritems():
+
+        attrs = []
+
+        for r in rs:
+            for a in r.attrs:
+                if a not in attrs:
+                    attrs.append(a)
+
+        kept.append(Record(
+            max(r.created_time for r in rs),
+            entity,
+            who,
+            summary_attr(attrs),
+            str(sum(r.how_many for r in rs)),
+            ''))
+
+    kept.sort(key=lambda r: r.created_time)
+
+    return kept
+
+
+class Journal(object):
+    """
+    Read and append activity records for one pitzdir.  With no
+    pathname, I only keep records in memory.
+
+    >>> j = Journal()
+    >>> e, who = uuid.uuid4(), uuid.uuid4()
+    >>> r = j.record(e, 'status', 'unstarted', 'started', who)
+    >>> [x.new for x in j.for_entity(e)] == [x.new for x in j.for_person(who)]
+    True
+    >>> j.forget(e)
+    >>> j.for_entity(e)
+    []
+    """
+
+    segment_dirname = 'journal'
+    records_per_segment = 10000
+
+    def __init__(self, pathname=None):
+
+        self.pathname = pathname
+
+        # Every record, oldest first.  Records that a tombstone wiped
+        # out turn into None, so the positions below stay good.
+        self.records = []
+
+        # Maps entity and person uuids to positions in records.
+        self.by_entity = dict()
+        self.by_person = dict()
+
+        # Records I haven't written out yet.
+        self.unsaved = []
+
+        self.loaded = False
+
+    @property
+    def dirpath(self):
+
+        if self.pathname:
+            return os.path.join(self.pathname, self.segment_dirname)
+
+    @classmethod
+    def exists(cls, pathname):
+        return os.path.isdir(os.path.join(pathname, cls.segment_dirname))
+
+    def segments(self):
+        """
+        Return the paths to my segment files, oldest first.
+        """
+
+        if not self.dirpath:
+            return []
+
+        return sorted(glob.glob(os.path.join(self.dirpath, '*.seg')))
+
+    def segment_path(self, n):
+        return os.path.join(self.dirpath, '%06d.seg' % n)
+
+    @staticmethod
+    def read_segment(fp):
+
+        size = Record.layout.size
+
+        with open(fp, 'rb') as f:
+            data = f.read()
+
+        # Skip a torn record at the end, from a crash in mid-write.
+        return [Record.unpack(data[i:i + size])
+            for i in xrange(0, len(data) - len(data) % size, size)]
+
+    def _index(self, r):
+
+        if r.is_tombstone:
+
+            for i in self.by_entity.pop(r.entity, ()):
+                self.records[i] = None
+
+            return
+
+        i = len(self.records)
+        self.records.append(r)
+
+        self.by_entity.setdefault(r.entity, []).append(i)
+
+        if r.who_did_it:
+            self.by_person.setdefault(r.who_did_it, []).append(i)
+
+    def load(self):
+        """
+        Read every segment and index the records, then the ones I
+        haven't written out yet.
+        """
+
+        if self.loaded:
+            return self
+
+        self.loaded = True
+
+        self.records = []
+        self.by_entity.clear()
+        self.by_person.clear()
+
+        for fp in self.segments():
+            for r in self.read_segment(fp):
+                self._index(r)
+
+        for r in self.unsaved:
+            self._index(r)
+
+        return self
+
+    def append(self, r):
+
+        self.unsaved.append(r)
+
+        # Until I'm loaded, load indexes r along with everything else.
+        if self.loaded:
+            self._index(r)
+
+        return r
+
+    def record(self, entity, attr, old_val, new_val, who_did_it=None,
+        created_time=None):
+        """
+        Append a record that attr on entity changed from old_val to
+        new_val.
+        """
+
+        return self.append(Record(
+            created_time or datetime.now(),
+            getattr(entity, 'uuid', entity),
+            getattr(who_did_it, 'uuid', who_did_it),
+            attr,
+            squeeze(old_val),
+            squeeze(new_val)))
+
+    def forget(self, entity):
+        """
+        Drop every record about entity.
+        """
+
+        self.append(Record(datetime.now(), getattr(entity, 'uuid', entity),
+            None, '', '', ''))
+
+    def flush(self):
+        """
+        Write out the records I'm holding, starting a new segment
+        whenever the last one fills up.  Returns how many I wrote.
+        """
+
+        if not self.unsaved or not self.dirpath:
+            return 0
+
+        return self.write(self.take_unsaved())
+
+    def take_unsaved(self):
+        """
+        Hand over the records I haven't written out yet, so somebody
+        can pass them to write later.
+        """
+
+        unsaved, self.unsaved = self.unsaved, []
+        return unsaved
+
+    def write(self, unsaved):
+        """
+        Append records to my segments.  Returns how many I wrote.
+        """
+
+        if not unsaved:
+            return 0
+
+        if not os.path.isdir(self.dirpath):
+            os.mkdir(self.dirpath)
+
+        size = Record.layout.size
+        segments = self.segments()
+
+        if segments:
+            n = int(os.path.basename(segments[-1]).split('.')[0])
+            room = self.records_per_segment \
+            - os.path.getsize(segments[-1]) // size
+
+        else:
+            n, room = 0, 0
+
+        written = 0
+
+        while written < len(unsaved):
+
+            if room <= 0:
+                n, room = n + 1, self.records_per_segment
+
+            chunk = unsaved[written:written + room]
+
+            with open(self.segment_path(n), 'ab') as f:
+                f.write(''.join(r.packed for r in chunk))
+
+            written += len(chunk)
+            room -= len(chunk)
+
+        return written
+
+    def compact(self, window=timedelta(minutes=10),
+        keep=timedelta(days=90), now=None):
+        """
+        Merge runs of changes within window of each other, roll up
+        everything older than keep into daily summaries, and rewrite
+        every segment.
+
+        Returns how many records there were before and after.
+        """
+
+        if not self.dirpath:
+            raise ValueError("I need a pathname!")
+
+        self.load()
+
+        records = [r for r in self.records if r is not None]
+        before = len(records)
+
+        records = roll_up_days(merge_runs(records, window),
+            (now or datetime.now()) - keep)
+
+        # Write the new segments off to the side, then swap them in,
+        # so a crash leaves either the old journal or the new one.
+        tmp_path = self.dirpath + '.tmp'
+        old_path = self.dirpath + '.old'
+
+        for fp in (tmp_path, old_path):
+            if os.path.isdir(fp):
+                shutil.rmtree(fp)
+
+        os.mkdir(tmp_path)
+
+        for n, i in enumerate(
+            xrange(0, len(records), self.records_per_segment)):
+
+            with open(os.path.join(tmp_path, '%06d.seg' % (n + 1)),
+                'wb') as f:
+
+                f.write(''.join(r.packed for r in
+                    records[i:i + self.records_per_segment]))
+
+        if os.path.isdir(self.dirpath):
+            os.rename(self.dirpath, old_path)
+
+        os.rename(tmp_path, self.dirpath)
+
+        if os.path.isdir(old_path):
+            shutil.rmtree(old_path)
+
+        self.unsaved = []
+        self.records = []
+        self.by_entity.clear()
+        self.by_person.clear()
+
+        for r in records:
+            self._index(r)
+
+        return before, len(records)
+
+    def _live(self, positions):
+
+        self.load()
+
+        return [r for r in (self.records[i] for i in positions)
+            if r is not None]
+
+    def for_entity(self, entity):
+        """
+        Return the records about entity, oldest first.
+        """
+
+        self.load()
+
+        return self._live(self.by_entity.get(
+            getattr(entity, 'uuid', entity), ()))
+
+    def for_person(self, person):
+        """
+        Return the records of what person did, oldest first.
+        """
+
+        self.load()
+
+        return self._live(self.by_person.get(
+            getattr(person, 'uuid', person), ()))
+
+    def latest(self, k=None):
+        """
+        Return the k newest records, newest first, or all of them.
+        """
+
+        self.load()
+
+        found = []
+
+        for r in reversed(self.records):
+
+            if k is not None and len(found) >= k:
+                break
+
+            if r is not None:
+                found.append(r)
+
+        return found
+
+    def __len__(self):
+
+        self.load()
+
+        return sum(1 for r in self.records if r is not None)
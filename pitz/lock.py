@@ -0,0 +1,100 @@
+# vim: set expandtab ts=4 sw=4 filetype=python:
+
+"""
+Reader/writer locking on a pitzdir.
+
+Scripts that only read the project take a shared lock on pitzdir/pitz.pid,
+so lots of them can run at the same time.  Scripts that write take an
+exclusive lock.  The locks are fcntl locks, so the kernel lets go of them
+when a process dies, even if it crashed.
+"""
+
+import errno
+import fcntl
+import logging
+import os
+
+from pitz import PitzdirLocked
+
+log = logging.getLogger('pitz.lock')
+
+lock_filename = 'pitz.pid'
+
+
+def lock_pitzdir(pitzdir, shared=False, blocking=False):
+    """
+    Return an open file that holds a lock on pitzdir.
+
+    Raises PitzdirLocked when blocking is False and somebody else holds
+    a conflicting lock.
+
+    >>> import tempfile
+    >>> pitzdir = tempfile.mkdtemp()
+    >>> r1 = lock_pitzdir(pitzdir, shared=True)
+    >>> r2 = lock_pitzdir(pitzdir, shared=True)
+    >>> lock_pitzdir(pitzdir)
+    Traceback (most recent call last):
+        ...
+    PitzdirLocked: Sorry, another pitz process is using this pitzdir.
+    >>> unlock_pitzdir(r1)
+    >>> unlock_pitzdir(r2)
+    >>> w = lock_pitzdir(pitzdir)
+    >>> open(os.path.join(pitzdir, lock_filename)).read() == str(os.getpid())
+    True
+    >>> unlock_pitzdir(w)
+    """
+
+    lockfile = open(os.path.join(pitzdir, lock_filename), 'a+')
+
+    flags = fcntl.LOCK_SH if shared else fcntl.LOCK_EX
+
+    if not blocking:
+        flags |= fcntl.LOCK_NB
+
+    try:
+        fcntl.flock(lockfile, flags)
+
+    except IOError, ex:
+
+        lockfile.close()
+
+        if ex.errno not in (errno.EAGAIN, errno.EACCES):
+            raise
+
+        raise PitzdirLocked(locked_message(pitzdir))
+
+    # Writers leave their pid behind so that the next guy knows who to
+    # blame.
+    if not shared:
+        lockfile.seek(0)
+        lockfile.truncate()
+        lockfile.write(str(os.getpid()))
+        lockfile.flush()
+
+    log.debug("Got %s lock on %s"
+        % ('shared' if shared else 'exclusive', pitzdir))
+
+    return lockfile
+
+
+def unlock_pitzdir(lockfile):
+
+    fcntl.flock(lockfile, fcntl.LOCK_UN)
+    lockfile.close()
+
+
+def locked_message(pitzdir):
+    """
+    Explain who holds the lock, if I can figure that out.
+    """
+
+    try:
+        pid = int(open(os.path.join(pitzdir, lock_filename)).read())
+        os.kill(pid, 0)
+
+    except (IOError, OSError, ValueError):
+        return "Sorry, another pitz process is using this pitzdir."
+
+    else:
+        return ("Sorry, another pitz process is using this pitzdir.  "
+            "The last one to write was process %s." % pid)
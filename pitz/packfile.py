@@ -0,0 +1,321 @@
+# vim: set expandtab ts=4 sw=4 filetype=python:
+
+"""
+A packed alternative to one-yaml-file-per-entity.
+
+The pack is one append-only data file plus a small offset index.  Every
+record in the data file looks like this::
+
+    <type> <uuid> <length>
+    <length bytes of yaml>
+
+When an entity gets saved again, I just append a new record and point
+the index at it.  Deleting an entity appends a tombstone record (length
+-1) so the index can always be rebuilt from the data file alone.
+
+The index file has one line per live entity::
+
+    <uuid> <frag> <type> <offset> <length>
+"""
+
+from __future__ import with_statement
+
+import logging
+import os
+
+import pitz
+
+yaml = pitz.lazy_import('yaml')
+
+log = logging.getLogger('pitz.packfile')
+
+
+class PackFile(object):
+    """
+    Read and write entities stored in a pitzdir pack.
+
+    >>> import tempfile
+    >>> from pitz.entity import Entity
+    >>> pf = PackFile(tempfile.mkdtemp())
+    >>> e = Entity(title='packed entity')
+    >>> offset = pf.append(e)
+    >>> index_path = pf.save_index()
+    >>> e.uuid in pf and e.frag in pf
+    True
+    >>> pf.read(e.frag)['title']
+    'packed entity'
+    """
+
+    data_filename = 'entities.pack'
+    index_filename = 'entities.idx'
+
+    def __init__(self, pathname, data_filename=None, index_filename=None):
+
+        self.pathname = pathname
+
+        self.data_path = os.path.join(
+            pathname, data_filename or self.data_filename)
+
+        self.index_path = os.path.join(
+            pathname, index_filename or self.index_filename)
+
+        # Maps uuid strings to (frag, type, offset, length) tuples.
+        self.offsets = dict()
+        self.uuids_by_frag = dict()
+
+        if os.path.isfile(self.index_path):
+            self.load_index()
+
+        elif os.path.isfile(self.data_path):
+            self.rebuild_index()
+
+    @classmethod
+    def exists(cls, pathname):
+        """
+        Return True if pathname holds a pack.
+        """
+
+        return os.path.isfile(os.path.join(pathname, cls.data_filename))
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __contains__(self, key):
+        return self._uuid_for(key) in self.offsets
+
+    def _uuid_for(self, key):
+        """
+        Turn an entity, uuid, or frag into the uuid string I use as a
+        key.
+        """
+
+        key = str(getattr(key, 'uuid', key))
+        return self.uuids_by_frag.get(key, key)
+
+    def _remember(self, uuid, type, offset, length):
+
+        frag = uuid[:6]
+        self.offsets[uuid] = (frag, type, offset, length)
+        self.uuids_by_frag[frag] = uuid
+
+    def _forget(self, uuid):
+
+        if uuid in self.offsets:
+            frag = self.offsets.pop(uuid)[0]
+            self.uuids_by_frag.pop(frag, None)
+
+    def load_index(self):
+
+        self.offsets.clear()
+        self.uuids_by_frag.clear()
+
+        with open(self.index_path) as f:
+            for line in f:
+                if line.strip():
+                    uuid, frag, type, offset, length = line.split()
+                    self._remember(uuid, type, int(offset), int(length))
+
+        return self
+
+    def save_index(self):
+        """
+        Write the index out, using a rename so readers never see half
+        an index.
+        """
+
+        tmp_path = self.index_path + '.tmp'
+
+        with open(tmp_path, 'w') as f:
+            for offset, uuid, (frag, type, o, length) in sorted(
+                (v[2], k, v) for k, v in self.offsets.items()):
+
+                f.write('%s %s %s %d %d\n'
+                    % (uuid, frag, type, offset, length))
+
+        os.rename(tmp_path, self.index_path)
+        return self.index_path
+
+    def rebuild_index(self):
+        """
+        Scan the data file from front to back and remember where the
+        newest record for each uuid lives.
+        """
+
+        self.offsets.clear()
+        self.uuids_by_frag.clear()
+
+        with open(self.data_path, 'rb') as f:
+
+            while True:
+
+                header = f.readline()
+
+                if not header:
+                    break
+
+                type, uuid, length = header.split()
+                length = int(length)
+
+                if length < 0:
+                    self._forget(uuid)
+
+                else:
+                    self._remember(uuid, type, f.tell(), length)
+                    f.seek(length, os.SEEK_CUR)
+
+        return self
+
+    def _append_record(self, f, type, uuid, data):
+
+        f.seek(0, os.SEEK_END)
+
+        if data is None:
+            f.write('%s %s -1\n' % (type, uuid))
+            return
+
+        f.write('%s %s %d\n' % (type, uuid, len(data)))
+        offset = f.tell()
+        f.write(data)
+
+        return offset
+
+    def append(self, entity):
+        """
+        Add a new record for entity and return its offset.
+
+        Call save_index after you're done appending.
+        """
+
+        return self.append_many([entity])[0]
+
+    def append_many(self, entities):
+
+        return self.append_records(
+            [(e['type'], str(e.uuid), e.yaml) for e in entities])
+
+    def append_records(self, records):
+        """
+        Append (type, uuid, yaml) records and point the index at them.
+        A record with None for the yaml is a tombstone.  Returns the
+        offsets.
+        """
+
+        offsets = []
+
+        with open(self.data_path, 'ab') as f:
+
+            for type, uuid, data in records:
+
+                offset = self._append_record(f, type, uuid, data)
+
+                if data is None:
+                    self._forget(uuid)
+
+                else:
+                    self._remember(uuid, type, offset, len(data))
+
+                offsets.append(offset)
+
+        return offsets
+
+    def tombstones(self, entities):
+        """
+        Forget entities now, without touching the disk, and return the
+        tombstone records that make it stick, for append_records.
+        """
+
+        records = []
+
+        for e in entities:
+
+            uuid = self._uuid_for(e)
+
+            if uuid in self.offsets:
+                records.append((self.offsets[uuid][1], uuid, None))
+                self._forget(uuid)
+
+        return records
+
+    def delete(self, entity):
+        """
+        Remove entity from the pack by appending a tombstone.
+        """
+
+        records = self.tombstones([entity])
+
+        if records:
+            self.append_records(records)
+            return True
+
+    def read_raw(self, key):
+        """
+        Return the yaml text for the entity with uuid or frag key.  This
+        costs one seek.
+        """
+
+        frag, type, offset, length = self.offsets[self._uuid_for(key)]
+
+        with open(self.data_path, 'rb') as f:
+            f.seek(offset)
+            return f.read(length)
+
+    def read(self, key):
+        return yaml.load(self.read_raw(key))
+
+    def _walk_records(self):
+
+        with open(self.data_path, 'rb') as f:
+
+            for offset, uuid, type, length in sorted(
+                (o, u, t, l) for u, (frag, t, o, l)
+                in self.offsets.items()):
+
+                if f.tell() != offset:
+                    f.seek(offset)
+
+                yield uuid, type, f.read(length)
+
+    def __iter__(self):
+        """
+        Yield (type, yaml text) pairs for every live record, reading the
+        data file sequentially.
+        """
+
+        for uuid, type, data in self._walk_records():
+            yield type, data
+
+    def compact(self):
+        """
+        Rewrite the data file so it only holds the newest record for
+        every live entity.
+        """
+
+        tmp_path = self.data_path + '.tmp'
+        new_offsets = []
+
+        with open(tmp_path, 'wb') as out:
+
+            for uuid, type, data in self._walk_records():
+                offset = self._append_record(out, type, uuid, data)
+                new_offsets.append((uuid, type, offset, len(data)))
+
+        os.rename(tmp_path, self.data_path)
+
+        self.offsets.clear()
+        self.uuids_by_frag.clear()
+
+        for args in new_offsets:
+            self._remember(*args)
+
+        self.save_index()
+
+        return self
+
+    def remove(self):
+        """
+        Delete the data and index files.
+        """
+
+        for fp in (self.data_path, self.index_path):
+            if os.path.exists(fp):
+                os.unlink(fp)
@@ -1,14 +1,15 @@
 # vim: set expandtab ts=4 sw=4 filetype=python:
 
 import glob
+import heapq
 import logging
 import os
 import cPickle as pickle
+from datetime import datetime, timedelta
 
-import yaml
-import clepy
-
-from pitz.bag import Bag
+from pitz.bag import Bag, BagView, SearchResults
+from pitz.refindex import References
+from pitz.rollup import Rollups, pointer
 import pitz
 
 from pitz import by_pscore_and_milestone, \
@@ -16,9 +17,83 @@ by_milestone_status_pscore_created_time
 
 from pitz import entity
 
+yaml = pitz.lazy_import('yaml')
+
 log = logging.getLogger('pitz.project')
 
 
+class PendingSave(object):
+    """
+    The second half of a save, from Project.prepare_save.
+    """
+
+    def __init__(self, proj, updated, yaml_files, pickled, frag_lines,
+        textindex, journal_records=(), packed=(), tombstones=()):
+
+        self.proj = proj
+
+        # The entities that changed.
+        self.updated = updated
+
+        # (path, yaml) pairs to write out.
+        self.yaml_files = yaml_files
+
+        # Everything below is already a string, so writing it out never
+        # reads the project or its text index, which might be changing
+        # in another thread by then.
+        self.pickled = pickled
+        self.frag_lines = frag_lines
+        self.textindex = textindex
+
+        # Journal records, records for the pack, and tombstones for
+        # the archive, all waiting to get appended.
+        self.journal_records = journal_records
+        self.packed = packed
+        self.tombstones = tombstones
+
+    def write(self):
+        """
+        Write everything out and return the entities that changed.
+        """
+
+        from pitz.fragindex import write_frag_index
+        from pitz.textindex import TextIndex
+
+        proj = self.proj
+
+        proj.journal.write(self.journal_records)
+
+        if self.packed:
+            proj.packfile.append_records(self.packed)
+            proj.packfile.save_index()
+
+        if self.tombstones:
+            proj.archive.append_records(self.tombstones)
+            proj.archive.save_index()
+
+        for fp, y in self.yaml_files:
+
+            f = open(fp, 'w')
+            f.write(y)
+            f.close()
+
+        # Deleted entities don't show up in updated, so just rewrite
+        # the frag index every time, like the pickle.
+        write_frag_index(proj.pathname, lines=self.frag_lines)
+        TextIndex.save_pickled(proj.pathname, self.textindex)
+
+        if self.updated:
+            pitz.run_hook(
+                proj.pitzdir,
+                'after_saving_entities_to_yaml_files')
+
+        f = open(os.path.join(proj.pathname, 'project.pickle'), 'w')
+        f.write(self.pickled)
+        f.close()
+
+        return self.updated
+
+
 class Project(Bag):
     """
     The project keeps references to every entity.
@@ -51,6 +126,16 @@ class Project(Bag):
 
         self.rerun_sort_after_append = True
 
+        # Running tallies for milestones and components.
+        self.rollups = Rollups(self)
+
+        # Who points at whom.
+        self.references = References(self)
+
+        # Who changed what, and when.
+        from pitz.journal import Journal
+        self.journal = Journal(pathname)
+
         super(Project, self).__init__(title, uuid=uuid,
             pathname=pathname, entities=entities,
             order_method=order_method, **kwargs)
@@ -62,6 +147,9 @@ class Project(Bag):
         # Tell all the entities to replace their pointers with objects.
         self.replace_pointers_with_objects()
 
+        if self.pathname:
+            self.count_archived_tasks()
+
         self.find_me()
 
     def append(self, e, rerun_sort_after_append=True):
@@ -75,6 +163,85 @@ class Project(Bag):
         # Make sure the entity remembers this project.
         e.project = self
 
+        self.rollups.update(e)
+        self.references.add(e)
+
+    def pop(self, index=-1):
+
+        e = super(Project, self).pop(index)
+
+        self.rollups.forget(e)
+        self.references.forget(e)
+
+        return e
+
+    def remove_many(self, entities):
+
+        removed = super(Project, self).remove_many(entities)
+
+        for e in removed:
+            self.rollups.forget(e)
+            self.references.forget(e)
+
+        return removed
+
+    def pointing_at(self, e, attr, archived=True, **d):
+        """
+        Like Bag.pointing_at, but I look up the entities pointing at e
+        in my reference index instead of checking everything I hold.
+
+        If archived entities point at e too, I load the archive first.
+        Pass archived=False when you only care about open work.
+        """
+
+        if archived and not self.archive_loaded and self.archive \
+        and self.archive.referrers(e, attr):
+
+            self.load_archive()
+
+        matches = [x for x in self.references.referrers(e, attr)
+            if x.matches_dict(**d)]
+
+        return BagView(self, matches, title='subset of %s' % self.title)
+
+    def matches_dict(self, **d):
+
+        if self.wants_archive(d):
+            self.load_archive()
+
+        return super(Project, self).matches_dict(**d)
+
+    def by_uuid(self, obj):
+        """
+        Like Bag.by_uuid, but when I don't have obj and the archive
+        does, I load the archive and look again.
+        """
+
+        found = super(Project, self).by_uuid(obj)
+
+        if found is obj and not self.archive_loaded and self.archive \
+        and obj in self.archive:
+
+            self.load_archive()
+            return super(Project, self).by_uuid(obj)
+
+        return found
+
+    def by_frag(self, frag):
+
+        try:
+            return super(Project, self).by_frag(frag)
+
+        except KeyError:
+
+            if self.archive_loaded or not self.archive \
+            or frag not in self.archive:
+
+                raise
+
+            self.load_archive()
+            return super(Project, self).by_frag(frag)
+
     def load_entities_from_yaml_files(self, pathname=None):
         """
         Loads all the files matching pathglob into this project.
@@ -110,14 +277,439 @@ class Project(Bag):
             C.from_yaml_file(fp, self)
 
         self.rerun_sort_after_append = True
+
+        if self.packfile is not None:
+            self.load_entities_from_packfile()
+
+        return self
+
+    @property
+    def packfile(self):
+        """
+        Return the PackFile for this project's pitzdir, or None if the
+        pitzdir doesn't use the packed format.
+        """
+
+        from pitz.packfile import PackFile
+
+        if getattr(self, '_packfile', None) is None \
+        and self.pathname and PackFile.exists(self.pathname):
+
+            self._packfile = PackFile(self.pathname)
+
+        return getattr(self, '_packfile', None)
+
+    @property
+    def archive(self):
+        """
+        Return the Archive for this project's pitzdir, or None if
+        nothing has been archived.
+        """
+
+        from pitz.archive import Archive
+
+        if getattr(self, '_archive', None) is None \
+        and self.pathname and Archive.exists(self.pathname):
+
+            self._archive = Archive(self.pathname)
+
+        return getattr(self, '_archive', None)
+
+    @property
+    def archive_loaded(self):
+        return getattr(self, '_archive_loaded', False)
+
+    def load_archive(self):
+        """
+        Stream every archived entity back into this project.  I only
+        do this once, and only when somebody asks about closed work.
+        """
+
+        if self.archive_loaded or not self.archive:
+            return self
+
+        self._archive_loaded = True
+
+        log.debug("Loading %d archived entities" % len(self.archive))
+
+        rerun_sort_after_append = self.rerun_sort_after_append
+        self.rerun_sort_after_append = False
+
+        loaded = []
+
+        for classname, data in self.archive:
+
+            d = yaml.load(data)
+
+            if d and d['uuid'] not in self.entities_by_uuid:
+                loaded.append(self.classes[classname](self, **d))
+
+        self.rerun_sort_after_append = rerun_sort_after_append
+
+        for e in loaded:
+            e.replace_pointers_with_objects()
+
+        self.order()
+
+        return self
+
+    def count_archived_tasks(self):
+        """
+        Count archived tasks toward their milestones and components,
+        so progress views come out the same whether or not the archive
+        is loaded.
+        """
+
+        archive = self.archive
+
+        if not archive:
+            return
+
+        for u, by_attr in archive.pointers.items():
+
+            if u in self.entities_by_uuid or archive.type_of(u) != 'task':
+                continue
+
+            def one(attr):
+                return (list(by_attr.get(attr, ())) or [None])[0]
+
+            self.rollups.forget(u)
+            self.rollups.count(u, one('milestone'),
+                by_attr.get('components', ()),
+                one('status'), one('estimate'))
+
+    def wants_archive(self, d):
+        """
+        Return True if filtering on d could match archived entities.
+        """
+
+        if self.archive_loaded or not self.archive:
+            return False
+
+        if 'status' in d:
+
+            vals = d['status']
+
+            if not isinstance(vals, (list, tuple)):
+                vals = [vals]
+
+            closed = set(pointer(s) for s in
+                entity.Status.by_titles(self, 'finished', 'abandoned')
+                if s is not None)
+
+            for v in vals:
+                if v in ('finished', 'abandoned') or pointer(v) in closed:
+                    return True
+
+        for attr in ('uuid', 'frag'):
+            if attr in d and d[attr] in self.archive:
+                return True
+
+        return False
+
+    def archive_closed_tasks(self, days=30):
+        """
+        Move every task that got finished or abandoned, and hasn't
+        changed in days, into the archive, along with its comments and
+        activities.
+
+        Returns the number of entities archived.
+        """
+
+        if not self.pathname or not os.path.isdir(self.pathname):
+            raise ValueError("I need a pathname!")
+
+        closed = set(pointer(s) for s in
+            entity.Status.by_titles(self, 'finished', 'abandoned')
+            if s is not None)
+
+        cutoff = datetime.now() - timedelta(days=days)
+
+        moving = [e for e in self
+            if e['type'] == 'task'
+            and pointer(e.get('status')) in closed
+            and e['modified_time'] < cutoff]
+
+        # Bring along everything that hangs off those tasks, and
+        # anything that hangs off that, and so on.
+        seen = set(e.uuid for e in moving)
+
+        for e in moving:
+            for child in self.references.referrers(e, 'entity'):
+                if child.uuid not in seen:
+                    seen.add(child.uuid)
+                    moving.append(child)
+
+        if not moving:
+            return 0
+
+        from pitz.archive import Archive
+
+        archive = self.archive or Archive(self.pathname)
+
+        for e in moving:
+            e['yaml_file_saved'] = datetime.now()
+
+        archive.append_many(moving)
+        archive.save_index()
+        self._archive = archive
+
+        packfile = self.packfile
+
+        self.remove_many(moving)
+
+        for e in moving:
+
+            fp = os.path.join(self.pathname, e.yaml_filename)
+
+            if os.path.exists(fp):
+                os.unlink(fp)
+
+            if packfile is not None:
+                packfile.delete(e)
+
+        if packfile is not None:
+            packfile.save_index()
+
+        self.count_archived_tasks()
+
+        # The pickle still has everything I just moved, so write a new
+        # one, and the frag and text indexes while I'm at it.
+        self.save_entities_to_yaml_files()
+
+        return len(moving)
+
+    @property
+    def rst_cache(self):
+        """
+        Return the RstCache for my descriptions, which keeps a copy of
+        everything it renders in pitzdir/rstcache.
+        """
+
+        from pitz.rstcache import RstCache, cache_dirname
+
+        if not self.pathname:
+            return
+
+        directory = os.path.join(self.pathname, cache_dirname)
+
+        if getattr(self, '_rst_cache', None) is None \
+        or self._rst_cache.directory != directory:
+
+            self._rst_cache = RstCache(directory=directory)
+
+        return self._rst_cache
+
+    @property
+    def textindex(self):
+        """
+        Return the TextIndex saved in this project's pitzdir, or None if
+        the project hasn't been saved since text indexing showed up.
+        """
+
+        from pitz.textindex import TextIndex
+
+        if getattr(self, '_textindex', None) is None \
+        and self.pathname and TextIndex.exists(self.pathname):
+
+            self._textindex = TextIndex.load(self.pathname)
+
+        return getattr(self, '_textindex', None)
+
+    def update_textindex(self, updated_entities):
+        """
+        Reindex the entities that changed, drop the ones that went away,
+        and save the index.
+        """
+
+        ti = self.reindex(updated_entities)
+        ti.save(self.pathname)
+
+        return ti
+
+    def reindex(self, updated_entities):
+        """
+        Bring my text index up to date in memory and return it.
+        """
+
+        from pitz.textindex import TextIndex
+
+        ti = self.textindex
+
+        if ti is None:
+            ti = self._textindex = TextIndex()
+            updated_entities = self
+
+        ti.add_many(updated_entities)
+
+        # Archived entities are still mine, even when I haven't loaded
+        # them, so only drop what really went away.
+        archive = self.archive
+
+        for uuid in set(ti.words_by_uuid) \
+        - set(str(e.uuid) for e in self):
+
+            if archive is None or uuid not in archive:
+                ti.remove(uuid)
+
+        return ti
+
+    def search(self, query, limit=10, highlight='*%s*'):
+        """
+        Return a SearchResults bag with the limit entities that best
+        match query, ranked with BM25 over the text index.  A limit of
+        0 or None means everything that matched.
+
+        Comments count toward the entity they're about, and activities
+        never show up.
+        """
+
+        from uuid import UUID
+        from pitz.textindex import TextIndex, make_snippet
+
+        ti = self.textindex
+
+        # Projects that haven't been saved get a throwaway index.
+        if ti is None:
+            ti = TextIndex()
+            ti.add_many(self)
+
+        ranked = ti.rank(query)
+
+        if not self.archive_loaded and self.archive is not None \
+        and any(uuid in self.archive for uuid in ranked):
+
+            self.load_archive()
+
+        scores = dict()
+
+        for uuid, score in ranked.iteritems():
+
+            e = self.entities_by_uuid.get(UUID(uuid))
+
+            if e is not None and e['type'] != 'activity':
+                scores[e.uuid] = score
+
+        if limit:
+            best = heapq.nlargest(limit, scores, key=scores.get)
+        else:
+            best = scores.keys()
+
+        words = ti.query_words(query)
+        snippets = dict()
+
+        for uuid in best:
+
+            e = self.entities_by_uuid[uuid]
+
+            comments = [c for c in self.references.referrers(e, 'entity')
+                if c['type'] == 'comment']
+
+            texts = [e.get('description')] \
+            + [c.get('description') for c in comments] \
+            + [e.get('title')]
+
+            for text in texts:
+
+                snippet = make_snippet(text, words, highlight=highlight)
+
+                if snippet:
+                    snippets[uuid] = snippet
+                    break
+
+        return SearchResults(
+            title='Search results for %s' % query,
+            pathname=self.pathname,
+            entities=[self.entities_by_uuid[uuid] for uuid in best],
+            scores=dict((uuid, scores[uuid]) for uuid in best),
+            snippets=snippets)
+
+    def load_entities_from_packfile(self):
+        """
+        Stream every entity out of the pack and into this project.
+        """
+
+        self.rerun_sort_after_append = False
+
+        for classname, data in self.packfile:
+
+            d = yaml.load(data)
+
+            if d:
+                self.classes[classname](self, **d)
+
+        self.rerun_sort_after_append = True
+        self.order()
+
         return self
 
+    def pack(self):
+        """
+        Convert the pitzdir to the packed format: write every entity into
+        the pack and then delete the individual yaml files.
+
+        Returns the number of entities packed.
+        """
+
+        if not self.pathname or not os.path.isdir(self.pathname):
+            raise ValueError("I need a pathname!")
+
+        from pitz.packfile import PackFile
+
+        packfile = PackFile(self.pathname)
+        packfile.append_many(self)
+        packfile.save_index()
+        self._packfile = packfile
+
+        for e in self:
+            fp = os.path.join(self.pathname, e.yaml_filename)
+            if os.path.exists(fp):
+                os.unlink(fp)
+
+        self.to_pickle()
+
+        return len(packfile)
+
+    def unpack(self):
+        """
+        The reverse of pack: write every entity out to its own yaml file
+        and then delete the pack.
+
+        Returns the number of yaml files written.
+        """
+
+        if self.packfile is None:
+            raise ValueError("%s isn't packed." % self.pathname)
+
+        for e in self:
+            e.to_yaml_file(self.pathname, force=True)
+
+        self.packfile.remove()
+        self._packfile = None
+
+        self.to_pickle()
+
+        return len(self)
+
     def save_entities_to_yaml_files(self, pathname=None):
         """
         Ask every entity to write itself out to YAML.
         Returns those entities that really wrote themselves out.
         """
 
+        return self.prepare_save(pathname).write()
+
+    def prepare_save(self, pathname=None):
+        """
+        Do the part of a save that needs me to hold still: figure out
+        which entities changed and turn them and me into strings.
+
+        Returns a PendingSave that does the rest, which is all the
+        writing to disk, and doesn't care if I change in the meantime.
+        """
+
+        from pitz.fragindex import frag_index_lines
+
         if pathname is None and self.pathname is None:
             raise ValueError("I need a pathname!")
 
@@ -129,17 +721,47 @@ class Project(Bag):
 
         pathname = pathname or self.pathname
 
-        updated_yaml_files = \
-        [e for e in self if e.to_yaml_file(self.pathname)]
+        self.journal.pathname = self.pathname
 
-        if updated_yaml_files:
-            pitz.run_hook(
-                self.pitzdir,
-                'after_saving_entities_to_yaml_files')
+        yaml_files = []
+        packed = []
+        updated_yaml_files = []
 
-        self.to_pickle()
+        packfile = self.packfile
+
+        for e in self:
+
+            if e.stale_yaml:
+
+                e['yaml_file_saved'] = datetime.now()
+
+                if packfile is not None:
+                    packed.append((e['type'], str(e.uuid), e.yaml))
+
+                else:
+                    yaml_files.append(
+                        (os.path.join(self.pathname, e.yaml_filename),
+                        e.yaml))
+
+                updated_yaml_files.append(e)
+
+        # Anything archived that changed since it got loaded back in is
+        # open work again, so it lives with the rest of it now.
+        archive = self.archive
+        tombstones = []
+
+        if archive is not None and self.archive_loaded:
+
+            tombstones = archive.tombstones(
+                [e for e in updated_yaml_files if e.uuid in archive])
 
-        return updated_yaml_files
+        return PendingSave(self, updated_yaml_files, yaml_files,
+            pickle.dumps(self),
+            frag_index_lines(self,
+                archive.offsets if archive is not None else None),
+            self.reindex(updated_yaml_files).dumps(),
+            self.journal.take_unsaved(),
+            packed, tombstones)
 
     @property
     def yaml(self):
@@ -197,6 +819,54 @@ class Project(Bag):
 
         return pf
 
+    def __getstate__(self):
+
+        # The pack and text indexes get reread from disk, and the lock
+        # belongs to just this process, so don't pickle them.
+        d = dict(super(Project, self).__getstate__())
+        d.pop('_packfile', None)
+        d.pop('_archive', None)
+        d.pop('_textindex', None)
+        d.pop('_rst_cache', None)
+        d.pop('lockfile', None)
+
+        # from_pickle rebuilds these as it appends.
+        d.pop('rollups', None)
+        d.pop('references', None)
+
+        # The journal lives in its own files.
+        d.pop('journal', None)
+
+        # Archived entities stay in the archive, even after somebody
+        # loaded them, so the next command starts with just open work.
+        if d.pop('_archive_loaded', False):
+
+            cold = self.archive.offsets
+
+            def hot(e):
+                return str(e.uuid) not in cold
+
+            d['_elements'] = filter(hot, self._elements)
+
+            for attr in ('entities_by_uuid', 'entities_by_frag',
+                'entities_by_yaml_filename', 'entities_by_title'):
+
+                d[attr] = dict(
+                    (k, e) for k, e in getattr(self, attr).iteritems()
+                    if hot(e))
+
+        return d
+
+    def __setstate__(self, d):
+
+        super(Project, self).__setstate__(d)
+
+        self.rollups = Rollups(self)
+        self.references = References(self)
+
+        from pitz.journal import Journal
+        self.journal = Journal(self.pathname)
+
     def setup_defaults(self):
 
         for cls in self.classes.values():
@@ -213,6 +883,9 @@ class Project(Bag):
         p = pickle.load(open(pf))
         for e in p:
             p.append(e)
+            p.entities_by_title.setdefault((e.__class__, e.title), e)
+
+        p.count_archived_tasks()
 
         p.loaded_from = 'pickle'
         p._shell_mode = False
@@ -250,14 +923,22 @@ class Project(Bag):
         # Walk up the file system.
         starting_path = os.getcwd()
 
-        # Walk up...
-        for dir in clepy.walkup(starting_path):
+        # Walk up.  This is what clepy.walkup does, but pitz-frags runs
+        # on every tab completion and clepy is slow to import.
+        dir = starting_path
+
+        while True:
 
             p = os.path.join(dir, 'pitzdir')
 
             if os.path.isdir(p):
                 return os.path.abspath(p)
 
+            if os.path.dirname(dir) == dir:
+                break
+
+            dir = os.path.dirname(dir)
+
 
         # Walk down...
         if walkdown:
@@ -277,6 +958,9 @@ class Project(Bag):
         pitzdir.
         """
 
+        from pitz.archive import Archive
+        from pitz.packfile import PackFile
+
         # If we have a project.pickle, compare the timestamp of the
         # pickle to the timestamps of all the yaml files.
         pickle_path = os.path.join(pitzdir, 'project.pickle')
@@ -285,7 +969,9 @@ class Project(Bag):
             pickle_timestamp = os.stat(pickle_path).st_mtime
 
             newest_yaml = max([os.stat(f).st_mtime
-                for f in glob.glob(os.path.join(pitzdir, '*.yaml'))])
+                for f in glob.glob(os.path.join(pitzdir, '*.yaml'))
+                + glob.glob(os.path.join(pitzdir, PackFile.data_filename))
+                + glob.glob(os.path.join(pitzdir, Archive.data_filename))])
 
             if pickle_timestamp >= newest_yaml:
                 return cls.from_pickle(pickle_path)
@@ -303,12 +989,8 @@ class Project(Bag):
 
         return "index.html"
 
-    @property
-    def html(self):
-
-        tmpl = self.e.get_template(self.jinja_template)
-
-        return tmpl.render(proj=self)
+    def _html_context(self):
+        return dict(proj=self)
 
     @classmethod
     def from_yaml_file(cls, fp):
@@ -347,10 +1029,13 @@ class Project(Bag):
     @property
     def todo(self):
 
+        finished, abandoned = entity.Status.by_titles(self,
+            'finished', 'abandoned')
+
         b = (
             self(type='task')
-            .does_not_match_dict(status=entity.Status(title='finished'))
-            .does_not_match_dict(status=entity.Status(title='abandoned')))
+            .does_not_match_dict(status=finished)
+            .does_not_match_dict(status=abandoned))
 
         b.title = '%s: stuff to do' % self.title
         b._html_filename = 'todo.html'
@@ -360,21 +1045,51 @@ class Project(Bag):
     @property
     def first_ten_tasks(self):
 
-        first_ten_tasks = self.todo[:10]
+        # Look these up once, instead of once per entity.
+        closed = set(pointer(s) for s in
+            entity.Status.by_titles(self, 'finished', 'abandoned')
+            if s is not None)
+
+        first_ten_tasks = self.top(10, predicate=lambda e:
+            e['type'] == 'task' and pointer(e.get('status')) not in closed)
+
         first_ten_tasks.title = 'First ten tasks from to-do list'
         return first_ten_tasks
 
+    def newest_activities(self, how_many=None):
+        """
+        Return a bag with the how_many newest activities, or all of
+        them.  I only turn that many journal records into activities.
+        """
+
+        if how_many is None:
+            b = self(type='activity')
+
+        else:
+            # Activities from before the journal are still entities.
+            b = self.top(how_many, pitz.by_descending_created_time,
+                predicate=lambda e: e['type'] == 'activity')
+
+        for a in entity.Activity.from_records(self,
+            self.journal.latest(how_many)):
+
+            b.append(a, rerun_sort_after_append=False)
+
+        return b.order(pitz.by_descending_created_time)
+
     @property
     def recent_activity(self):
-        return Bag("Recent activity", entities=self.activities[:10],
-            order_method=pitz.by_descending_created_time)
+
+        b = self.newest_activities(10).top(10)
+        b.title = "Recent activity"
+
+        return b
 
     # TODO: replace all these properties with some metaclass tomfoolery.
     @property
     def activities(self):
-        b = self(type='activity')
+        b = self.newest_activities()
         b.title = "Activities"
-        b.order(pitz.by_descending_created_time)
         return b
 
     @property
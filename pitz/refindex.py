@@ -0,0 +1,148 @@
+# vim: set expandtab ts=4 sw=4 filetype=python:
+
+"""
+Remember which entities point at which, so finding the comments on a
+task, or the activities on it, doesn't mean scanning the whole
+project.
+
+Any attribute that holds an entity, a uuid, or a list of them counts
+as a pointer: a comment's entity, an activity's who_did_it, a task's
+milestone or tags, and so on.
+
+The project tells me about every entity when it joins or leaves, and
+every entity tells me when one of its attributes changes (see
+Entity.__setitem__).
+
+When an entity leaves the project, I forget what it points at, but I
+remember what points at it.  That way self_destruct can still find
+the comments on a task after the task is gone.
+"""
+
+from pitz.rollup import pointer
+
+import pitz
+
+uuid = pitz.lazy_import('uuid')
+
+
+def targets(val):
+    """
+    Return the set of uuids that val points at.
+
+    >>> u = uuid.UUID(int=1)
+    >>> targets(u) == set([u])
+    True
+    >>> targets([u, 'not a pointer', None]) == set([u])
+    True
+    >>> targets('matt')
+    set([])
+    """
+
+    if isinstance(val, (list, tuple)):
+        vals = val
+    else:
+        vals = [val]
+
+    return set(t for t in (pointer(v) for v in vals)
+        if isinstance(t, uuid.UUID))
+
+
+class References(object):
+    """
+    Maps each entity's uuid to the entities that point at it, grouped
+    by the attribute they point with.
+    """
+
+    def __init__(self, project):
+
+        self.project = project
+
+        # target uuid -> attribute -> set of uuids pointing at target.
+        self.pointed_at = dict()
+
+        # source uuid -> attribute -> set of uuids source points at.
+        # This is what lets me take a pointer back without knowing the
+        # attribute's old value.
+        self.pointers = dict()
+
+    def _link(self, source, attr, target):
+
+        self.pointed_at.setdefault(target, dict())\
+        .setdefault(attr, set()).add(source)
+
+    def _unlink(self, source, attr, target):
+
+        by_attr = self.pointed_at.get(target)
+
+        if by_attr is None or attr not in by_attr:
+            return
+
+        by_attr[attr].discard(source)
+
+        if not by_attr[attr]:
+            del by_attr[attr]
+
+        if not by_attr:
+            del self.pointed_at[target]
+
+    def update(self, e, attr):
+        """
+        Catch up with whatever e[attr] points at now.
+        """
+
+        if attr == 'uuid':
+            return
+
+        mine = self.pointers.setdefault(e.uuid, dict())
+
+        old = mine.get(attr, set())
+        new = targets(e.get(attr))
+
+        if old == new:
+            return
+
+        for t in old - new:
+            self._unlink(e.uuid, attr, t)
+
+        for t in new - old:
+            self._link(e.uuid, attr, t)
+
+        if new:
+            mine[attr] = new
+        else:
+            mine.pop(attr, None)
+
+    def add(self, e):
+        """
+        Record everything e points at.
+        """
+
+        for attr in e:
+            self.update(e, attr)
+
+    def forget(self, e):
+        """
+        Take back everything e points at.
+        """
+
+        for attr, ts in self.pointers.pop(e.uuid, dict()).items():
+            for t in ts:
+                self._unlink(e.uuid, attr, t)
+
+    def referrers(self, e, attr):
+        """
+        Return the entities in my project whose attr points at e.
+        """
+
+        sources = self.pointed_at.get(pointer(e), dict()).get(attr, ())
+
+        found = []
+
+        for u in list(sources):
+
+            source = self.project.entities_by_uuid.get(u)
+
+            if source is not None:
+                found.append(source)
+
+        return found
@@ -0,0 +1,224 @@
+# vim: set expandtab ts=4 sw=4 filetype=python:
+
+"""
+Keep running tallies of the tasks in every milestone and component, so
+progress views don't have to scan the whole project.
+
+Every task tells its project's Rollups when its milestone, status,
+estimate, or components change (see Entity.__setitem__), and when it
+joins or leaves the project.  I take back whatever the task counted
+toward before and add in what it counts toward now.
+
+I store everything by uuid, so it doesn't matter whether a task holds
+a pointer or the real object, and I look up estimate points when
+somebody asks, so changing an estimate's points doesn't leave me
+stale.
+"""
+
+import collections
+
+
+def pointer(x):
+    """
+    Return the uuid for x, whether x is an entity or already a uuid.
+
+    >>> pointer(None) is None
+    True
+    """
+
+    return getattr(x, 'uuid', x)
+
+
+class Rollup(object):
+    """
+    Tallies for one milestone or component.
+
+    >>> r = Rollup(None)
+    >>> r.number_of_tasks()
+    0
+    """
+
+    def __init__(self, project):
+
+        self.project = project
+
+        # Maps (status uuid, estimate uuid) to how many tasks have that
+        # status and estimate.  There's only a handful of statuses and
+        # estimates, so this stays small no matter how many tasks I
+        # count.
+        self.counts = collections.defaultdict(int)
+
+    def _wanted(self, statuses):
+
+        if statuses is None:
+            return None
+
+        return set(pointer(s) for s in statuses)
+
+    def _lookup(self, u):
+
+        if self.project is None:
+            return u
+
+        return self.project.entities_by_uuid.get(u, u)
+
+    def number_of_tasks(self, statuses=None):
+        """
+        How many tasks have any of these statuses, or any status at
+        all if statuses is None.
+        """
+
+        wanted = self._wanted(statuses)
+
+        return sum(n for (s, est), n in self.counts.iteritems()
+            if wanted is None or s in wanted)
+
+    def points(self, statuses=None):
+        """
+        Add up the estimate points of the tasks with these statuses.
+        """
+
+        wanted = self._wanted(statuses)
+
+        total = 0
+
+        for (s, est), n in self.counts.iteritems():
+
+            if wanted is None or s in wanted:
+
+                estimate = self._lookup(est)
+
+                if hasattr(estimate, 'get'):
+                    total += n * (estimate.get('points') or 0)
+
+        return total
+
+    @property
+    def tasks_by_status(self):
+        """
+        Map each status to how many tasks have it.
+        """
+
+        d = collections.defaultdict(int)
+
+        for (s, est), n in self.counts.iteritems():
+            d[self._lookup(s)] += n
+
+        return dict(d)
+
+    @property
+    def points_by_status(self):
+        """
+        Map each status to the estimate points of the tasks that have
+        it.
+        """
+
+        return dict((s, self.points([s])) for s in self.tasks_by_status)
+
+    def progress(self, finished, statuses):
+        """
+        Return how many tasks are finished, how many have any of
+        statuses, and the percent complete.
+        """
+
+        a = self.number_of_tasks([finished])
+        b = self.number_of_tasks(statuses)
+
+        if b:
+            return a, b, 100 * (float(a) / b)
+
+        else:
+            return a, b, 0.0
+
+
+class Rollups(object):
+    """
+    All the tallies for one project.
+    """
+
+    # A task only needs recounting when one of these changes.
+    watched = set(['type', 'milestone', 'status', 'estimate', 'components'])
+
+    def __init__(self, project):
+
+        self.project = project
+
+        # Maps a milestone or component uuid to its Rollup.
+        self.rollups = dict()
+
+        # Maps a task uuid to what it counts toward right now, so I
+        # can take it back later.
+        self.counted = dict()
+
+    def __getitem__(self, e):
+        """
+        Return the Rollup for milestone or component e.  If no task
+        points at e, the Rollup is empty.
+        """
+
+        return self.rollups.get(pointer(e)) or Rollup(self.project)
+
+    def _tally(self, groups, key, delta):
+
+        for g in groups:
+
+            if g is None:
+                continue
+
+            if g not in self.rollups:
+                self.rollups[g] = Rollup(self.project)
+
+            counts = self.rollups[g].counts
+            counts[key] += delta
+
+            if not counts[key]:
+                del counts[key]
+
+    def forget(self, e):
+        """
+        Take back whatever e counted toward.
+        """
+
+        u = pointer(e)
+
+        if u in self.counted:
+            groups, key = self.counted.pop(u)
+            self._tally(groups, key, -1)
+
+    def update(self, e):
+        """
+        Count e toward its milestone and components, replacing what it
+        counted toward before.
+        """
+
+        self.forget(e)
+
+        if e.get('type') != 'task':
+            return
+
+        self.count(e.uuid, e.get('milestone'), e.get('components') or [],
+            e.get('status'), e.get('estimate'))
+
+    def count(self, task, milestone, components, status, estimate):
+        """
+        Count the task with uuid task, even if it isn't in my project
+        right now.  The archive uses this for tasks it holds.
+        """
+
+        groups = set([pointer(milestone)]
+            + [pointer(c) for c in components])
+
+        key = pointer(status), pointer(estimate)
+
+        self.counted[task] = groups, key
+        self._tally(groups, key, 1)
+
+    def rebuild(self, entities):
+
+        self.rollups.clear()
+        self.counted.clear()
+
+        for e in entities:
+            self.update(e)
+
+        return self
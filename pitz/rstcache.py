@@ -0,0 +1,233 @@
+# vim: set expandtab ts=4 sw=4 filetype=python:
+
+"""
+Turning reStructuredText into HTML with docutils is the slowest thing
+pitz does, and descriptions hardly ever change, so I remember the HTML
+for every description I render, keyed by a hash of the text.
+
+The cache lives in memory, and throws out the least recently used
+entries once it holds max_entries of them.  A project with a pathname
+has its own cache (see Project.rst_cache) that also keeps a copy of
+everything in pitzdir/rstcache, so pitz-html, the webapp, and plain
+old Entity.html all share the work.  That directory holds at most
+max_files pages; saving one more throws out the ones used longest ago.
+"""
+
+from __future__ import with_statement
+
+import collections
+import hashlib
+import logging
+import os
+import threading
+
+log = logging.getLogger('pitz.rstcache')
+
+cache_dirname = 'rstcache'
+
+
+def publish(text):
+    """
+    Return the HTML body for reST text.  If docutils chokes, return the
+    text inside a pre tag instead.
+    """
+
+    from docutils.core import publish_parts
+    from docutils.utils import SystemMessage
+
+    try:
+        return publish_parts(text, writer_name='html')['html_body']
+
+    except SystemMessage, ex:
+
+        log.error("Couldn't render description as HTML")
+        log.exception(ex)
+
+        return """<pre>%s</pre>""" % text
+
+
+class RstCache(object):
+    """
+    Maps description hashes to HTML.
+
+    >>> c = RstCache(max_entries=2)
+    >>> c.render('*a*')
+    u'<div class="document">\\n<p><em>a</em></p>\\n</div>\\n'
+    >>> c.misses, c.hits
+    (1, 0)
+    >>> html = c.render('*a*')
+    >>> c.misses, c.hits
+    (1, 1)
+    """
+
+    def __init__(self, max_entries=1000, directory=None, max_files=5000):
+
+        self.max_entries = max_entries
+        self.directory = directory
+        self.max_files = max_files
+
+        # How many files are in directory, or None if I haven't looked.
+        self.files = None
+
+        self.entries = collections.OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+
+        # The webapp renders on lots of threads at once.
+        self.mutex = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    @staticmethod
+    def key(text):
+
+        if isinstance(text, unicode):
+            text = text.encode('utf8')
+
+        return hashlib.sha1(text).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, '%s.html' % key)
+
+    def _remember(self, key, html):
+
+        self.entries[key] = html
+
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def _read_from_disk(self, key):
+
+        if self.directory and os.path.isfile(self.path(key)):
+
+            with open(self.path(key)) as f:
+                html = f.read().decode('utf8')
+
+            # Touch it, so _prune knows it's still in use.
+            try:
+                os.utime(self.path(key), None)
+
+            except OSError:
+                pass
+
+            return html
+
+    def _cached_files(self):
+
+        return [os.path.join(self.directory, f)
+            for f in os.listdir(self.directory) if f.endswith('.html')]
+
+    def _prune(self):
+        """
+        Once the directory holds more than max_files pages, delete the
+        ones used longest ago, down to nine tenths of max_files so I
+        don't have to do this again on the very next save.
+        """
+
+        if self.files is None:
+            self.files = len(self._cached_files())
+
+        if self.files <= self.max_files:
+            return
+
+        by_age = sorted((os.path.getmtime(fp), fp)
+            for fp in self._cached_files())
+
+        doomed = by_age[:len(by_age) - self.max_files * 9 // 10]
+
+        for mtime, fp in doomed:
+
+            try:
+                os.unlink(fp)
+
+            except OSError:
+                pass
+
+        self.files = len(by_age) - len(doomed)
+
+    def _write_to_disk(self, key, html):
+
+        if not self.directory:
+            return
+
+        try:
+
+            if not os.path.isdir(self.directory):
+                os.mkdir(self.directory)
+
+            # Write to a temporary file and rename so that a reader in
+            # another process never sees half a file.
+            tmp_path = '%s.%d.tmp' % (self.path(key), os.getpid())
+
+            with open(tmp_path, 'w') as f:
+                f.write(html.encode('utf8'))
+
+            os.rename(tmp_path, self.path(key))
+
+            with self.mutex:
+
+                if self.files is not None:
+                    self.files += 1
+
+                self._prune()
+
+        except (IOError, OSError), ex:
+            log.debug("Couldn't write %s to the rst cache: %s" % (key, ex))
+
+    def render(self, text):
+        """
+        Return the HTML for reST text, rendering it only if I haven't
+        seen it before.
+        """
+
+        text = text or ''
+        key = self.key(text)
+
+        with self.mutex:
+
+            html = self.entries.pop(key, None)
+
+            if html is not None:
+
+                self.hits += 1
+
+                # Put it back at the end, since it's the most recently
+                # used.
+                self.entries[key] = html
+
+                return html
+
+        html = self._read_from_disk(key)
+        hit = html is not None
+
+        if not hit:
+            html = publish(text)
+            self._write_to_disk(key, html)
+
+        with self.mutex:
+
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+            self._remember(key, html)
+
+        return html
+
+    def clear(self):
+
+        with self.mutex:
+            self.entries.clear()
+            self.hits = self.misses = 0
+
+
+# For entities that aren't in a project with a pathname.  It only
+# lives in memory.
+cache = RstCache()
+
+
+def render(text):
+    return cache.render(text)
@@ -0,0 +1,514 @@
+# vim: set expandtab ts=4 sw=4 filetype=python:
+
+"""
+An inverted index over entity titles, descriptions, and comments.
+
+The project updates the index every time it saves, and keeps it in
+pitzdir/textindex.pickle, so searching never has to read the yaml
+files.
+
+Queries look like this::
+
+    cat box         entities with both words somewhere
+    "cat box"       entities with that exact phrase
+    cat*            entities with any word starting with cat
+
+Matching is case-sensitive unless you ask otherwise, just like grep.  A
+comment that matches also counts as a match for the entity it comments
+on.
+"""
+
+from __future__ import with_statement
+
+import bisect
+import cPickle as pickle
+import math
+import os
+import re
+
+textindex_filename = 'textindex.pickle'
+
+word = re.compile(r'\w+', re.UNICODE)
+query_part = re.compile(r'"([^"]*)"|(\S+)')
+
+
+def tokenize(text):
+    """
+    >>> tokenize("Clean the cat-box, NOW!")
+    ['Clean', 'the', 'cat', 'box', 'NOW']
+    """
+
+    if not isinstance(text, basestring):
+        text = str(text)
+
+    if isinstance(text, str):
+        text = text.decode('utf8', 'replace')
+
+    return [w.encode('utf8') for w in word.findall(text)]
+
+
+def parse_query(query):
+    """
+    Return a list of (kind, value) clauses.  A document has to match
+    every clause.
+
+    >>> parse_query('cat "litter box" dog*')
+    [('term', 'cat'), ('phrase', ['litter', 'box']), ('prefix', 'dog')]
+
+    Words that tokenize into several words, like cat-box, turn into
+    phrases.
+
+    >>> parse_query('cat-box')
+    [('phrase', ['cat', 'box'])]
+    """
+
+    clauses = []
+
+    for quoted, bare in query_part.findall(query):
+
+        if bare and bare.endswith('*') and len(tokenize(bare)) == 1:
+            clauses.append(('prefix', tokenize(bare)[0]))
+            continue
+
+        words = tokenize(quoted or bare)
+
+        if len(words) == 1:
+            clauses.append(('term', words[0]))
+
+        elif words:
+            clauses.append(('phrase', words))
+
+    return clauses
+
+
+class TextIndex(object):
+    """
+    Maps words to the entities that use them.
+
+    >>> from pitz.entity import Entity
+    >>> e = Entity(title='Clean the cat box')
+    >>> ti = TextIndex()
+    >>> ti.add(e)
+    >>> ti.search('"cat box"') == set([str(e.uuid)])
+    True
+    >>> ti.search('box cat*') == set([str(e.uuid)])
+    True
+    >>> ti.search('"box cat"')
+    set([])
+    >>> ti.search('clean')
+    set([])
+    >>> ti.search('clean', ignore_case=True) == set([str(e.uuid)])
+    True
+    """
+
+    # Bump this when the layout changes, so old index files get
+    # rebuilt instead of loaded.
+    format = 3
+
+    # Put this many positions between the title and the description so
+    # that phrases can't straddle the two.
+    field_gap = 100
+
+    def __init__(self):
+
+        # Maps words to dictionaries that map uuid strings to sets of
+        # positions.
+        self.postings = dict()
+
+        # Maps lowercased words to the set of words in postings that
+        # lowercase to them, for searches that ignore case.
+        self.variants = dict()
+
+        # Maps uuid strings to the set of words I indexed for them, so
+        # I can take them back out.
+        self.words_by_uuid = dict()
+
+        # Maps uuid strings to how many words they hold, for ranking.
+        self.lengths = dict()
+        self.total_length = 0
+
+        # Maps comment uuid strings to the uuid of what they comment on.
+        self.parents = dict()
+
+        self._sorted_words = None
+        self._sorted_variants = None
+
+        self.format = self.format
+
+    def __len__(self):
+        return len(self.words_by_uuid)
+
+    def __contains__(self, entity):
+        return str(getattr(entity, 'uuid', entity)) in self.words_by_uuid
+
+    def __getstate__(self):
+
+        d = self.__dict__.copy()
+        d['_sorted_words'] = d['_sorted_variants'] = None
+        return d
+
+    @classmethod
+    def path(cls, pathname):
+        return os.path.join(pathname, textindex_filename)
+
+    @classmethod
+    def exists(cls, pathname):
+        return os.path.isfile(cls.path(pathname))
+
+    @classmethod
+    def load(cls, pathname):
+        """
+        Return the saved index, or None if it's from an older version
+        of pitz.
+        """
+
+        with open(cls.path(pathname), 'rb') as f:
+            ti = pickle.load(f)
+
+        if isinstance(ti, cls) and ti.__dict__.get('format') == cls.format:
+            return ti
+
+    def dumps(self):
+        return pickle.dumps(self, pickle.HIGHEST_PROTOCOL)
+
+    def save(self, pathname):
+        return self.save_pickled(pathname, self.dumps())
+
+    @classmethod
+    def save_pickled(cls, pathname, data):
+        """
+        Write out an index that dumps already pickled, using a rename
+        so readers never see half an index.
+        """
+
+        path = cls.path(pathname)
+        tmp_path = path + '.tmp'
+
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+
+        os.rename(tmp_path, path)
+
+        return path
+
+    def add(self, entity):
+        """
+        Index entity, replacing whatever I knew about it before.
+        """
+
+        uuid = str(entity.uuid)
+
+        self.remove(uuid)
+
+        positions = dict()
+
+        words = tokenize(entity.get('title') or '')
+        words.extend([None] * self.field_gap)
+        words.extend(tokenize(entity.get('description') or ''))
+
+        for i, w in enumerate(words):
+            if w is not None:
+                positions.setdefault(w, set()).add(i)
+
+        for w, pos in positions.items():
+
+            if w not in self.postings:
+                self.variants.setdefault(w.lower(), set()).add(w)
+                self._sorted_words = self._sorted_variants = None
+
+            self.postings.setdefault(w, dict())[uuid] = pos
+
+        self.words_by_uuid[uuid] = set(positions)
+
+        self.lengths[uuid] = len(words) - self.field_gap
+        self.total_length += self.lengths[uuid]
+
+        if entity.get('type') == 'comment' and entity.get('entity'):
+            target = entity['entity']
+            self.parents[uuid] = str(getattr(target, 'uuid', target))
+
+    def add_many(self, entities):
+
+        for e in entities:
+            self.add(e)
+
+    def remove(self, entity):
+
+        uuid = str(getattr(entity, 'uuid', entity))
+
+        for w in self.words_by_uuid.pop(uuid, ()):
+
+            docs = self.postings[w]
+            docs.pop(uuid, None)
+
+            if not docs:
+
+                del self.postings[w]
+
+                lw = w.lower()
+                self.variants[lw].discard(w)
+
+                if not self.variants[lw]:
+                    del self.variants[lw]
+
+                self._sorted_words = self._sorted_variants = None
+
+        self.total_length -= self.lengths.pop(uuid, 0)
+        self.parents.pop(uuid, None)
+
+    @property
+    def sorted_words(self):
+
+        if self._sorted_words is None:
+            self._sorted_words = sorted(self.postings)
+
+        return self._sorted_words
+
+    @property
+    def sorted_variants(self):
+
+        if self._sorted_variants is None:
+            self._sorted_variants = sorted(self.variants)
+
+        return self._sorted_variants
+
+    def _spellings(self, w, ignore_case):
+        """
+        Return the words in postings that count as w.
+        """
+
+        if ignore_case:
+            return self.variants.get(w.lower(), ())
+
+        return [w] if w in self.postings else []
+
+    def _positions(self, w, uuid, ignore_case):
+
+        positions = set()
+
+        for v in self._spellings(w, ignore_case):
+            positions.update(self.postings[v].get(uuid, ()))
+
+        return positions
+
+    def _match_term(self, w, ignore_case):
+
+        matches = set()
+
+        for v in self._spellings(w, ignore_case):
+            matches.update(self.postings[v])
+
+        return matches
+
+    def _match_prefix(self, prefix, ignore_case):
+
+        if ignore_case:
+            prefix = prefix.lower()
+            words = self.sorted_variants
+        else:
+            words = self.sorted_words
+
+        matches = set()
+
+        i = bisect.bisect_left(words, prefix)
+
+        while i < len(words) and words[i].startswith(prefix):
+            matches.update(self._match_term(words[i], ignore_case))
+            i += 1
+
+        return matches
+
+    def _match_phrase(self, words, ignore_case):
+
+        candidates = self._match_term(words[0], ignore_case)
+
+        for w in words[1:]:
+            candidates &= self._match_term(w, ignore_case)
+
+        matches = set()
+
+        for uuid in candidates:
+
+            starts = self._positions(words[0], uuid, ignore_case)
+
+            for offset, w in enumerate(words[1:], 1):
+
+                following = self._positions(w, uuid, ignore_case)
+                starts = set(p for p in starts if p + offset in following)
+
+            if starts:
+                matches.add(uuid)
+
+        return matches
+
+    def search(self, query, ignore_case=False):
+        """
+        Return the set of uuid strings for everything that matches the
+        query, including the entities that matching comments are about.
+        """
+
+        matches = None
+
+        for kind, value in parse_query(query):
+
+            found = getattr(self, '_match_%s' % kind)(value, ignore_case)
+            matches = found if matches is None else matches & found
+
+            if not matches:
+                return set()
+
+        if matches is None:
+            return set()
+
+        matches.update([self.parents[uuid] for uuid in matches
+            if uuid in self.parents])
+
+        return matches
+
+    def query_words(self, query):
+        """
+        Return the indexed words that a query uses, ignoring case, with
+        prefix* words expanded into the words they match.
+        """
+
+        words = set()
+
+        for kind, value in parse_query(query):
+
+            if kind == 'prefix':
+
+                variants = self.sorted_variants
+                i = bisect.bisect_left(variants, value.lower())
+
+                while i < len(variants) \
+                and variants[i].startswith(value.lower()):
+
+                    words.update(self.variants[variants[i]])
+                    i += 1
+
+            else:
+
+                for w in (value if kind == 'phrase' else [value]):
+                    words.update(self.variants.get(w.lower(), ()))
+
+        return words
+
+    def rank(self, query, k1=1.2, b=0.75):
+        """
+        Return a dictionary that maps uuid strings to Okapi BM25 scores
+        for every document that uses any word in the query.  Case
+        doesn't matter here.
+
+        A comment's score gets added to the entity it comments on, and
+        the comment drops out.
+
+        >>> from pitz.entity import Entity
+        >>> e1 = Entity(title='Cats cats cats')
+        >>> e2 = Entity(title='A cat and a dog')
+        >>> e3 = Entity(title='Only a dog')
+        >>> ti = TextIndex()
+        >>> ti.add_many([e1, e2, e3])
+        >>> scores = ti.rank('cats dog')
+        >>> scores[str(e1.uuid)] > scores[str(e3.uuid)]
+        True
+        >>> str(e2.uuid) in scores
+        True
+        """
+
+        n = len(self.lengths)
+
+        if not n:
+            return dict()
+
+        average_length = float(self.total_length) / n or 1.0
+
+        scores = dict()
+
+        for w in self.query_words(query):
+
+            docs = self.postings[w]
+
+            idf = math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+
+            for uuid, positions in docs.iteritems():
+
+                tf = len(positions)
+
+                norm = k1 * (1 - b + b * self.lengths[uuid]
+                    / average_length)
+
+                scores[uuid] = scores.get(uuid, 0) \
+                + idf * tf * (k1 + 1) / (tf + norm)
+
+        for uuid in [u for u in scores if u in self.parents]:
+
+            parent = self.parents[uuid]
+
+            if parent in self.lengths:
+                scores[parent] = scores.get(parent, 0) + scores.pop(uuid)
+
+        return scores
+
+
+def make_snippet(text, words, width=72, highlight='*%s*'):
+    """
+    Return about width characters of text around the first of words,
+    with every one of words wrapped in highlight.  Returns None if none
+    of the words show up.
+
+    >>> make_snippet('The cat sat on the mat.', ['cat', 'mat'])
+    'The *cat* sat on the *mat*.'
+
+    >>> make_snippet('a ' * 50 + 'cat ' + 'b ' * 50, ['cat'], width=20)
+    '... a a a a a *cat* b b b b ...'
+    """
+
+    if not text or not words:
+        return
+
+    if isinstance(text, str):
+        text = text.decode('utf8', 'replace')
+
+    text = ' '.join(text.split())
+
+    lowered = set(w.lower() for w in words)
+
+    hits = [m for m in word.finditer(text)
+        if m.group().encode('utf8').lower() in lowered]
+
+    if not hits:
+        return
+
+    start = max(0, hits[0].start() - width / 2)
+    end = min(len(text), start + width)
+
+    # Don't chop words in half.
+    while start > 0 and not text[start - 1].isspace():
+        start -= 1
+
+    while end < len(text) and not text[end].isspace():
+        end += 1
+
+    pieces = []
+    last = start
+
+    for m in hits:
+
+        if m.start() < start or m.end() > end:
+            continue
+
+        pieces.append(text[last:m.start()])
+        pieces.append(highlight % m.group())
+        last = m.end()
+
+    pieces.append(text[last:end])
+
+    snippet = ''.join(pieces).strip()
+
+    if start > 0:
+        snippet = '... ' + snippet
+
+    if end < len(text):
+        snippet = snippet + ' ...'
+
+    return snippet.encode('utf8')
@@ -1,5 +1,7 @@
 # vim: set expandtab ts=4 sw=4 filetype=python:
 
+from __future__ import with_statement
+
 import cgi
 import logging
 import mimetypes
@@ -12,6 +14,8 @@ import jinja2
 from pitz import build_filter, PitzException
 from pitz.entity import Entity
 from pitz.webapp.handlers import DispatchingHandler
+from pitz.webapp.rendercache import RenderCache
+from pitz.webapp.server import ReadWriteLock
 
 log = logging.getLogger('pitz.webapp')
 
@@ -22,6 +26,51 @@ class NoMatch(PitzException):
 
 class SimpleWSGIApp(DispatchingHandler):
 
+    def __init__(self, proj):
+        super(SimpleWSGIApp, self).__init__(proj)
+        self.render_cache = RenderCache(proj)
+
+        # GETs only hold the read side of self.lock, so they must never
+        # add entities to the project, but any query about closed work
+        # would load the archive.  Get that over with before serving.
+        proj.load_archive()
+
+        # Requests come in on lots of threads, and they all share
+        # self.proj.
+        self.lock = ReadWriteLock()
+        self.old_patterns = self.compile_old_patterns(proj.classes)
+
+    @staticmethod
+    def compile_old_patterns(classes):
+
+        """
+        Compile the patterns for the old routes once, instead of on
+        every request.
+        """
+
+        all_classes = ('^/('
+            + '|'.join([c.title() for c in classes])
+            + ')')
+
+        return dict(
+
+            m2=re.compile(all_classes +
+                r'/all/?(detailed_view|summarized_view)?/?$'),
+
+            m3=re.compile(all_classes +
+                r'/by_title/([^/]+)/?'
+                '(detailed_view|summarized_view)?/?$'),
+
+            m4=re.compile(r'^/Person/by_title/([^/]+)/my_todo/?'
+                '(detailed_view|summarized_view)?/?$'),
+
+            m5=re.compile('/by_frag/([^/]+)/?'
+                '(detailed_view|summarized_view|rst_detailed_view|rst_summarized_view|one_line_view)?/?$'),
+
+            m6=re.compile('/by_frag/([^/]+)/my_todo/?'
+                '(detailed_view|summarized_view)?/?$'),
+        )
+
     @classmethod
     def reply404(cls, start_response, msg=None):
 
@@ -35,30 +84,107 @@ class SimpleWSGIApp(DispatchingHandler):
         else:
             return ["Sorry, didn't match any patterns..."]
 
+    @classmethod
+    def reply400(cls, start_response, msg):
+
+        start_response('400 BAD REQUEST',
+            [('content-type', 'text/plain')])
+
+        return [msg]
+
+    @staticmethod
+    def pop_page(qs):
+
+        """
+        Take offset and limit out of a parsed query string, so they
+        don't get mistaken for attributes to filter on.
+
+        >>> qs = {'offset': ['20'], 'limit': ['10'], 'status': ['started']}
+        >>> SimpleWSGIApp.pop_page(qs)
+        (20, 10)
+        >>> qs
+        {'status': ['started']}
+        >>> SimpleWSGIApp.pop_page({})
+        (0, None)
+        """
+
+        offset = int(qs.pop('offset', ['0'])[0])
+        limit = qs.pop('limit', None)
+
+        if limit is not None:
+            limit = int(limit[0])
+
+        if offset < 0 or (limit is not None and limit < 0):
+            raise ValueError("offset and limit can't be negative")
+
+        return offset, limit
+
     def __call__(self, environ, start_response):
 
-        log.debug('PATH_INFO is %(PATH_INFO)s.' % environ)
-        log.debug('QUERY_STRING is %(QUERY_STRING)s.' % environ)
-        log.debug('HTTP_ACCEPT is %(HTTP_ACCEPT)s.' % environ)
+        if environ.get('REQUEST_METHOD', 'GET') in ('GET', 'HEAD'):
+            lock = self.lock.reading
+        else:
+            lock = self.lock.writing
+
+        with lock():
+            body = self.respond(environ, start_response)
+
+        if isinstance(body, list):
+            return body
+
+        return self.locked_chunks(body)
+
+    def locked_chunks(self, chunks):
+
+        """
+        Draw the rest of a streamed page, holding the read lock for
+        each chunk rather than for the whole page, so a slow browser
+        can't hold up edits.
+        """
+
+        chunks = iter(chunks)
+
+        while True:
+
+            with self.lock.reading():
+                chunk = next(chunks, None)
+
+            if chunk is None:
+                return
+
+            yield chunk
+
+    def respond(self, environ, start_response):
+
+        log.debug('QUERY_STRING is %s.', environ.get('QUERY_STRING'))
+        log.debug('HTTP_ACCEPT is %s.', environ.get('HTTP_ACCEPT'))
 
         h = self.dispatch(environ)
 
-        if h:
+        if h and not getattr(h, 'cacheable', False):
             return h(environ, start_response)
 
+        return self.render_cache(environ, start_response,
+            h or self.old_routes)
+
+    def old_routes(self, environ, start_response):
+
         # Stuff below is the old junk that will one day be rewritten.
 
         path_info = environ['PATH_INFO']
         qs = cgi.parse_qs(environ['QUERY_STRING'])
         http_accept = environ.get('HTTP_ACCEPT', '')
 
-        all_classes = ('^/('
-            + '|'.join([c.title() for c in self.proj.classes])
-            + ')')
+        try:
+            offset, limit = self.pop_page(qs)
+
+        except ValueError:
+            return self.reply400(start_response,
+                'offset and limit must be whole numbers')
 
         try:
 
-            if re.search('^/$', path_info):
+            if path_info == '/':
 
                 log.debug("matched the slash...")
 
@@ -67,6 +193,8 @@ class SimpleWSGIApp(DispatchingHandler):
                 else:
                     results = self.proj
 
+                results = results.page(offset, limit)
+
                 status = '200 OK'
 
                 if 'application/x-pitz' in http_accept \
@@ -76,13 +204,13 @@ class SimpleWSGIApp(DispatchingHandler):
 
                     headers = [('Content-type', 'application/x-pitz')]
                     start_response(status, headers)
-                    return [str(results.colorized_detailed_view)]
+                    return results.stream('colorized_detailed_view')
 
                 if 'application/x-pitz' in http_accept:
                     log.debug('e')
                     headers = [('Content-type', 'application/x-pitz')]
                     start_response(status, headers)
-                    return [str(results.colorized_detailed_view)]
+                    return results.stream('colorized_detailed_view')
 
                 if 'detailed_view' in path_info:
 
@@ -90,7 +218,7 @@ class SimpleWSGIApp(DispatchingHandler):
 
                     headers = [('Content-type', 'text/plain')]
                     start_response(status, headers)
-                    return [str(results.detailed_view)]
+                    return results.stream('detailed_view')
 
                 if 'summarized_view' in path_info:
 
@@ -98,7 +226,7 @@ class SimpleWSGIApp(DispatchingHandler):
 
                     headers = [('Content-type', 'text/plain')]
                     start_response(status, headers)
-                    return [str(results.colorized_detailed_view)]
+                    return results.stream('colorized_detailed_view')
 
                 else:
 
@@ -106,12 +234,9 @@ class SimpleWSGIApp(DispatchingHandler):
 
                     headers = [('Content-type', 'text/plain')]
                     start_response(status, headers)
-                    return [str(results)]
-
-            pattern = (all_classes +
-                r'/all/?(detailed_view|summarized_view)?/?$')
+                    return results.stream()
 
-            m2 = re.search(pattern, path_info)
+            m2 = self.old_patterns['m2'].search(path_info)
 
             if m2:
 
@@ -119,11 +244,13 @@ class SimpleWSGIApp(DispatchingHandler):
 
                 classname, view_type = m2.groups()
                 cls = self.proj.classes[classname.lower()]
-                results = cls.all()
+                results = cls.all(self.proj)
 
                 if qs:
                     results = results.matches_dict(**qs)
 
+                results = results.page(offset, limit)
+
                 status = '200 OK'
 
                 if 'application/x-pitz' in http_accept \
@@ -133,7 +260,7 @@ class SimpleWSGIApp(DispatchingHandler):
 
                     headers = [('Content-type', 'application/x-pitz')]
                     start_response(status, headers)
-                    return [str(results.colorized_detailed_view)]
+                    return results.stream('colorized_detailed_view')
 
                 if 'detailed_view' in path_info:
 
@@ -141,7 +268,7 @@ class SimpleWSGIApp(DispatchingHandler):
 
                     headers = [('Content-type', 'text/plain')]
                     start_response(status, headers)
-                    return [str(results.detailed_view)]
+                    return results.stream('detailed_view')
 
                 if 'summarized_view' in path_info:
 
@@ -149,7 +276,7 @@ class SimpleWSGIApp(DispatchingHandler):
 
                     headers = [('Content-type', 'text/plain')]
                     start_response(status, headers)
-                    return [str(results.colorized_detailed_view)]
+                    return results.stream('colorized_detailed_view')
 
                 else:
 
@@ -157,11 +284,9 @@ class SimpleWSGIApp(DispatchingHandler):
 
                     headers = [('Content-type', 'text/plain')]
                     start_response(status, headers)
-                    return [str(results)]
+                    return results.stream()
 
-            m3 = re.search(all_classes +
-                r'/by_title/([^/]+)/?'
-                '(detailed_view|summarized_view)?/?$', path_info)
+            m3 = self.old_patterns['m3'].search(path_info)
 
             if m3:
 
@@ -170,7 +295,7 @@ class SimpleWSGIApp(DispatchingHandler):
                 classname, title, view_type = m3.groups()
 
                 cls = self.proj.classes[classname.lower()]
-                results = cls.by_title(urllib.unquote(title))
+                results = cls.by_title(urllib.unquote(title), self.proj)
 
                 if qs:
                     results = results.matches_dict(**qs)
@@ -210,19 +335,21 @@ class SimpleWSGIApp(DispatchingHandler):
                     start_response(status, headers)
                     return [str(results)]
 
-            m4 = re.search(r'^/Person/by_title/([^/]+)/my_todo/?'
-                '(detailed_view|summarized_view)?/?$', path_info)
+            m4 = self.old_patterns['m4'].search(path_info)
 
             if m4:
 
                 log.debug('matched m4. groups: %s' % list(m4.groups()))
                 title, view_type = m4.groups()
                 Person = self.proj.classes['person']
-                results = Person.by_title(urllib.unquote(title)).my_todo
+                results = Person.by_title(urllib.unquote(title),
+                    self.proj).my_todo
 
                 if qs:
                     results = results.matches_dict(**qs)
 
+                results = results.page(offset, limit)
+
                 status = '200 OK'
 
                 if 'application/x-pitz' in http_accept \
@@ -232,7 +359,7 @@ class SimpleWSGIApp(DispatchingHandler):
 
                     headers = [('Content-type', 'application/x-pitz')]
                     start_response(status, headers)
-                    return [str(results.colorized_detailed_view)]
+                    return results.stream('colorized_detailed_view')
 
                 if 'detailed_view' in path_info:
 
@@ -240,7 +367,7 @@ class SimpleWSGIApp(DispatchingHandler):
 
                     headers = [('Content-type', 'text/plain')]
                     start_response(status, headers)
-                    return [str(results.detailed_view)]
+                    return results.stream('detailed_view')
 
                 if 'summarized_view' in path_info:
 
@@ -248,7 +375,7 @@ class SimpleWSGIApp(DispatchingHandler):
 
                     headers = [('Content-type', 'text/plain')]
                     start_response(status, headers)
-                    return [str(results.summarized_view)]
+                    return results.stream('summarized_view')
 
                 else:
 
@@ -256,10 +383,9 @@ class SimpleWSGIApp(DispatchingHandler):
 
                     headers = [('Content-type', 'text/plain')]
                     start_response(status, headers)
-                    return [str(results)]
+                    return results.stream()
 
-            m5 = re.search('/by_frag/([^/]+)/?'
-                '(detailed_view|summarized_view|rst_detailed_view|rst_summarized_view|one_line_view)?/?$', path_info)
+            m5 = self.old_patterns['m5'].search(path_info)
 
             if m5:
 
@@ -306,8 +432,7 @@ class SimpleWSGIApp(DispatchingHandler):
                         getattr(results, view_type) if view_type
                         else results.html)]
 
-            m6 = re.search('/by_frag/([^/]+)/my_todo/?'
-                '(detailed_view|summarized_view)?/?$', path_info)
+            m6 = self.old_patterns['m6'].search(path_info)
 
             if m6:
 
@@ -326,6 +451,8 @@ class SimpleWSGIApp(DispatchingHandler):
                 if qs:
                     results = results.matches_dict(**qs)
 
+                results = results.page(offset, limit)
+
                 status = '200 OK'
 
                 if 'application/x-pitz' in http_accept \
@@ -335,7 +462,7 @@ class SimpleWSGIApp(DispatchingHandler):
 
                     headers = [('Content-type', 'application/x-pitz')]
                     start_response(status, headers)
-                    return [str(results.colorized_detailed_view)]
+                    return results.stream('colorized_detailed_view')
 
                 if 'detailed_view' in path_info:
 
@@ -343,7 +470,7 @@ class SimpleWSGIApp(DispatchingHandler):
 
                     headers = [('Content-type', 'text/plain')]
                     start_response(status, headers)
-                    return [str(results.detailed_view)]
+                    return results.stream('detailed_view')
 
                 if 'summarized_view' in path_info:
 
@@ -351,7 +478,7 @@ class SimpleWSGIApp(DispatchingHandler):
 
                     headers = [('Content-type', 'text/plain')]
                     start_response(status, headers)
-                    return [str(results.summarized_view)]
+                    return results.stream('summarized_view')
 
                 else:
 
@@ -359,9 +486,7 @@ class SimpleWSGIApp(DispatchingHandler):
 
                     headers = [('Content-type', 'text/plain')]
                     start_response(status, headers)
-                    return [str(
-                        getattr(results, view_type) if view_type
-                        else results)]
+                    return results.stream(view_type or 'detailed_view')
 
             raise NoMatch(path_info)
 
@@ -8,11 +8,22 @@ import time
 from wsgiref.headers import Headers
 
 import pitz.jinja2templates
+from pitz.bag import chunked
 
 log = logging.getLogger('pitz.webapp.handlers')
 
+by_frag_path = re.compile(r'^/by_frag/(?P<frag>.{6}).*$')
+
 class Handler(object):
 
+    # The webapp caches GET replies from handlers that set this, until
+    # the project changes.
+    cacheable = False
+
+    # The first parts of the paths I might want, like 'help' for
+    # /help, or '' for /.  None means ask me about every path.
+    path_segments = None
+
     def __init__(self, proj):
         self.proj = proj
 
@@ -29,9 +40,20 @@ class Handler(object):
 
         """
 
-        return re.match(
-            r'^/by_frag/(?P<frag>.{6}).*$',
-            path_info).groupdict()['frag']
+        return by_frag_path.match(path_info).groupdict()['frag']
+
+def first_segment(path_info):
+
+    """
+    >>> first_segment('/by_frag/9f1c76/edit-attributes')
+    'by_frag'
+    >>> first_segment('/help')
+    'help'
+    >>> first_segment('/')
+    ''
+    """
+
+    return path_info.split('/', 2)[1] if path_info.startswith('/') else ''
 
 class DispatchingHandler(Handler):
 
@@ -39,25 +61,58 @@ class DispatchingHandler(Handler):
         super(DispatchingHandler, self).__init__(proj)
         self.handlers = list()
 
+        self._routed_handlers = None
+        self._routes = dict()
+        self._unrouted = list()
+
+    def routes(self):
+
+        """
+        Return a dictionary that maps first path segments to the
+        handlers that might want them, in the order they got added, and
+        the list of handlers that might want any path.
+
+        I only rebuild the table when the handlers list changes.
+        """
+
+        handlers = tuple(self.handlers)
+
+        if handlers != self._routed_handlers:
+
+            unrouted = [h for h in handlers
+                if getattr(h, 'path_segments', None) is None]
+
+            segments = set()
+
+            for h in handlers:
+                segments.update(getattr(h, 'path_segments', None) or ())
+
+            self._routes = dict(
+                (seg, [h for h in handlers
+                    if getattr(h, 'path_segments', None) is None
+                    or seg in h.path_segments])
+                for seg in segments)
+
+            self._unrouted = unrouted
+            self._routed_handlers = handlers
+
+        return self._routes, self._unrouted
+
     def dispatch(self, environ):
 
         """
         Return the first handler that wants to handle this environ.
         """
 
-        log.debug('PATH_INFO is %(PATH_INFO)s' % environ)
-        log.debug('REQUEST_METHOD is %(REQUEST_METHOD)s' % environ)
-        log.debug('CONTENT_LENGTH is %s' % environ.get('CONTENT_LENGTH'))
-        log.debug('wsgi.input is %(wsgi.input)s' % environ)
+        log.debug('PATH_INFO is %s', environ['PATH_INFO'])
+        log.debug('REQUEST_METHOD is %s', environ['REQUEST_METHOD'])
 
-        for h in self.handlers:
+        routes, unrouted = self.routes()
 
-            log.debug(
-                'Asking %s if it wants this request...'
-                % h.__class__.__name__)
+        for h in routes.get(first_segment(environ['PATH_INFO']), unrouted):
 
             if h.wants_to_handle(environ):
-                log.debug('And the answer is YES!')
+                log.debug('%s wants this request', h.__class__.__name__)
                 return h
 
     def __call__(self, environ, start_response):
@@ -74,6 +129,8 @@ class HelpHandler(Handler):
     Handles the GET /help request.
     """
 
+    path_segments = ('help',)
+
     def wants_to_handle(self, environ):
 
         if environ['PATH_INFO'] == '/help':
@@ -92,7 +149,7 @@ class HelpHandler(Handler):
         headers = [('Content-Type', 'text/html')]
 
         start_response(status, headers)
-        return [str(t.render(title='Pitz Webapp Help'))]
+        return chunked(t.generate(title='Pitz Webapp Help'))
 
 class StaticHandler(object):
 
@@ -100,6 +157,8 @@ class StaticHandler(object):
     Serves files like CSS and javascript.
     """
 
+    path_segments = ('static',)
+
     timefmt = '%a, %d %b %Y %H:%M:%S GMT'
 
     def __init__(self, static_files):
@@ -204,6 +263,8 @@ class StaticHandler(object):
 
 class FaviconHandler(StaticHandler):
 
+    path_segments = ('favicon.ico',)
+
     def __init__(self, static_dir):
 
         super(FaviconHandler, self).__init__(static_dir)
@@ -236,6 +297,9 @@ class FaviconHandler(StaticHandler):
 
 class ByFragHandler(Handler):
 
+    cacheable = True
+    path_segments = ('by_frag',)
+
     def __init__(self, proj):
 
         super(ByFragHandler, self).__init__(proj)
@@ -249,8 +313,17 @@ class ByFragHandler(Handler):
 
     def __call__(self, environ, start_response):
 
-        results = self.proj.by_frag(
-            self.extract_frag(environ['PATH_INFO']))
+        frag = self.extract_frag(environ['PATH_INFO'])
+
+        try:
+            results = self.proj.by_frag(frag)
+
+        except KeyError:
+
+            start_response('404 NOT FOUND',
+                [('content-type', 'text/plain')])
+
+            return ["Sorry, I don't have anything with frag %s" % frag]
 
         status = '200 OK'
         headers = [('Content-type', 'text/html')]
@@ -260,6 +333,9 @@ class ByFragHandler(Handler):
 
 class Project(Handler):
 
+    cacheable = True
+    path_segments = ('', 'Project')
+
     def wants_to_handle(self, environ):
 
         if environ['PATH_INFO'] in ('/', '/Project'):
@@ -271,7 +347,7 @@ class Project(Handler):
         headers = [('Content-type', 'text/html')]
         start_response(status, headers)
 
-        return [str(self.proj.html)]
+        return self.proj.stream('html')
 
 from pitz.webapp.handlers.team import Team
 from pitz.webapp.handlers.editattributes import EditAttributes
@@ -1,9 +1,13 @@
 # vim: set expandtab ts=4 sw=4 filetype=python:
 
+from pitz.bag import chunked
 from pitz.webapp.handlers import Handler
 
 class Team(Handler):
 
+    cacheable = True
+    path_segments = ('team',)
+
     def wants_to_handle(self, environ):
 
         if environ['PATH_INFO'] == '/team':
@@ -17,4 +21,4 @@ class Team(Handler):
         headers = [('Content-type', 'text/html')]
         start_response(status, headers)
 
-        return [str(tmpl.render(proj=self.proj))]
+        return chunked(tmpl.generate(proj=self.proj))
@@ -102,3 +102,20 @@ class TestUpdate1(unittest.TestCase):
 
         self.assertEqual(self.entity['flavor'],
             ['chocolate', 'vanilla'])
+
+    def test_call_marks_dirty(self):
+        """
+        Verify Update tells the write-behind queue what it changed.
+        """
+
+        write_behind = mock.Mock()
+        uh = handlers.Update(self.proj, write_behind)
+
+        something = 'flavor=vanilla'
+        self.bogus_environ['wsgi.input'].write(something)
+        self.bogus_environ['wsgi.input'].seek(0)
+        self.bogus_environ['CONTENT_LENGTH'] = len(something)
+
+        uh(self.bogus_environ, self.bogus_start_response)
+
+        write_behind.mark_dirty.assert_called_with(self.entity)
@@ -27,6 +27,15 @@ class Update(Handler):
 
     """
 
+    path_segments = ('by_frag',)
+
+    def __init__(self, proj, write_behind=None):
+        super(Update, self).__init__(proj)
+
+        # Something like pitz.webapp.writebehind.WriteBehind that saves
+        # the entities I change.
+        self.write_behind = write_behind
+
     def wants_to_handle(self, environ):
 
         # Gauntlet pattern... Look for lots of different reasons to
@@ -60,6 +69,9 @@ class Update(Handler):
             else:
                 e[k] = v
 
+        if self.write_behind:
+            self.write_behind.mark_dirty(e)
+
         status = '302 FOUND'
         headers = [('Location', 'http://google.com')]
         start_response(status, headers)
@@ -69,6 +81,8 @@ class Update(Handler):
 
 class UpdateTask(Handler):
 
+    path_segments = ('by_frag',)
+
     def wants_to_handle(self, environ):
 
         if environ['REQUEST_METHOD'] != 'POST':
@@ -0,0 +1,135 @@
+# vim: set expandtab ts=4 sw=4 filetype=python:
+
+"""
+Throw a bunch of concurrent GETs at a running pitz-webapp and report
+how long they took.
+"""
+
+from __future__ import with_statement
+
+import itertools
+import threading
+import time
+import urllib2
+
+
+def percentile(sorted_values, p):
+    """
+    Return the value that p percent of sorted_values are at or below,
+    using the nearest rank.
+
+    >>> percentile(range(1, 101), 50)
+    50
+    >>> percentile(range(1, 101), 99)
+    99
+    >>> percentile([7], 90)
+    7
+    >>> percentile([], 50)
+    """
+
+    if not sorted_values:
+        return
+
+    rank = max(1, int(round(p / 100.0 * len(sorted_values))))
+
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+class LoadTest(object):
+    """
+    Spreads a total of requests GETs across urls, from concurrency
+    threads at once.
+    """
+
+    def __init__(self, urls, requests=1000, concurrency=10, timeout=30):
+
+        self.urls = urls
+        self.requests = requests
+        self.concurrency = concurrency
+        self.timeout = timeout
+
+        self.latencies = []
+        self.errors = 0
+        self.elapsed = 0.0
+
+        self._lock = threading.Lock()
+        self._remaining = None
+
+    def fetch(self, url):
+
+        f = urllib2.urlopen(url, timeout=self.timeout)
+
+        try:
+            f.read()
+
+        finally:
+            f.close()
+
+    def work(self):
+
+        while True:
+
+            with self._lock:
+
+                try:
+                    url = self._remaining.next()
+
+                except StopIteration:
+                    return
+
+            t = time.time()
+
+            try:
+                self.fetch(url)
+
+            except (urllib2.URLError, IOError):
+
+                with self._lock:
+                    self.errors += 1
+
+            else:
+
+                with self._lock:
+                    self.latencies.append(time.time() - t)
+
+    def run(self):
+        """
+        Send all the requests and return myself.
+        """
+
+        self._remaining = itertools.islice(
+            itertools.cycle(self.urls), self.requests)
+
+        threads = [threading.Thread(target=self.work)
+            for i in range(self.concurrency)]
+
+        t = time.time()
+
+        for th in threads:
+            th.start()
+
+        for th in threads:
+            th.join()
+
+        self.elapsed = time.time() - t
+        self.latencies.sort()
+
+        return self
+
+    @property
+    def report(self):
+
+        lines = ['%d requests, %d errors, %d threads, %.2f seconds, '
+            '%.1f requests per second' % (
+                len(self.latencies) + self.errors, self.errors,
+                self.concurrency, self.elapsed,
+                len(self.latencies) / (self.elapsed or 1))]
+
+        for p in (50, 90, 99):
+
+            ms = percentile(self.latencies, p)
+
+            lines.append('p%d: %s' % (p,
+                'n/a' if ms is None else '%.1fms' % (ms * 1000)))
+
+        return '\n'.join(lines)
@@ -0,0 +1,214 @@
+# vim: set expandtab ts=4 sw=4 filetype=python:
+
+"""
+Remember the pages the webapp renders until the project changes, and
+answer conditional GETs with a 304.
+
+Every entity tells its project when it changes (see
+Entity.maybe_note_change), and the project bumps its generation.  A
+page's ETag is built from that generation, so one edit anywhere makes
+every page stale.  That's coarse, but a task page shows its comments,
+its milestone, its owner, and so on, and working out exactly which
+pages one edit touches costs more than just rendering them again.
+"""
+
+from __future__ import with_statement
+
+import collections
+import hashlib
+import logging
+import threading
+import time
+
+log = logging.getLogger('pitz.webapp.rendercache')
+
+timefmt = '%a, %d %b %Y %H:%M:%S GMT'
+
+
+class RenderCache(object):
+    """
+    Wraps a WSGI app and caches the 200 replies it gives to GETs.
+    """
+
+    def __init__(self, proj, max_entries=500, max_body=4 * 1024 * 1024):
+
+        self.proj = proj
+        self.max_entries = max_entries
+
+        # Pages bigger than this many bytes don't get kept.
+        self.max_body = max_body
+
+        self.entries = collections.OrderedDict()
+        self.generation = None
+
+        # Lots of reader threads share me.
+        self.mutex = threading.Lock()
+
+        # Generations start over when the webapp restarts, so mix in
+        # when I started, or a browser could hang on to an ETag from
+        # the last run that happens to match.
+        self.started = '%x' % int(time.time() * 1000)
+
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(environ):
+
+        return (
+            environ.get('PATH_INFO', ''),
+            environ.get('QUERY_STRING', ''),
+            environ.get('HTTP_ACCEPT', ''))
+
+    def etag(self, key):
+
+        return '"%s-%d-%s"' % (self.started, self.proj.generation,
+            hashlib.sha1(repr(key)).hexdigest()[:12])
+
+    @property
+    def last_modified(self):
+        return self.proj.last_change.strftime(timefmt)
+
+    def not_modified(self, environ, etag):
+        """
+        Return True if the browser's copy is still good.  If-None-Match
+        wins over If-Modified-Since when the browser sends both.
+        """
+
+        if 'HTTP_IF_NONE_MATCH' in environ:
+
+            tags = [t.strip() for t in
+                environ['HTTP_IF_NONE_MATCH'].split(',')]
+
+            return etag in tags or '*' in tags
+
+        if 'HTTP_IF_MODIFIED_SINCE' in environ:
+
+            try:
+                since = time.strptime(
+                    environ['HTTP_IF_MODIFIED_SINCE'], timefmt)
+
+            except ValueError:
+                return False
+
+            return self.proj.last_change.timetuple()[:6] <= since[:6]
+
+        return False
+
+    def _forget_old_generations(self):
+
+        if self.generation != self.proj.generation:
+            self.entries.clear()
+            self.generation = self.proj.generation
+
+    def _remember(self, key, generation, status, headers, chunks):
+        """
+        Pass chunks along, and keep a copy if it turns out small enough
+        and nothing changed while it got drawn.
+        """
+
+        kept, length = [], 0
+
+        for chunk in chunks:
+
+            if kept is not None:
+
+                kept.append(chunk)
+                length += len(chunk)
+
+                if length > self.max_body:
+                    kept = None
+
+            yield chunk
+
+        if kept is None or generation != self.proj.generation:
+            return
+
+        with self.mutex:
+
+            self.entries[key] = status, headers, ''.join(kept)
+
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def __call__(self, environ, start_response, app):
+
+        if environ.get('REQUEST_METHOD', 'GET') not in ('GET', 'HEAD'):
+            return app(environ, start_response)
+
+        with self.mutex:
+            self._forget_old_generations()
+
+        key = self.key(environ)
+        etag = self.etag(key)
+
+        validators = [
+            ('ETag', etag),
+            ('Last-Modified', self.last_modified),
+        ]
+
+        with self.mutex:
+
+            cached = self.entries.get(key)
+
+            if cached:
+                self.hits += 1
+
+                # Move it to the end, since it's the most recently used.
+                self.entries[key] = self.entries.pop(key)
+
+            else:
+                self.misses += 1
+
+        # Only pages that really exist get a 304, so I don't look at
+        # the conditional headers until I have a 200 in hand, either
+        # from the cache or from the app.
+        if cached:
+
+            if self.not_modified(environ, etag):
+                return self._reply304(key, start_response, validators)
+
+            status, headers, body = cached
+            start_response(status, headers + validators)
+
+            return [body]
+
+        generation = self.proj.generation
+
+        reply = []
+
+        def capture(status, headers, exc_info=None):
+            reply[:] = [status, list(headers)]
+
+        chunks = app(environ, capture)
+        status, headers = reply
+
+        # Don't keep errors.
+        if not status.startswith('200'):
+            start_response(status, headers)
+            return chunks
+
+        if self.not_modified(environ, etag):
+
+            if hasattr(chunks, 'close'):
+                chunks.close()
+
+            return self._reply304(key, start_response, validators)
+
+        start_response(status, headers + validators)
+
+        return self._remember(key, generation, status, headers, chunks)
+
+    @staticmethod
+    def _reply304(key, start_response, validators):
+
+        log.debug('304 for %s' % (key,))
+        start_response('304 Not Modified', validators)
+
+        return []
+
+    def clear(self):
+
+        with self.mutex:
+            self.entries.clear()
+            self.hits = self.misses = 0
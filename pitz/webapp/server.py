@@ -0,0 +1,187 @@
+# vim: set expandtab ts=4 sw=4 filetype=python:
+
+"""
+Serve the webapp from a pool of threads, so one slow page doesn't make
+the whole team wait.
+
+Every thread shares the one loaded project.  GETs only read it, so any
+number of them run at once; a POST that changes an entity waits until
+the readers finish, and holds everybody else off while it works.  See
+ReadWriteLock.
+
+I went with threads instead of forking because a forked worker would
+get its own copy of the project, and edits through one worker would
+never show up in the others.
+"""
+
+from __future__ import with_statement
+
+import contextlib
+import logging
+import Queue
+import threading
+from wsgiref.simple_server import WSGIServer, WSGIRequestHandler
+
+log = logging.getLogger('pitz.webapp.server')
+
+
+class ReadWriteLock(object):
+    """
+    Lets lots of readers in at once, or one writer.
+
+    Writers that are waiting keep new readers out, so a steady stream
+    of GETs can't starve a POST.
+
+    >>> lock = ReadWriteLock()
+    >>> with lock.reading():
+    ...     with lock.reading():
+    ...         lock.readers
+    2
+    >>> with lock.writing():
+    ...     lock.writer
+    True
+    >>> lock.readers, lock.writer
+    (0, False)
+    """
+
+    def __init__(self):
+
+        self.condition = threading.Condition(threading.Lock())
+
+        self.readers = 0
+        self.writer = False
+        self.writers_waiting = 0
+
+    def acquire_read(self):
+
+        with self.condition:
+
+            while self.writer or self.writers_waiting:
+                self.condition.wait()
+
+            self.readers += 1
+
+    def release_read(self):
+
+        with self.condition:
+
+            self.readers -= 1
+
+            if not self.readers:
+                self.condition.notify_all()
+
+    def acquire_write(self):
+
+        with self.condition:
+
+            self.writers_waiting += 1
+
+            try:
+                while self.writer or self.readers:
+                    self.condition.wait()
+
+            finally:
+                self.writers_waiting -= 1
+
+            self.writer = True
+
+    def release_write(self):
+
+        with self.condition:
+
+            self.writer = False
+            self.condition.notify_all()
+
+    @contextlib.contextmanager
+    def reading(self):
+
+        self.acquire_read()
+
+        try:
+            yield self
+
+        finally:
+            self.release_read()
+
+    @contextlib.contextmanager
+    def writing(self):
+
+        self.acquire_write()
+
+        try:
+            yield self
+
+        finally:
+            self.release_write()
+
+
+class ThreadPoolWSGIServer(WSGIServer):
+    """
+    Hands each connection to one of a fixed number of worker threads.
+    """
+
+    def __init__(self, server_address, threads=8,
+        RequestHandlerClass=WSGIRequestHandler):
+
+        WSGIServer.__init__(self, server_address, RequestHandlerClass)
+
+        self.requests = Queue.Queue(threads * 4)
+        self.workers = []
+
+        for i in range(threads):
+
+            t = threading.Thread(target=self.work,
+                name='pitz-webapp-%d' % i)
+
+            t.daemon = True
+            t.start()
+
+            self.workers.append(t)
+
+    def work(self):
+
+        while True:
+
+            request, client_address = self.requests.get()
+
+            if request is None:
+                return
+
+            try:
+                self.finish_request(request, client_address)
+
+            except Exception:
+                self.handle_error(request, client_address)
+
+            finally:
+                self.shutdown_request(request)
+
+    def process_request(self, request, client_address):
+        self.requests.put((request, client_address))
+
+    def server_close(self):
+
+        WSGIServer.server_close(self)
+
+        for t in self.workers:
+            self.requests.put((None, None))
+
+        for t in self.workers:
+            t.join(5)
+
+
+def make_server(host, port, app, threads=8):
+    """
+    Return a server for app.  With threads set to 1 or less, you get
+    the plain single-threaded wsgiref server.
+    """
+
+    if threads <= 1:
+        server = WSGIServer((host, port), WSGIRequestHandler)
+
+    else:
+        server = ThreadPoolWSGIServer((host, port), threads)
+
+    server.set_app(app)
+
+    return server
@@ -0,0 +1,146 @@
+# vim: set expandtab ts=4 sw=4 filetype=python:
+
+"""
+Save the edits that come in through the webapp without making the
+browser wait for the disk.
+
+The Update handler marks the entities it changes as dirty and returns
+right away.  A background thread saves the project every interval
+seconds, or sooner once batch_size entities are dirty, and one more
+time when the webapp shuts down.
+
+A save happens in two steps.  First, while holding the write side of
+the webapp's lock, the project turns everything that changed into
+strings: the yaml, a pickle of the whole project, the frag index, and
+its text index, which it brings up to date first.  That part never
+touches the disk, but it does take time in proportion to the size of
+the project.  Then, with no webapp lock held, all of that gets written
+out, along with the journal, and GETs and POSTs carry on while that
+happens.
+
+Every save rewrites project.pickle from what the webapp holds in
+memory, so nobody else may change the pitzdir while the webapp runs.
+pitz-webapp holds an exclusive lock on the pitzdir from before it
+loads the project until after the last save, and I count on that.
+
+The dirty set only decides when to save.  What gets saved is every
+entity with a stale yaml file, which also catches the activities that
+edits create.
+"""
+
+from __future__ import with_statement
+
+import logging
+import threading
+
+log = logging.getLogger('pitz.webapp.writebehind')
+
+
+class WriteBehind(object):
+
+    def __init__(self, proj, lock, interval=5.0, batch_size=20):
+
+        self.proj = proj
+
+        # The webapp's ReadWriteLock.
+        self.lock = lock
+
+        self.interval = interval
+        self.batch_size = batch_size
+
+        self.dirty = set()
+        self.mutex = threading.Lock()
+
+        # Only one flush at a time.
+        self.flushing = threading.Lock()
+
+        self.wakeup = threading.Event()
+        self.stopping = False
+        self.thread = None
+
+        self.flushes = 0
+        self.saved = 0
+
+    def mark_dirty(self, e):
+        """
+        Remember that e needs saving.  This never touches the disk.
+        """
+
+        with self.mutex:
+
+            self.dirty.add(e.uuid)
+
+            if len(self.dirty) >= self.batch_size:
+                self.wakeup.set()
+
+    def flush(self):
+        """
+        Save the project if anything is dirty.  Returns the entities
+        that got written.
+        """
+
+        with self.flushing:
+
+            with self.mutex:
+
+                if not self.dirty:
+                    return []
+
+                dirty, self.dirty = self.dirty, set()
+
+            try:
+
+                with self.lock.writing():
+                    pending = self.proj.prepare_save()
+
+                updated = pending.write()
+
+            except Exception, ex:
+
+                log.exception(ex)
+
+                # Try again next time.
+                with self.mutex:
+                    self.dirty.update(dirty)
+
+                return []
+
+            self.flushes += 1
+            self.saved += len(updated)
+
+            log.info("Saved %d entities" % len(updated))
+
+            return updated
+
+    def run(self):
+
+        while not self.stopping:
+
+            self.wakeup.wait(self.interval)
+            self.wakeup.clear()
+
+            if not self.stopping:
+                self.flush()
+
+    def start(self):
+
+        self.thread = threading.Thread(target=self.run,
+            name='pitz-write-behind')
+
+        self.thread.daemon = True
+        self.thread.start()
+
+        return self
+
+    def stop(self):
+        """
+        Stop the background thread and save whatever is left.
+        """
+
+        self.stopping = True
+        self.wakeup.set()
+
+        if self.thread:
+            self.thread.join()
+
+        return self.flush()
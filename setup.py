@@ -49,6 +49,7 @@ setup(
     pitz-shell = pitz.cmdline:pitz_shell
     pitz-setup = pitz.cmdline:pitz_setup
     pitz-show = pitz.cmdline:pitz_show
+    pitz-search = pitz.cmdline:pitz_search
     pitz-html = pitz.cmdline:pitz_html
     pitz-edit = pitz.cmdline:pitz_edit
     pitz-add-task = pitz.cmdline:pitz_add_task
@@ -67,6 +68,8 @@ setup(
     pitz-abandon-task = pitz.cmdline:pitz_abandon_task
     pitz-unassign-task = pitz.cmdline:pitz_unassign_task
     pitz-webapp = pitz.cmdline:pitz_webapp
+    pitz-webapp-load = pitz.cmdline:pitz_webapp_load
+    pitz-daemon = pitz.cmdline:pitz_daemon
     pitz-estimate-task = pitz.cmdline:pitz_estimate_task
     pitz-attach-file = pitz.cmdline:pitz_attach_file
     pitz-frags = pitz.cmdline:pitz_frags
@@ -81,6 +84,10 @@ setup(
     pitz-statuses = pitz.cmdline:pitz_statuses
     pitz-help = pitz.cmdline:pitz_help
     pitz-refresh-pickle = pitz.cmdline:pitz_refresh_pickle
+    pitz-pack = pitz.cmdline:pitz_pack
+    pitz-unpack = pitz.cmdline:pitz_unpack
+    pitz-archive = pitz.cmdline:pitz_archive
+    pitz-compact-activities = pitz.cmdline:pitz_compact_activities
     pitz-comment = pitz.cmdline:pitz_comment
     pitz-tags = pitz.cmdline:pitz_tags
     pitz-add-tag = pitz.cmdline:pitz_add_tag
@@ -7,6 +7,9 @@ Stuff in here is for profiling and timing.
 import cProfile
 import os
 import pstats
+import re
+import subprocess
+import sys
 import timeit
 
 from collections import namedtuple
@@ -36,6 +39,105 @@ from pitz.entity import Entity
 e = Entity(title='boring', a=1, b=2, c=3, d=6)
 """
 
+# 100,000 fake documents, each with a 5 word title and a 30 word
+# description, pulled from a 5,000 word vocabulary.
+textindex_setup = """
+import heapq, random
+from pitz.textindex import TextIndex
+
+class Doc(dict):
+    uuid = property(lambda self: self['uuid'])
+
+random.seed(0)
+vocabulary = ['word%d' % i for i in xrange(5000)]
+
+ti = TextIndex()
+
+for i in xrange(100000):
+    ti.add(Doc(uuid='doc-%d' % i,
+        title=' '.join(random.sample(vocabulary, 5)),
+        description=' '.join(random.sample(vocabulary, 30))))
+"""
+
+# The same handlers that pitz-webapp uses, in the same order, and a mix
+# of the requests that a browser sends.
+webapp_setup = """
+import os, wsgiref.util
+import pitz.static
+from pitz.project import Project
+from pitz.entity import Task
+from pitz import webapp
+from pitz.webapp import handlers
+
+p = Project(title='dispatch benchmark')
+tasks = [Task(p, title='dispatch task %d' % i) for i in xrange(100)]
+
+app = webapp.SimpleWSGIApp(p)
+static_files = os.path.dirname(pitz.static.__file__)
+
+app.handlers.extend([
+    handlers.FaviconHandler(static_files),
+    handlers.StaticHandler(static_files),
+    handlers.HelpHandler(p),
+    handlers.Update(p),
+    handlers.ByFragHandler(p),
+    handlers.EditAttributes(p),
+    handlers.Project(p),
+    handlers.Team(p)])
+
+environs = []
+
+for path in ['/', '/team', '/help', '/static/pitz.css', '/favicon.ico',
+    '/by_frag/%s' % tasks[0].frag,
+    '/by_frag/%s/edit-attributes' % tasks[1].frag,
+    '/Task/all/detailed_view']:
+
+    environ = dict(PATH_INFO=path)
+    wsgiref.util.setup_testing_defaults(environ)
+    environs.append(environ)
+"""
+
+# 5,000 tasks, for comparing a whole page to the first streamed chunk.
+big_bag_setup = """
+from pitz.project import Project
+from pitz.entity import Task
+p = Project(title='big bag')
+p.rerun_sort_after_append = False
+for i in xrange(5000):
+    Task(p, title='big bag task %d' % i)
+p.order()
+b = p.tasks
+"""
+
+# 50 milestones with 40 tasks each, for the pitz-milestones listing.
+milestones_setup = """
+from pitz.project import Project
+from pitz.entity import Milestone, Task
+p = Project(title='lots of milestones')
+p.setup_defaults()
+p.rerun_sort_after_append = False
+for i in xrange(50):
+    m = Milestone(p, title='perf milestone %d' % i)
+    for j in xrange(40):
+        Task(p, title='perf milestone %d task %d' % (i, j), milestone=m)
+p.order()
+"""
+
+# 1,000 tasks with two comments each, for drawing comment counts.
+comments_setup = """
+from pitz.project import Project
+from pitz.entity import Comment, Task
+p = Project(title='lots of comments')
+p.rerun_sort_after_append = False
+for i in xrange(1000):
+    t = Task(p, title='commented task %d' % i)
+    for j in xrange(2):
+        Comment(p, title='comment %d on task %d' % (j, i), entity=t,
+            who_said_it='matt')
+p.order()
+tasks = list(p.tasks)[:100]
+"""
+
 # Map cute name to a tuple of stmt, setup.
 commands = {
 
@@ -52,6 +154,33 @@ commands = {
     'e.matches_dict': StatementAndSetup(
         'e.matches_dict(a=1, b=2, c=3, d=[4,5,6])',
         entity_setup),
+
+    'ti.search': StatementAndSetup(
+        """ti.search('word1 word2')""", textindex_setup),
+
+    'ti.rank top 10': StatementAndSetup(
+        """s = ti.rank('word1 word2 word3')
+heapq.nlargest(10, s, key=s.get)""", textindex_setup),
+
+    'b.detailed_view': StatementAndSetup(
+        """b.detailed_view""", big_bag_setup),
+
+    'b.stream first chunk': StatementAndSetup(
+        """next(b.stream())""", big_bag_setup),
+
+    'milestones summarized': StatementAndSetup(
+        """[m.summarized_view for m in p.milestones]""",
+        milestones_setup),
+
+    'p.first_ten_tasks': StatementAndSetup(
+        """p.note_change(); p.first_ten_tasks""", big_bag_setup),
+
+    'comment counts': StatementAndSetup(
+        """[t.comments.length for t in tasks]""", comments_setup),
+
+    'app.dispatch': StatementAndSetup(
+        """for environ in environs: app.dispatch(environ)""",
+        webapp_setup),
 }
 
 def prof_this(k):
@@ -64,3 +193,96 @@ def prof_this(k):
 def time_this(k, number=100):
     stmt, setup = commands[k]
     return min(timeit.Timer(stmt, setup).repeat(3, number))
+
+def dispatch_rate(number=10000):
+    """
+    Return how many requests per second the webapp can route to a
+    handler, not counting the time to draw the page.
+    """
+
+    ns = dict()
+    exec webapp_setup in ns
+
+    app, environs = ns['app'], ns['environs']
+
+    def route_all():
+        for environ in environs:
+            app.dispatch(environ)
+
+    best = min(timeit.Timer(route_all).repeat(3, number))
+
+    return number * len(environs) / best
+
+
+# Modules that are slow to import.  The pitz-* scripts should only load
+# these when they really need them.
+heavy_modules = ['clepy', 'docutils', 'jinja2', 'tempita', 'uuid',
+    'yaml', 'wsgiref', 'subprocess', 'csv']
+
+# Everything here but the import gets subtracted off as interpreter
+# startup.
+startup_script = """
+import sys, time
+t = time.time()
+from pitz.cmdline import %s
+elapsed = time.time() - t
+heavy = [m for m in %r if sys.modules.get(m)]
+print elapsed, ','.join(heavy)
+"""
+
+def entry_points():
+    """
+    Return (script name, function name) pairs for every console script
+    in setup.py.
+    """
+
+    setup_py = os.path.join(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__))), 'setup.py')
+
+    return re.findall(r'(pitz-[\w-]+) = pitz\.cmdline:(\w+)',
+        open(setup_py).read())
+
+def startup_this(func_name, number=5):
+    """
+    Import one entry point in a fresh interpreter number times.
+
+    Returns the total best time in seconds (interpreter startup plus
+    the import) and the heavy modules that the import dragged in.
+    """
+
+    best = None
+
+    for i in range(number):
+
+        t = timeit.default_timer()
+
+        out = subprocess.Popen(
+            [sys.executable, '-c',
+                startup_script % (func_name, heavy_modules)],
+            stdout=subprocess.PIPE).communicate()[0]
+
+        total = timeit.default_timer() - t
+
+        if best is None or total < best[0]:
+            import_time, heavy = out.split(' ', 1)
+            best = (total, float(import_time), heavy.strip())
+
+    return best
+
+def time_startup(number=5):
+    """
+    Print a table of startup times for every pitz-* script.
+
+    The pitz-frags and pitz-help scripts should start in under 50ms
+    since pitz-frags runs on every tab completion.
+    """
+
+    for script_name, func_name in sorted(entry_points()):
+
+        total, import_time, heavy = startup_this(func_name, number)
+
+        print '%-24s %6.1fms total %6.1fms import  %s' % (
+            script_name, total * 1000, import_time * 1000, heavy)
+
+if __name__ == '__main__':
+    time_startup()
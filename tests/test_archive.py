@@ -0,0 +1,207 @@
+# vim: set expandtab ts=4 sw=4 filetype=python:
+
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+
+from pitz.entity import Comment, Milestone, Status, Task
+from pitz.project import Project
+
+
+class TestArchive(unittest.TestCase):
+
+    def setUp(self):
+
+        self.pitzdir = tempfile.mkdtemp()
+
+        self.p = Project(title='archive', pathname=self.pitzdir)
+        self.p.setup_defaults()
+
+        finished, = Status.by_titles(self.p, 'finished')
+
+        self.m = Milestone(self.p, title='archive milestone')
+
+        self.old = Task(self.p, title='old', milestone=self.m,
+            status=finished, description='feed the zebra')
+
+        self.comment = Comment(self.p, title='on old',
+            entity=self.old, who_said_it='matt')
+
+        self.new = Task(self.p, title='new', milestone=self.m)
+
+        # Pretend the old task got finished two months ago.
+        long_ago = datetime.now() - timedelta(days=60)
+
+        for e in (self.old, self.comment):
+            dict.__setitem__(e, 'modified_time', long_ago)
+
+        self.p.to_yaml_file()
+        self.p.save_entities_to_yaml_files()
+
+    def tearDown(self):
+        shutil.rmtree(self.pitzdir)
+
+    def reload(self):
+        return Project.from_pitzdir(self.pitzdir)
+
+    def test_archive_closed_tasks(self):
+
+        assert self.p.archive_closed_tasks(days=90) == 0
+        assert self.p.archive_closed_tasks(days=30) == 2
+
+        assert self.old.uuid not in self.p.entities_by_uuid
+        assert self.comment.uuid not in self.p.entities_by_uuid
+
+        assert not os.path.exists(
+            os.path.join(self.pitzdir, self.old.yaml_filename))
+
+        assert self.old.uuid in self.p.archive
+        assert self.comment.uuid in self.p.archive
+
+    def test_open_work_leaves_the_archive_alone(self):
+
+        self.p.archive_closed_tasks(days=30)
+
+        from_pickle = self.reload()
+
+        os.unlink(os.path.join(self.pitzdir, 'project.pickle'))
+        from_yaml = self.reload()
+
+        for p in (from_pickle, from_yaml):
+
+            assert list(p.tasks) == [p[self.new.uuid]]
+            assert p.todo.length == 1
+            assert p.milestones[0].todo.length == 1
+            assert p.rollups[self.m].number_of_tasks() == 2
+
+            assert not p.archive_loaded
+
+    def test_progress_still_counts_archived_tasks(self):
+
+        before = self.m.summarized_view
+        self.p.archive_closed_tasks(days=30)
+
+        assert self.m.summarized_view == before
+
+        p = self.reload()
+        assert '50% complete (1 / 2 tasks)' in p.milestones[0].summarized_view
+        assert not p.archive_loaded
+
+    def test_closed_queries_load_the_archive(self):
+
+        self.p.archive_closed_tasks(days=30)
+
+        p = self.reload()
+        finished = p.tasks(status='finished')
+        assert [t.uuid for t in finished] == [self.old.uuid]
+        assert p.archive_loaded
+
+        p = self.reload()
+        finished = p(type='task', status='finished')
+        assert [t.uuid for t in finished] == [self.old.uuid]
+        assert p.archive_loaded
+
+        old = p[self.old.uuid]
+        assert [c.uuid for c in old.comments] == [self.comment.uuid]
+        assert old.milestone.tasks.length == 2
+
+    def test_archived_entities_stay_in_the_indexes(self):
+
+        from pitz.fragindex import matching_frags
+
+        self.p.archive_closed_tasks(days=30)
+
+        assert self.old.frag in matching_frags(self.pitzdir, ['task'])
+
+        p = self.reload()
+        assert [t.uuid for t in p.search('zebra')] == [self.old.uuid]
+
+        p = self.reload()
+        found = p.tasks(status='finished').grep('zebra')
+        assert [t.uuid for t in found] == [self.old.uuid]
+
+        # Saving with the archive left on disk keeps it all too.
+        p = self.reload()
+        p[self.new.uuid]['title'] = 'newer'
+        p.save_entities_to_yaml_files()
+
+        assert self.old.frag in matching_frags(self.pitzdir, ['task'])
+        assert str(self.old.uuid) in p.textindex.words_by_uuid
+
+    def test_frag_lookups_load_the_archive(self):
+
+        self.p.archive_closed_tasks(days=30)
+
+        p = self.reload()
+        assert p[self.old.frag].uuid == self.old.uuid
+        assert p.by_frag(self.comment.frag).uuid == self.comment.uuid
+
+        self.assertRaises(KeyError, p.by_frag, 'zzzzzz')
+
+    def test_pickle_leaves_out_archived_entities(self):
+
+        self.p.archive_closed_tasks(days=30)
+
+        p = self.reload()
+        p.load_archive()
+        assert p.tasks.length == 2
+
+        p.to_pickle()
+        p = Project.from_pickle(os.path.join(self.pitzdir, 'project.pickle'))
+
+        assert p.tasks.length == 1
+        assert not p.archive_loaded
+        assert p.rollups[self.m].number_of_tasks() == 2
+
+    def test_reopened_tasks_leave_the_archive(self):
+
+        self.p.archive_closed_tasks(days=30)
+
+        p = self.reload()
+        old = p[self.old.frag]
+        old['status'] = Status(p, title='unstarted')
+        p.save_entities_to_yaml_files()
+
+        assert self.old.uuid not in p.archive
+
+        p = self.reload()
+        assert p.todo.length == 2
+        assert not p.archive_loaded
+
+    def test_webapp_loads_the_archive_up_front(self):
+
+        from pitz.webapp import SimpleWSGIApp
+
+        self.p.archive_closed_tasks(days=30)
+
+        p = self.reload()
+        SimpleWSGIApp(p)
+
+        # So GETs holding just the read lock never have to.
+        assert p.archive_loaded
+        assert self.old.uuid in p.entities_by_uuid
+
+    def test_self_destruct_reaches_into_the_archive(self):
+
+        self.p.archive_closed_tasks(days=30)
+
+        # Reopening the task takes it out of the archive, but its
+        # comment stays in there.
+        p = self.reload()
+        p[self.old.frag]['status'] = Status(p, title='unstarted')
+        p.save_entities_to_yaml_files()
+
+        p = self.reload()
+        assert self.comment.uuid in p.archive
+        assert not p.archive_loaded
+
+        deleted = p[self.old.uuid].self_destruct(p)
+
+        assert '%s#%s' % (p.archive.data_path, self.comment.uuid) \
+        in deleted
+
+        p = self.reload()
+        assert self.comment.uuid not in p.archive
+        assert not p.archive.referrers(self.old, 'entity')
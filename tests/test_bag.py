@@ -398,3 +398,317 @@ class TestBag(unittest.TestCase):
         b2 = b[0:2]
 
         assert isinstance(b2, Bag), "b2 is a %s" % type(b2)
+
+
+class TestChunkedGrep(unittest.TestCase):
+
+    def setUp(self):
+
+        import tempfile
+
+        self.pathname = tempfile.mkdtemp()
+
+        self.b = Bag('Lots of files', pathname=self.pathname)
+
+        for i in range(20):
+
+            e = Entity(title='chunky %s %d' % (self.pathname, i),
+                flavor=('vanilla', 'chocolate')[i % 2])
+
+            self.b.append(e)
+            e.to_yaml_file(self.pathname)
+
+    def tearDown(self):
+
+        import shutil
+        shutil.rmtree(self.pathname)
+
+    def test_argv_chunks(self):
+
+        from pitz.bag import argv_chunks
+
+        chunks = list(argv_chunks(['grep'], ['x' * 10] * 10, 100))
+
+        assert len(chunks) > 1
+        assert sum(len(c) for c in chunks) == 10
+
+    @mock.patch('pitz.bag.argv_chunks')
+    def test_grep_files_in_chunks(self, m):
+
+        from pitz.bag import grep_files
+
+        files = [os.path.join(self.pathname, e.yaml_filename)
+            for e in self.b]
+
+        # One file per command line.
+        m.return_value = iter([[f] for f in files])
+
+        matches = list(grep_files(['grep', '-l', 'chocolate'], files,
+            workers=3))
+
+        assert len(matches) == 10, matches
+        assert all(f in files for f in matches)
+
+    def test_grep_with_limit(self):
+
+        assert len(self.b.grep('chocolate')) == 10
+        assert len(self.b.grep('chocolate', limit=3)) == 3
+        assert len(self.b.grep('CHOCOLATE', ignore_case=True)) == 10
+
+    def test_limit_keeps_the_first_in_order(self):
+
+        self.b.order(pitz.by_whatever('by_title', 'title', reverse=True))
+
+        chocolate = [e for e in self.b if e['flavor'] == 'chocolate']
+
+        assert list(self.b.grep('chocolate', limit=3)) == chocolate[:3]
+
+    @mock.patch('pitz.bag.grep_files')
+    def test_limit_stops_early(self, m):
+
+        read = []
+
+        def matching_files():
+            for e in self.b:
+                read.append(e)
+                yield os.path.join(self.pathname, e.yaml_filename)
+
+        m.return_value = matching_files()
+
+        assert list(self.b.grep('chunky', limit=3)) == list(self.b[:3])
+        assert len(read) == 3
+        assert m.call_args[1] == dict(ordered=True)
+
+    def test_grep_files_in_order(self):
+
+        from pitz.bag import grep_files
+
+        files = [os.path.join(self.pathname, e.yaml_filename)
+            for e in self.b]
+
+        # One file per command line, so the chunks race each other.
+        with mock.patch('pitz.bag.argv_chunks') as m:
+
+            m.return_value = iter([[f] for f in files])
+
+            matches = list(grep_files(['grep', '-l', 'chunky'], files,
+                workers=4, ordered=True))
+
+        assert matches == files
+
+
+class TestTop(unittest.TestCase):
+
+    def setUp(self):
+
+        self.b = Bag(title='top',
+            entities=[Entity(title='top entity %d' % i, pscore=(i * 7) % 20)
+                for i in range(20)])
+
+    def test_matches_a_full_sort(self):
+
+        by_title = pitz.by_whatever('by_title', 'title')
+
+        assert list(self.b.top(5, by_title)) \
+        == sorted(self.b, cmp=by_title)[:5]
+
+        assert list(self.b.top(5)) == list(self.b)[:5]
+
+    @mock.patch('pitz.bag.heapq.nsmallest')
+    def test_sorted_bags_skip_the_heap(self, m):
+
+        odd = lambda e: e['pscore'] % 2
+
+        top = self.b.top(3, predicate=odd)
+
+        assert not m.called
+        assert list(top) == [e for e in self.b if odd(e)][:3]
+
+    def test_changing_an_entity_means_a_heap(self):
+
+        # These entities have no project, so nothing bumps my
+        # generation when one of them changes.
+        last = list(self.b)[-1]
+        last['pscore'] = 100
+
+        assert list(self.b.top(1)) == [last]
+
+        # Same goes for views.
+        v = self.b.top(20)[:5]
+        first = list(v)[0]
+        first['pscore'] = -1
+
+        assert first not in list(v.top(4))
+
+    def test_changes_mean_a_heap(self):
+
+        self.b.note_change()
+
+        top = self.b.top(3)
+
+        assert [e['pscore'] for e in top] == [19, 18, 17]
+
+
+class TestRemoveMany(unittest.TestCase):
+
+    def setUp(self):
+
+        self.by_title = pitz.by_whatever('by_title', 'title')
+
+        self.entities = [Entity(title='remove many %02d' % i)
+            for i in range(10)]
+
+        self.b = Bag(title='remove many', entities=self.entities,
+            order_method=self.by_title)
+
+    def test_remove_many(self):
+
+        doomed = self.entities[::3]
+
+        assert self.b.remove_many(doomed + doomed[:1]) == doomed
+
+        assert list(self.b) \
+        == [e for i, e in enumerate(self.entities) if i % 3]
+
+        for e in doomed:
+            assert e not in self.b
+            assert e.uuid not in self.b.entities_by_uuid
+            assert e.frag not in self.b.entities_by_frag
+
+        # I stayed in order, so I don't need another sort.
+        assert self.b._ordered[1] is self.by_title
+
+    def test_index_follows_changes(self):
+
+        e = self.entities[5]
+        assert self.b.index(e) == 5
+
+        self.b.remove_many(self.entities[:2])
+        assert self.b.index(e) == 3
+
+        e2 = Entity(title='remove many 99')
+        self.b.append(e2)
+        assert self.b.index(e2) == 8
+
+        self.assertRaises(ValueError, self.b.index, self.entities[0])
+
+    def test_contains_is_by_uuid(self):
+
+        assert self.entities[0] in self.b
+        assert Entity(title='never added') not in self.b
+        assert 'remove many 00' not in self.b
+
+
+class TestSetOperations(unittest.TestCase):
+
+    def setUp(self):
+
+        self.by_title = pitz.by_whatever('by_title', 'title')
+
+        self.entities = [Entity(title='set operations %02d' % i)
+            for i in range(10)]
+
+        self.evens = Bag(title='evens', entities=self.entities[::2],
+            order_method=self.by_title)
+
+        self.low = Bag(title='low', entities=self.entities[:5],
+            order_method=self.by_title)
+
+    def test_or(self):
+
+        both = self.evens | self.low
+
+        assert list(both) == sorted(set(self.evens._elements
+            + self.low._elements), cmp=self.by_title)
+
+        assert both.order_method is self.by_title
+        assert both._is_ordered()
+
+        assert list(self.evens + self.low) == list(both)
+
+    @mock.patch('pitz.bag.merge_ordered')
+    def test_or_sorts_when_orders_differ(self, m):
+
+        self.low.order(pitz.by_whatever('backwards', 'title',
+            reverse=True))
+
+        both = self.evens | self.low
+
+        assert not m.called
+        assert list(both) == sorted(both, cmp=self.by_title)
+
+    def test_and(self):
+
+        assert list(self.evens & self.low) \
+        == [self.entities[i] for i in (0, 2, 4)]
+
+    def test_sub(self):
+
+        assert list(self.evens - self.low) \
+        == [self.entities[i] for i in (6, 8)]
+
+        assert list(self.low - self.evens) \
+        == [self.entities[i] for i in (1, 3)]
+
+    @raises(TypeError)
+    def test_only_bags(self):
+        self.evens | self.entities
+
+
+class TestBagView(unittest.TestCase):
+
+    def setUp(self):
+
+        self.by_title = pitz.by_whatever('by_title', 'title')
+
+        self.entities = [Entity(title='bag view %02d' % i,
+            flavor=('vanilla', 'chocolate')[i % 2]) for i in range(10)]
+
+        self.b = Bag(title='bag view', entities=self.entities,
+            order_method=self.by_title)
+
+    def test_views(self):
+
+        from pitz.bag import BagView
+
+        for v in (self.b[2:5], self.b(flavor='vanilla'),
+            self.b.does_not_match_dict(flavor='chocolate'),
+            self.b(flavor='vanilla')[:2]):
+
+            assert isinstance(v, BagView)
+            assert v.parent is self.b
+            assert v._is_ordered()
+
+    def test_lookups_stay_inside_the_view(self):
+
+        v = self.b(flavor='vanilla')
+        vanilla, chocolate = self.entities[:2]
+
+        assert v.by_uuid(vanilla.uuid) is vanilla
+        assert v.by_uuid(chocolate.uuid) is chocolate.uuid
+        assert v.by_frag(vanilla.frag) is vanilla
+        self.assertRaises(KeyError, v.by_frag, chocolate.frag)
+
+        assert v.index(self.entities[4]) == 2
+        assert set(v.entities_by_uuid) == set(e.uuid for e in v)
+
+    def test_changes_make_a_real_bag(self):
+
+        v = self.b[:3]
+        e = v.pop()
+
+        assert type(v) is Bag
+        assert e not in v and e in self.b
+        assert e.uuid not in v.entities_by_uuid
+        assert len(v) == 2 and len(self.b) == 10
+
+        v.append(e)
+        assert list(v) == self.entities[:3]
+
+    def test_sorting_a_view_leaves_the_parent_alone(self):
+
+        v = self.b[:3]
+        v.order(pitz.by_whatever('backwards', 'title', reverse=True))
+
+        assert list(v) == self.entities[2::-1]
+        assert list(self.b) == self.entities
@@ -10,6 +10,7 @@ from mock import Mock, patch
 
 from pitz import cmdline
 from pitz.cmdline.pitzsetup import mk_pitzdir
+from pitz.lock import lock_pitzdir, unlock_pitzdir
 from pitz.project import Project
 from pitz.entity import Entity
 
@@ -105,6 +106,20 @@ class TestPitzTodo(TestPitzCmdLine):
         cmdline.pitz_todo()
 
 
+class TestPitzSearch(TestPitzCmdLine):
+
+    @patch('clepy.send_through_pager')
+    def test_search(self, m1):
+
+        sys.argv = ['pitz-search', '--no-color', 'frog']
+
+        cmdline.pitz_search()
+
+        output = m1.call_args[0][0]
+        assert '*frog*' in output, output
+        assert 'toad' not in output, output
+
+
 class TestPitzShell(TestPitzCmdLine):
 
     def test_version(self):
@@ -200,3 +215,66 @@ class TestPitzScript(unittest.TestCase):
             None, bogus_options, [], 'bogus')
 
         assert b == 'bogus', 'b is %s!' % b
+
+    def test_apply_filter_and_grep_with_operators(self):
+
+        from pitz.bag import Bag
+
+        bogus_options = Mock()
+        bogus_options.grep = False
+
+        frog, toad, newt = [Entity(title=t, color=c) for t, c in
+            [('operator frog', 'green'), ('operator toad', 'brown'),
+                ('operator newt', 'green')]]
+
+        b = Bag(entities=[frog, toad, newt])
+
+        script = cmdline.PitzScript(title='bogus pitz script')
+
+        def f(*args):
+            return set(e.title for e in
+                script.apply_filter_and_grep(None, bogus_options, args, b))
+
+        assert f('color=brown', '|', 'title=operator newt') \
+        == set(['operator toad', 'operator newt'])
+
+        assert f('color=green', '&', 'title=operator newt') \
+        == set(['operator newt'])
+
+        assert f('-', 'color=green') == set(['operator toad'])
+
+
+class TestLocking(TestPitzCmdLine):
+
+    def setUp(self):
+
+        super(TestLocking, self).setUp()
+        self.lockfile = lock_pitzdir('/tmp/pitzdir', shared=True)
+
+    def tearDown(self):
+
+        unlock_pitzdir(self.lockfile)
+        super(TestLocking, self).tearDown()
+
+    @patch('clepy.send_through_pager')
+    def test_readers_share(self, m1):
+
+        sys.argv = ['pitz-todo', '--pitzdir', '/tmp/pitzdir']
+
+        cmdline.pitz_todo()
+
+        assert m1.called
+
+    @raises(SystemExit)
+    def test_writers_wait_for_readers(self):
+
+        sys.argv = ['pitz-pause-task', '--pitzdir', '/tmp/pitzdir',
+            'abc123']
+
+        cmdline.pitz_pause_task()
+
+    def test_read_only(self):
+
+        assert cmdline.pitz_todo.read_only
+        assert not cmdline.pitz_pause_task.read_only
+        assert not cmdline.pitz_refresh_pickle.read_only
@@ -0,0 +1,69 @@
+# vim: set expandtab ts=4 sw=4 filetype=python:
+
+import os
+import sys
+import threading
+import unittest
+
+from mock import patch
+
+from pitz import cmdline, daemon
+
+from tests.test_cmdline import TestPitzCmdLine
+
+
+class TestPitzDaemon(TestPitzCmdLine):
+
+    def setUp(self):
+
+        super(TestPitzDaemon, self).setUp()
+
+        self.d = daemon.PitzDaemon('/tmp/pitzdir',
+            cmdline.pitz_help.commands)
+
+        self.t = threading.Thread(target=self.d.serve_forever)
+        self.t.start()
+
+    def tearDown(self):
+
+        self.d.shutdown()
+        self.t.join()
+        self.d.server_close()
+
+        super(TestPitzDaemon, self).tearDown()
+
+    def test_ping(self):
+        assert daemon.ask('/tmp/pitzdir', None, []) == \
+        dict(status=0, output='')
+
+    def test_refuses_writers(self):
+
+        reply = daemon.ask('/tmp/pitzdir', 'pitz-add-task', [])
+        assert reply['status'] == 1, reply
+
+    @patch('clepy.send_through_pager')
+    def test_everything(self, m):
+
+        sys.argv = ['pitz-everything', '--pitzdir', '/tmp/pitzdir']
+
+        cmdline.pitz_everything()
+
+        output = m.call_args[0][0]
+        assert 'frog' in output and 'toad' in output, output
+
+    @patch('clepy.send_through_pager')
+    def test_filter(self, m):
+
+        sys.argv = ['pitz-everything', '--pitzdir', '/tmp/pitzdir',
+            'title=frog']
+
+        cmdline.pitz_everything()
+
+        output = m.call_args[0][0]
+        assert 'frog' in output and 'toad' not in output, output
+
+
+class TestNoDaemon(unittest.TestCase):
+
+    def test_ask(self):
+        assert daemon.ask('/tmp', None, []) is None
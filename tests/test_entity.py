@@ -1,5 +1,6 @@
 # vim: set expandtab ts=4 sw=4 filetype=python:
 
+import gc
 import glob
 import os
 import pickle
@@ -12,7 +13,7 @@ from mock import patch
 
 from pitz.entity import (
     Entity, Task, Status, Comment, Component,
-    Person, Estimate, Milestone,
+    Person, Estimate, Milestone, EntityDoesNotExist,
     )
 from pitz.project import Bag, Project
 from pitz import NoProject
@@ -135,13 +136,10 @@ def test_self_destruct_2():
 
     assert e1.activities.length == 1, e1.activities.length
 
-    a = e1.activities[0]
-    activity_yaml_file = a.to_yaml_file(p.pathname)
-
     files_deleted = sorted(e1.self_destruct(p))
 
-    files_created = sorted(
-        [file_written, comment_yaml_file, activity_yaml_file])
+    # Activities live in the journal now, not in their own files.
+    files_created = sorted([file_written, comment_yaml_file])
 
     print("files_deleted is %s" % files_deleted)
     print("files_created is %s" % files_created)
@@ -149,6 +147,7 @@ def test_self_destruct_2():
     assert files_deleted == files_created
 
     assert not os.path.exists(file_written)
+    assert p.journal.for_entity(e1) == []
 
 
 @raises(TypeError)
@@ -965,3 +964,62 @@ class TestViews(unittest.TestCase):
     def test_rst_link_view(self):
 
         self.e.rst_link_target_view
+
+
+class TestRegistry(unittest.TestCase):
+    """
+    Every project keeps its own title lookups.
+    """
+
+    def setUp(self):
+
+        self.p1 = Project(title='registry 1')
+        self.p2 = Project(title='registry 2')
+
+    def test_same_title_in_two_projects(self):
+
+        t1 = Task(self.p1, title='registry task')
+        t2 = Task(self.p2, title='registry task')
+
+        assert t1 is not t2
+        assert t1.uuid != t2.uuid
+
+        assert Task.by_title('registry task', self.p1) is t1
+        assert Task.by_title('registry task', self.p2) is t2
+
+        assert list(Task.all(self.p1)) == [t1]
+
+    def test_unowned_entities_join_a_project(self):
+
+        e = Entity(title='registry orphan')
+        assert Entity(self.p1, title='registry orphan') is e
+        assert e.project is self.p1
+
+    def test_retitle(self):
+
+        t = Task(self.p1, title='registry before')
+        t['title'] = 'registry after'
+
+        assert Task.by_title('registry after', self.p1) is t
+
+        self.assertRaises(EntityDoesNotExist,
+            Task.by_title, 'registry before', self.p1)
+
+    def test_pop(self):
+
+        t = Task(self.p1, title='registry popped')
+        self.p1.pop(self.p1.index(t))
+
+        assert (Task, 'registry popped') not in self.p1.entities_by_title
+
+    def test_dropped_projects_go_away(self):
+
+        p = Project(title='registry dropped')
+
+        for i in range(20):
+            Task(p, title='registry dropped task %d' % i)
+
+        p = None
+        gc.collect()
+
+        assert 'registry dropped task 0' not in Task.already_instantiated
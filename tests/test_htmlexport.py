@@ -0,0 +1,71 @@
+# vim: set expandtab ts=4 sw=4 filetype=python:
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from pitz.entity import Entity, Task
+from pitz.htmlexport import HtmlExport
+from pitz.project import Project
+
+
+class TestHtmlExport(unittest.TestCase):
+
+    def setUp(self):
+
+        self.pitzdir = tempfile.mkdtemp()
+        self.htmldir = tempfile.mkdtemp()
+
+        n = os.path.basename(self.pitzdir)
+
+        self.p = Project(title='exported project', pathname=self.pitzdir)
+
+        self.tasks = [Task(self.p, title='task %d %s' % (i, n))
+            for i in range(6)]
+
+        self.loner = Entity(self.p, title='loner %s' % n)
+
+    def tearDown(self):
+        shutil.rmtree(self.pitzdir)
+        shutil.rmtree(self.htmldir)
+
+    def test_second_run_skips_everything(self):
+
+        first = HtmlExport(self.p, self.htmldir, workers=1).run()
+        assert first.rendered == len(self.p) + 5
+        assert first.skipped == 0
+
+        assert os.path.exists(
+            os.path.join(self.htmldir, self.loner.html_filename))
+
+        second = HtmlExport(self.p, self.htmldir, workers=1).run()
+        assert second.rendered == 0, second.report
+        assert second.skipped == first.rendered
+
+    def test_one_change_renders_its_neighborhood(self):
+
+        HtmlExport(self.p, self.htmldir, workers=1).run()
+
+        self.loner['flavor'] = 'sour'
+
+        # Just the loner and the project page, which lists everything.
+        again = HtmlExport(self.p, self.htmldir, workers=1).run()
+        assert again.rendered == 2, again.report
+
+        self.tasks[0]['flavor'] = 'sweet'
+
+        # The task, its milestone, status, and estimate pages, and
+        # every bag page that lists tasks.
+        again = HtmlExport(self.p, self.htmldir, workers=1).run()
+        assert 5 < again.rendered < len(self.p), again.report
+
+    def test_process_pool(self):
+
+        export = HtmlExport(self.p, self.htmldir, workers=2).run()
+
+        assert export.rendered == len(self.p) + 5
+        assert 'Rendered' in export.report
+
+        for e in self.p:
+            assert os.path.exists(os.path.join(self.htmldir, e.html_filename))
@@ -0,0 +1,273 @@
+# vim: set expandtab ts=4 sw=4 filetype=python:
+
+import glob
+import os
+import shutil
+import tempfile
+import unittest
+import uuid
+from datetime import datetime, timedelta
+
+from pitz.entity import Person, Task
+from pitz.journal import Journal, Record
+from pitz.project import Project
+
+
+class TestJournal(unittest.TestCase):
+
+    def setUp(self):
+
+        self.pitzdir = tempfile.mkdtemp()
+
+        self.j = Journal(self.pitzdir)
+        self.j.records_per_segment = 3
+
+        self.e1, self.e2 = uuid.uuid4(), uuid.uuid4()
+        self.who = uuid.uuid4()
+
+        for i in range(7):
+            self.j.record(self.e1 if i % 2 else self.e2, 'pscore', i,
+                i + 1, self.who)
+
+    def tearDown(self):
+        shutil.rmtree(self.pitzdir)
+
+    def test_flush_rotates_segments(self):
+
+        assert self.j.flush() == 7
+        assert self.j.flush() == 0
+
+        segments = self.j.segments()
+        assert len(segments) == 3
+
+        assert [os.path.getsize(fp) / Record.layout.size
+            for fp in segments] == [3, 3, 1]
+
+        j2 = Journal(self.pitzdir)
+        j2.records_per_segment = 3
+        j2.record(self.e1, 'pscore', 7, 8, self.who)
+        j2.flush()
+
+        assert len(j2.segments()) == 3
+        assert os.path.getsize(j2.segments()[-1]) == 2 * Record.layout.size
+
+    def test_reads_back_in_order(self):
+
+        self.j.flush()
+
+        j2 = Journal(self.pitzdir)
+
+        assert [r.old for r in j2.for_entity(self.e1)] == ['1', '3', '5']
+        assert len(j2.for_person(self.who)) == 7
+        assert [r.new for r in j2.latest(2)] == ['7', '6']
+
+    def test_unloaded_appends_go_after_the_disk(self):
+
+        self.j.flush()
+
+        j2 = Journal(self.pitzdir)
+        j2.record(self.e1, 'pscore', 'x', 'y', self.who)
+
+        assert [r.old for r in j2.for_entity(self.e1)] \
+        == ['1', '3', '5', 'x']
+
+    def test_forget(self):
+
+        self.j.forget(self.e1)
+        self.j.record(self.e1, 'pscore', 'back', 'again', self.who)
+        self.j.flush()
+
+        for j in (self.j, Journal(self.pitzdir)):
+            assert [r.old for r in j.for_entity(self.e1)] == ['back']
+            assert len(j) == 5
+
+    def test_torn_record(self):
+
+        self.j.flush()
+
+        f = open(self.j.segments()[-1], 'ab')
+        f.write('half a record')
+        f.close()
+
+        assert len(Journal(self.pitzdir)) == 7
+
+
+class TestCompact(unittest.TestCase):
+
+    def setUp(self):
+
+        self.pitzdir = tempfile.mkdtemp()
+        self.j = Journal(self.pitzdir)
+
+        self.e1, self.e2 = uuid.uuid4(), uuid.uuid4()
+        self.who = uuid.uuid4()
+
+        self.now = datetime(2010, 6, 1, 12)
+        long_ago = self.now - timedelta(days=200)
+
+        # Somebody dragging a task up the list, and starting it along
+        # the way.
+        for m in range(5):
+
+            self.j.record(self.e1, 'pscore', m, m + 1, self.who,
+                created_time=self.now - timedelta(minutes=10 - m))
+
+            if m == 2:
+                self.j.record(self.e1, 'status', 'unstarted', 'started',
+                    self.who, created_time=self.now - timedelta(minutes=7))
+
+        # Old history on another task.
+        for h, attr in enumerate(['title', 'status', 'title', 'pscore']):
+            self.j.record(self.e2, attr, 'x', 'y', self.who,
+                created_time=long_ago + timedelta(hours=h))
+
+        self.j.flush()
+
+    def tearDown(self):
+        shutil.rmtree(self.pitzdir)
+
+    def test_compact(self):
+
+        size = sum(os.path.getsize(fp) for fp in self.j.segments())
+
+        assert self.j.compact(timedelta(minutes=5), timedelta(days=90),
+            now=self.now) == (10, 5)
+
+        assert sum(os.path.getsize(fp) for fp in self.j.segments()) \
+        == size / 2
+
+        for j in (self.j, Journal(self.pitzdir)):
+
+            # The status change splits the pscore changes into two runs.
+            assert [(r.attr, r.old, r.new) for r in j.for_entity(self.e1)] \
+            == [('pscore', '0', '3'), ('status', 'unstarted', 'started'),
+                ('pscore', '3', '5')]
+
+            assert [(r.attr, r.how_many) for r in j.for_entity(self.e2)] \
+            == [('status', 1), ('*title,pscore', 3)]
+
+        assert not os.path.exists(self.j.dirpath + '.tmp')
+        assert not os.path.exists(self.j.dirpath + '.old')
+
+    def test_long_attribute_lists(self):
+
+        attrs = ['description', 'milestone', 'components', 'estimate',
+            'title', 'owner']
+
+        start = self.now - timedelta(days=300)
+
+        for h, attr in enumerate(attrs):
+            self.j.record(self.e2, attr, 'x', 'y', self.who,
+                created_time=start + timedelta(hours=h))
+
+        self.j.compact(timedelta(minutes=5), timedelta(days=90),
+            now=self.now)
+
+        for r in Journal(self.pitzdir).for_entity(self.e2):
+
+            assert len(r.attr) <= 24, r.attr
+
+            for a in r.attrs:
+                assert a in attrs + ['status', 'pscore'], r.attrs
+
+        summaries = [r for r in Journal(self.pitzdir).for_entity(self.e2)
+            if r.is_summary and r.how_many == len(attrs)]
+
+        assert [r.attr for r in summaries] == ['*description,+5']
+        assert summaries[0].attrs == ['description']
+        assert summaries[0].unlisted == 5
+
+    def test_status_changes_survive(self):
+
+        self.j.compact(timedelta(days=1000), timedelta(days=0),
+            now=self.now)
+
+        statuses = [r for r in Journal(self.pitzdir).for_person(self.who)
+            if r.attr == 'status']
+
+        assert len(statuses) == 2
+
+
+class TestActivities(unittest.TestCase):
+
+    def setUp(self):
+
+        # Titles are global, so keep mine from running into anybody
+        # else's.
+        n = uuid.uuid4().hex[:8]
+
+        self.pitzdir = tempfile.mkdtemp()
+
+        self.p = Project(title='journal %s' % n, pathname=self.pitzdir)
+        self.p.to_yaml_file()
+
+        self.p.current_user = Person(self.p, title='journaler %s' % n)
+        self.t = Task(self.p, title='journaled %s' % n)
+
+        for i in range(5):
+            self.t['pscore'] = i
+
+        self.p.save_entities_to_yaml_files()
+
+    def tearDown(self):
+        shutil.rmtree(self.pitzdir)
+
+    def test_no_activity_files(self):
+
+        assert not glob.glob(os.path.join(self.pitzdir, 'activity-*'))
+        assert len(self.p.journal.segments()) == 1
+
+    def test_reading_activities(self):
+
+        p = Project.from_pitzdir(self.pitzdir)
+        t = p[self.t.uuid]
+        me = p[self.p.current_user.uuid]
+
+        assert t.activities.length == 5
+        assert me.my_activities.length == 5
+        assert p.activities.length == 5
+
+        a = p.recent_activity[0]
+
+        assert a['entity'] is t
+        assert a['who_did_it'] is me
+        assert a.title == '%s set pscore from 3 to 4 on %s' \
+        % (me.abbr, t.frag)
+
+        assert [x.uuid for x in me.four_recent_activities] \
+        == [x.uuid for x in me.my_activities[:4]]
+
+    def test_summaries(self):
+
+        long_ago = datetime.now() - timedelta(days=200)
+
+        for h in range(3):
+            self.p.journal.record(self.t, 'title', 'a', 'b', self.p.me,
+                created_time=long_ago + timedelta(hours=h))
+
+        self.p.save_entities_to_yaml_files()
+        self.p.journal.compact()
+
+        assert self.t.activities.length == 2
+        assert self.t.activities[-1].title \
+        == '%s made 3 changes to title on %s' % (self.p.me.abbr, self.t.frag)
+
+    def test_self_destruct(self):
+
+        self.t.self_destruct(self.p)
+        self.p.save_entities_to_yaml_files()
+
+        p = Project.from_pitzdir(self.pitzdir)
+
+        assert p.activities.length == 0
+
+    def test_wide_characters(self):
+
+        self.t['description'] = u'\xfcber' * 10
+        self.p.save_entities_to_yaml_files()
+
+        p = Project.from_pitzdir(self.pitzdir)
+        a = p.recent_activity[0]
+
+        assert (u'to %s' % (u'\xfcber' * 4)[:16]) in a.title, a.title
+        assert a.summarized_view
@@ -33,3 +33,43 @@ class TestByPscoreAndMilestone(unittest.TestCase):
             '%s, %s' % (e['pscore'], prevscore)
 
             prevscore = e['pscore']
+
+
+def test_lazy_module():
+
+    from pitz import LazyModule
+
+    lm = LazyModule('pitz_no_such_module')
+
+    try:
+        lm.whatever
+
+    except ImportError:
+        pass
+
+    else:
+        raise AssertionError("Should have raised an ImportError")
+
+
+def test_cmdline_imports_are_cheap():
+    """
+    Importing pitz.cmdline shouldn't drag in the slow stuff.
+    """
+
+    import os, subprocess, sys
+
+    # Make sure the child finds this copy of pitz.
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__))))
+
+    out = subprocess.Popen([sys.executable, '-c',
+        "import sys, pitz.cmdline; "
+        "print ' '.join(m for m in ['jinja2', 'yaml', 'docutils', "
+        "'tempita', 'clepy', 'uuid', 'subprocess', 'hashlib', "
+        "'pitz.archive', 'pitz.journal', 'pitz.packfile', "
+        "'pitz.textindex', 'pitz.fragindex', 'pitz.rstcache', "
+        "'pitz.htmlexport'] "
+        "if sys.modules.get(m))"],
+        stdout=subprocess.PIPE, env=env).communicate()[0]
+
+    assert out.strip() == '', out
@@ -2,6 +2,8 @@
 
 import glob
 import os
+import shutil
+import tempfile
 import unittest
 
 from nose.tools import raises
@@ -411,3 +413,289 @@ class TestProperties(unittest.TestCase):
 
     def test_me(self):
         assert self.p.me is None
+
+    def test_short_lists_match_the_long_ones(self):
+
+        from pitz.entity import Person, Status, Task
+
+        p = Project(title='short lists')
+        p.setup_defaults()
+
+        matt = Person(p, title='short lists matt')
+        p.current_user = matt
+
+        for i in range(30):
+
+            t = Task(p, title='short list task %d' % i, pscore=i % 7,
+                owner=matt)
+
+            if i % 3 == 0:
+                t['status'] = Status(title='finished')
+
+        assert list(p.first_ten_tasks) == list(p.todo[:10])
+        assert list(p.recent_activity) == list(p.activities[:10])
+
+        assert matt.top_priority_task == matt.my_todo[:1][0]
+        assert list(matt.first_four_tasks) == list(matt.my_todo[:4])
+
+        assert list(matt.four_recent_activities) \
+        == list(matt.my_activities[:4])
+
+
+class TestPackfile(unittest.TestCase):
+
+    def setUp(self):
+
+        self.pitzdir = tempfile.mkdtemp()
+
+        self.p = Project(title='packed project', pathname=self.pitzdir)
+        self.e1 = Entity(self.p, title='packed entity 1')
+        self.e2 = Entity(self.p, title='packed entity 2')
+        self.p.to_yaml_file()
+        self.p.save_entities_to_yaml_files()
+
+    def tearDown(self):
+        shutil.rmtree(self.pitzdir)
+
+    def test_pack(self):
+
+        assert self.p.pack() == 2
+
+        assert not glob.glob(os.path.join(self.pitzdir, 'entity-*.yaml'))
+        assert self.e1.frag in self.p.packfile
+
+        p2 = Project(pathname=self.pitzdir)
+        assert self.e1.uuid in p2.entities_by_uuid
+        assert self.e2.uuid in p2.entities_by_uuid
+
+    def test_save_appends_to_pack(self):
+
+        self.p.pack()
+        self.e1['flavor'] = 'chocolate'
+
+        assert self.p.save_entities_to_yaml_files() == [self.e1]
+        assert self.p.packfile.read(self.e1.frag)['flavor'] == 'chocolate'
+
+        # Rebuilding the index from the data file finds the newest
+        # record.
+        self.p.packfile.rebuild_index()
+        assert self.p.packfile.read(self.e1.frag)['flavor'] == 'chocolate'
+
+    def test_self_destruct_and_compact(self):
+
+        self.p.pack()
+        self.e2.self_destruct(self.p)
+
+        assert self.e2.uuid not in self.p.packfile
+        assert len(self.p.packfile.compact()) == 1
+        assert self.e1.uuid in self.p.packfile.rebuild_index()
+
+    def test_unpack(self):
+
+        self.p.pack()
+
+        assert self.p.unpack() == 2
+        assert self.p.packfile is None
+
+        assert os.path.isfile(
+            os.path.join(self.pitzdir, self.e1.yaml_filename))
+
+    def test_empty_pack_is_still_a_pack(self):
+
+        self.p.pack()
+        self.e1.self_destruct(self.p)
+        self.e2.self_destruct(self.p)
+
+        assert len(self.p.packfile) == 0
+
+        e3 = Entity(self.p, title='packed entity 3')
+        self.p.save_entities_to_yaml_files()
+
+        assert not os.path.exists(
+            os.path.join(self.pitzdir, e3.yaml_filename))
+
+        assert e3.uuid in self.p.packfile
+
+        e3.self_destruct(self.p)
+        assert self.p.unpack() == 0
+        assert self.p.packfile is None
+
+
+class TestFragIndex(unittest.TestCase):
+
+    def setUp(self):
+
+        from pitz.entity import Person, Task
+
+        self.pitzdir = tempfile.mkdtemp()
+
+        # Entities with the same title get reused between tests, so
+        # make these titles unique.
+        n = os.path.basename(self.pitzdir)
+
+        self.p = Project(title='indexed project', pathname=self.pitzdir)
+        self.e = Entity(self.p, title='plain\nentity %s' % n)
+        self.person = Person(self.p, title='somebody %s' % n)
+        self.t = Task(self.p, title='some task %s' % n)
+        self.p.to_yaml_file()
+        self.p.save_entities_to_yaml_files()
+
+    def tearDown(self):
+        shutil.rmtree(self.pitzdir)
+
+    def test_save_writes_index(self):
+
+        from pitz.fragindex import read_frag_index
+
+        rows = read_frag_index(self.pitzdir)
+        assert (self.e.frag, 'entity', 'plain %s' % self.e.title[6:]) \
+        in rows, rows
+        assert (self.t.frag, 'task', self.t.title) in rows, rows
+
+    def test_matching_frags(self):
+
+        from pitz.fragindex import matching_frags
+
+        assert matching_frags(self.pitzdir, ['task']) == [self.t.frag]
+
+        people = matching_frags(self.pitzdir, ['person'])
+        assert self.person.frag in people
+        assert self.t.frag not in people
+
+        assert matching_frags(self.pitzdir, prefix=self.e.frag[:3]) \
+        == [self.e.frag]
+
+    def test_destroyed_entities_leave_index(self):
+
+        from pitz.fragindex import matching_frags
+
+        self.t.self_destruct(self.p)
+        self.p.save_entities_to_yaml_files()
+
+        assert self.t.frag not in matching_frags(self.pitzdir)
+
+    def test_scan_without_index(self):
+
+        from pitz.fragindex import frag_index_path, matching_frags
+
+        os.unlink(frag_index_path(self.pitzdir))
+
+        frags = matching_frags(self.pitzdir, ['task', 'entity'])
+        assert frags == sorted([self.t.frag, self.e.frag]), frags
+
+
+class TestTextIndex(unittest.TestCase):
+
+    def setUp(self):
+
+        from pitz.entity import Comment
+
+        self.pitzdir = tempfile.mkdtemp()
+        n = os.path.basename(self.pitzdir)
+
+        self.p = Project(title='searchable project', pathname=self.pitzdir)
+
+        self.e1 = Entity(self.p, title='Clean the litter box %s' % n,
+            description='The cat is upset.')
+
+        self.e2 = Entity(self.p, title='Feed the dog %s' % n)
+
+        self.c = Comment(self.p, title='comment %s' % n,
+            description='Buy more kibble', entity=self.e2,
+            who_said_it=None)
+
+        self.p.save_entities_to_yaml_files()
+
+    def tearDown(self):
+        shutil.rmtree(self.pitzdir)
+
+    @patch('subprocess.Popen')
+    def test_grep_uses_index(self, m):
+
+        assert self.p.textindex is not None
+
+        assert list(self.p.grep('"litter box"')) == [self.e1]
+        assert list(self.p.grep('"box litter"')) == []
+        assert list(self.p.grep('lit*')) == [self.e1]
+        assert list(self.p.grep('CAT', ignore_case=True)) == [self.e1]
+        assert list(self.p.grep('CAT')) == []
+
+        assert not m.called
+
+    def test_comments_count_for_their_entity(self):
+
+        g = self.p.grep('kibble')
+        assert self.e2 in g
+        assert self.c in g
+        assert self.e1 not in g
+
+    def test_index_follows_saves(self):
+
+        self.e1['description'] = 'The hamster is upset.'
+        self.e2.self_destruct(self.p)
+        self.p.save_entities_to_yaml_files()
+
+        from pitz.textindex import TextIndex
+        ti = TextIndex.load(self.pitzdir)
+
+        assert ti.search('hamster') == set([str(self.e1.uuid)])
+        assert not ti.search('cat')
+        assert self.e2 not in ti
+
+
+class TestSearch(unittest.TestCase):
+
+    def setUp(self):
+
+        from pitz.entity import Comment
+
+        self.pitzdir = tempfile.mkdtemp()
+        n = os.path.basename(self.pitzdir)
+
+        self.p = Project(title='searchable project', pathname=self.pitzdir)
+
+        self.e1 = Entity(self.p, title='Cat food %s' % n,
+            description='Buy cat food.  The cat likes fish.')
+
+        self.e2 = Entity(self.p, title='Dog walk %s' % n,
+            description='Walk the dog.')
+
+        self.e3 = Entity(self.p, title='Taxes %s' % n,
+            description='File the taxes.')
+
+        self.c = Comment(self.p, title='comment %s' % n,
+            description='Maybe the cat could walk the dog?',
+            entity=self.e3, who_said_it=None)
+
+        self.p.save_entities_to_yaml_files()
+
+    def tearDown(self):
+        shutil.rmtree(self.pitzdir)
+
+    def test_ranking(self):
+
+        results = self.p.search('cat')
+
+        assert list(results) == [self.e1, self.e3], list(results)
+        assert results.scores[self.e1.uuid] > results.scores[self.e3.uuid]
+
+    def test_comments_roll_up(self):
+
+        results = self.p.search('cat')
+
+        assert self.c not in results
+        assert results.snippets[self.e3.uuid] \
+        == 'Maybe the *cat* could walk the dog?', results.snippets
+
+    def test_limit(self):
+
+        assert len(self.p.search('the', limit=1)) == 1
+        assert len(self.p.search('the', limit=None)) == 3
+
+    def test_without_saved_index(self):
+
+        os.unlink(os.path.join(self.pitzdir, 'textindex.pickle'))
+        self.p._textindex = None
+
+        assert self.p.search('taxes').snippets_view().startswith(
+            'Search results for taxes')
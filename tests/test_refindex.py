@@ -0,0 +1,101 @@
+# vim: set expandtab ts=4 sw=4 filetype=python:
+
+import os
+import shutil
+import tempfile
+import unittest
+import uuid
+
+from pitz.entity import Comment, Person, Tag, Task
+from pitz.project import Project
+
+
+class TestReferences(unittest.TestCase):
+
+    def setUp(self):
+
+        # Titles are global, so keep mine from running into anybody
+        # else's.
+        self.n = n = uuid.uuid4().hex[:8]
+
+        self.pitzdir = tempfile.mkdtemp()
+
+        self.p = Project(title='references %s' % n, pathname=self.pitzdir)
+
+        self.t1 = Task(self.p, title='t1 %s' % n)
+        self.t2 = Task(self.p, title='t2 %s' % n)
+
+        self.c1 = Comment(self.p, title='c1 %s' % n, entity=self.t1,
+            who_said_it='matt')
+        self.c2 = Comment(self.p, title='c2 %s' % n, entity=self.t1.uuid,
+            who_said_it='matt')
+
+    def tearDown(self):
+        shutil.rmtree(self.pitzdir)
+
+    def test_comments(self):
+
+        assert set(self.t1.comments) == set([self.c1, self.c2])
+        assert self.t2.comments.length == 0
+
+        assert set(self.t1.comments) \
+        == set(self.p(type='comment', entity=self.t1))
+
+    def test_changing_a_pointer(self):
+
+        self.c2['entity'] = self.t2
+
+        assert list(self.t1.comments) == [self.c1]
+        assert list(self.t2.comments) == [self.c2]
+
+    def test_lists_of_pointers(self):
+
+        tag = Tag(self.p, title='tag %s' % self.n)
+
+        self.t1['tags'] = [tag]
+        self.t2['tags'] = [tag]
+
+        assert set(tag.tasks) == set([self.t1, self.t2])
+
+        self.t1['tags'] = []
+
+        assert list(tag.tasks) == [self.t2]
+
+    def test_activities(self):
+
+        self.p.current_user = Person(self.p, title='referee %s' % self.n)
+
+        self.t1['title'] = 't1 renamed %s' % self.n
+
+        assert self.t1.activities.length == 1
+        assert self.p.me.my_activities.length == 1
+
+        # They come out of the journal, not the project.
+        assert self.p(type='activity').length == 0
+
+        assert [a['entity'] for a in self.t1.activities] == [self.t1]
+        assert [a['who_did_it'] for a in self.t1.activities] \
+        == [self.p.me]
+
+    def test_self_destruct(self):
+
+        self.p.save_entities_to_yaml_files()
+
+        deleted = self.t1.self_destruct(self.p)
+
+        assert len(deleted) == 3, deleted
+
+        for e in (self.t1, self.c1, self.c2):
+            assert e.uuid not in self.p.entities_by_uuid
+            assert e.uuid not in self.p.references.pointers
+
+        assert self.t2 in self.p
+
+    def test_pickle_rebuilds(self):
+
+        self.p.to_pickle()
+
+        p2 = Project.from_pickle(os.path.join(self.pitzdir, 'project.pickle'))
+
+        assert set(c.uuid for c in p2.references.referrers(self.t1, 'entity')) \
+        == set([self.c1.uuid, self.c2.uuid])
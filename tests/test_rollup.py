@@ -0,0 +1,131 @@
+# vim: set expandtab ts=4 sw=4 filetype=python:
+
+import os
+import shutil
+import tempfile
+import unittest
+import uuid
+
+from pitz.entity import Component, Estimate, Milestone, Status, Task
+from pitz.project import Project
+
+
+class TestRollups(unittest.TestCase):
+
+    def setUp(self):
+
+        # Titles are global, so keep mine from running into anybody
+        # else's.
+        n = uuid.uuid4().hex[:8]
+
+        self.p = Project(title='rollups %s' % n)
+        self.p.setup_defaults()
+
+        self.m = Milestone(self.p, title='rollup milestone %s' % n)
+        self.c = Component(self.p, title='rollup component %s' % n)
+
+        self.small = Estimate(self.p, title='small %s' % n, points=1)
+        self.big = Estimate(self.p, title='big %s' % n, points=10)
+
+        self.finished = Status(title='finished')
+        self.unstarted = Status(title='unstarted')
+
+        self.tasks = [
+            Task(self.p, title='rollup task %s %d' % (n, i),
+                milestone=self.m, estimate=self.small,
+                components=[self.c])
+            for i in range(4)]
+
+    def assert_matches_a_scan(self, e):
+
+        r = self.p.rollups[e]
+        tasks = e.tasks
+
+        assert r.number_of_tasks() == len(tasks), \
+        (r.number_of_tasks(), len(tasks))
+
+        for s in self.p.statuses:
+
+            assert r.number_of_tasks([s]) == len(tasks(status=s))
+
+            assert r.points([s]) == sum(
+                t.estimate.points for t in tasks(status=s))
+
+    def test_counts_on_append(self):
+
+        r = self.m.rollup
+
+        assert r.number_of_tasks() == 4
+        assert r.number_of_tasks([self.unstarted]) == 4
+        assert r.points() == 4
+
+        self.assert_matches_a_scan(self.m)
+        self.assert_matches_a_scan(self.c)
+
+    def test_status_and_estimate_changes(self):
+
+        t0, t1, t2, t3 = self.tasks
+
+        t0['status'] = self.finished
+        t1['status'] = self.finished
+        t1['estimate'] = self.big
+
+        r = self.m.rollup
+
+        assert r.tasks_by_status == {self.finished: 2, self.unstarted: 2}
+        assert r.points_by_status == {self.finished: 11, self.unstarted: 2}
+
+        assert '50% complete (2 / 4 tasks)' in self.m.summarized_view
+
+        self.assert_matches_a_scan(self.m)
+        self.assert_matches_a_scan(self.c)
+
+    def test_moving_between_milestones_and_components(self):
+
+        other = Milestone(self.p, title='other %s' % self.m.title)
+
+        self.tasks[0]['milestone'] = other
+        self.tasks[1]['components'] = []
+
+        assert self.m.rollup.number_of_tasks() == 3
+        assert other.rollup.number_of_tasks() == 1
+        assert self.c.rollup.number_of_tasks() == 3
+
+        self.assert_matches_a_scan(self.m)
+        self.assert_matches_a_scan(other)
+        self.assert_matches_a_scan(self.c)
+
+    def test_pop(self):
+
+        self.p.pop(self.p.index(self.tasks[0]))
+
+        assert self.m.rollup.number_of_tasks() == 3
+        self.assert_matches_a_scan(self.m)
+
+    def test_pointers_count_the_same(self):
+
+        t = self.tasks[0]
+        before = dict(self.m.rollup.counts)
+
+        t.replace_objects_with_pointers()
+        assert dict(self.m.rollup.counts) == before
+
+        t.replace_pointers_with_objects()
+        assert dict(self.m.rollup.counts) == before
+
+    def test_pickle_recounts(self):
+
+        pitzdir = tempfile.mkdtemp()
+
+        try:
+            self.tasks[0]['status'] = self.finished
+            self.p.to_pickle(pitzdir)
+
+            p2 = Project.from_pickle(os.path.join(pitzdir, 'project.pickle'))
+
+            r = p2.rollups[self.m.uuid]
+            assert r.number_of_tasks() == 4
+            assert r.number_of_tasks([self.finished]) == 1
+
+        finally:
+            shutil.rmtree(pitzdir)
@@ -0,0 +1,116 @@
+# vim: set expandtab ts=4 sw=4 filetype=python:
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from mock import patch
+
+from pitz import rstcache
+from pitz.entity import Entity
+
+
+class TestRstCache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_lru_eviction(self):
+
+        c = rstcache.RstCache(max_entries=2)
+
+        c.render('a')
+        c.render('b')
+        c.render('a')
+        c.render('c')
+
+        # b was the least recently used.
+        assert c.key('a') in c.entries
+        assert c.key('b') not in c.entries
+        assert len(c) == 2
+
+    @patch('pitz.rstcache.publish')
+    def test_disk_cache_survives_a_new_cache(self, m):
+
+        m.return_value = u'<p>hi</p>'
+
+        c1 = rstcache.RstCache(directory=self.directory)
+        assert c1.render('hi') == u'<p>hi</p>'
+
+        c2 = rstcache.RstCache(directory=self.directory)
+        assert c2.render('hi') == u'<p>hi</p>'
+
+        assert m.call_count == 1
+        assert c2.hits == 1
+
+    @patch('pitz.rstcache.publish')
+    def test_entity_html_uses_cache(self, m):
+
+        m.return_value = u'<p>cached</p>'
+        rstcache.cache.clear()
+
+        e = Entity(title='cached description %s' % self.directory,
+            description='Some *important* stuff')
+
+        e.description_as_html
+        e.description_as_html
+
+        assert m.call_count == 1
+
+    @patch('pitz.rstcache.publish')
+    def test_disk_cache_has_a_limit(self, m):
+
+        m.side_effect = lambda text: u'<p>%s</p>' % text
+
+        c = rstcache.RstCache(directory=self.directory, max_files=10)
+
+        for i in range(10):
+            c.render('page %d' % i)
+
+        # Make page 0 the oldest, then use it again.
+        for i in range(10):
+            os.utime(c.path(c.key('page %d' % i)), (i, i))
+
+        c.entries.clear()
+        c.render('page 0')
+
+        c.render('one too many')
+
+        left = os.listdir(self.directory)
+
+        assert len(left) == 9, left
+        assert os.path.basename(c.path(c.key('page 0'))) in left
+        assert os.path.basename(c.path(c.key('page 1'))) not in left
+
+    def test_projects_have_their_own_caches(self):
+
+        from pitz.project import Project
+
+        p1 = Project(title='rst 1', pathname=self.directory)
+        p2 = Project(title='rst 2', pathname=tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, p2.pathname)
+
+        assert p1.rst_cache is p1.rst_cache
+        assert p1.rst_cache is not p2.rst_cache
+
+        assert p1.rst_cache.directory \
+        == os.path.join(self.directory, 'rstcache')
+
+        assert p2.rst_cache.directory.startswith(p2.pathname)
+
+        e = Entity(p2, title='described %s' % p2.pathname,
+            description='hello')
+
+        e.description_as_html
+        assert len(p2.rst_cache) == 1 and len(p1.rst_cache) == 0
+
+    def test_bad_rst(self):
+
+        c = rstcache.RstCache()
+        html = c.render('`unclosed')
+
+        assert 'unclosed' in html
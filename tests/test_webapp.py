@@ -66,7 +66,10 @@ class TestWebApp(unittest.TestCase):
         wsgiref.util.setup_testing_defaults(bogus_environ)
 
         bogus_start_response = mock.Mock()
-        results = self.webapp(bogus_environ, bogus_start_response)
+
+        # Big pages come back a chunk at a time.
+        results = [''.join(self.webapp(bogus_environ,
+            bogus_start_response))]
 
         assert bogus_start_response.called
         assert bogus_start_response.call_args[0][0] == expected_status
@@ -99,26 +102,26 @@ class TestWebApp(unittest.TestCase):
     def test_5(self):
         self.mk_request('/Entity/by_title/c', '', 'text/plain',
             '200 OK',
-            str(Entity.by_title('c')))
+            str(Entity.by_title('c', self.p)))
 
     def test_6(self):
         self.mk_request('/Task/all/detailed_view', 'status=unstarted',
             'text/plain',
             '200 OK',
-            Task.all().matches_dict(
+            Task.all(self.p).matches_dict(
                 status=['unstarted']).detailed_view)
 
     def test_7(self):
         self.mk_request('/Person/by_title/matt/my_todo', '',
             'text/plain',
             '200 OK',
-            Person.by_title('matt').my_todo.detailed_view)
+            Person.by_title('matt', self.p).my_todo.detailed_view)
 
     def test_8(self):
         self.mk_request('/Person/by_title/matt/my_todo/summarized_view',
             '', 'text/plain',
             '200 OK',
-            Person.by_title('matt').my_todo.summarized_view)
+            Person.by_title('matt', self.p).my_todo.summarized_view)
 
     def test_9(self):
         self.mk_request('/',
@@ -129,7 +132,7 @@ class TestWebApp(unittest.TestCase):
 
 
     def test_11(self):
-        matt = Person.by_title('matt')
+        matt = Person.by_title('matt', self.p)
 
         self.mk_request('/by_frag/%s/my_todo' % matt.frag,
             '',
@@ -199,6 +202,35 @@ class TestDispatcher(unittest.TestCase):
 
         assert self.app.dispatch(self.bogus_environ) is None
 
+    def test_routes(self):
+        """
+        Only the handlers for the first path segment get asked, and the
+        table notices handlers added later.
+        """
+
+        team = handlers.Team(self.p)
+        team.wants_to_handle = mock.Mock(return_value=None)
+        self.app.handlers.append(team)
+
+        help_handler = handlers.HelpHandler(self.p)
+        self.app.handlers.append(help_handler)
+
+        self.bogus_environ['PATH_INFO'] = '/help'
+
+        assert self.app.dispatch(self.bogus_environ) is help_handler
+        assert not team.wants_to_handle.called
+
+        # Handlers that don't say what paths they want get asked about
+        # everything.
+        catch_all = mock.Mock(path_segments=None)
+        self.app.handlers.insert(0, catch_all)
+
+        assert self.app.dispatch(self.bogus_environ) is catch_all
+
+        self.bogus_environ['PATH_INFO'] = '/fibityfoo'
+
+        assert self.app.dispatch(self.bogus_environ) is catch_all
+
 class TestStaticHandler1(unittest.TestCase):
 
     def test_1(self):
@@ -306,3 +338,166 @@ class TestStaticHandler2(unittest.TestCase):
         content WAS updated since that date, verify the handler replies
         with a 200.
         """
+
+
+class TestConditionalGet(unittest.TestCase):
+
+    def setUp(self):
+
+        self.p = Project(title='Bogus project for testing caching')
+        self.t = Task(self.p, title='cached task %s' % id(self))
+
+        self.webapp = webapp.SimpleWSGIApp(self.p)
+        self.webapp.handlers.append(handlers.ByFragHandler(self.p))
+        self.webapp.handlers.append(handlers.Project(self.p))
+
+    def get(self, path, **headers):
+
+        environ = dict(PATH_INFO=path, QUERY_STRING='',
+            HTTP_ACCEPT='text/html', **headers)
+
+        wsgiref.util.setup_testing_defaults(environ)
+
+        start_response = mock.Mock()
+        results = list(self.webapp(environ, start_response))
+
+        status, response_headers = start_response.call_args[0]
+
+        return status, dict(response_headers), results
+
+    def test_repeat_gets_come_from_the_cache(self):
+
+        status, headers, results = self.get('/by_frag/%s' % self.t.frag)
+
+        assert status == '200 OK', status
+        assert results == [str(self.t.html)]
+        assert 'ETag' in headers and 'Last-Modified' in headers, headers
+
+        status, headers2, results2 = self.get('/by_frag/%s' % self.t.frag)
+
+        assert results2 == results
+        assert headers2['ETag'] == headers['ETag']
+        assert self.webapp.render_cache.hits == 1
+
+    def test_if_none_match(self):
+
+        status, headers, results = self.get('/by_frag/%s' % self.t.frag)
+
+        status, headers, results = self.get('/by_frag/%s' % self.t.frag,
+            HTTP_IF_NONE_MATCH=headers['ETag'])
+
+        assert status == '304 Not Modified', status
+        assert results == []
+
+    def test_if_modified_since(self):
+
+        status, headers, results = self.get('/')
+
+        status, headers, results = self.get('/',
+            HTTP_IF_MODIFIED_SINCE=headers['Last-Modified'])
+
+        assert status == '304 Not Modified', status
+
+        status, headers, results = self.get('/',
+            HTTP_IF_MODIFIED_SINCE='Thu, 01 Jan 1970 00:00:00 GMT')
+
+        assert status == '200 OK', status
+
+    def test_changes_invalidate(self):
+
+        status, headers, results = self.get('/by_frag/%s' % self.t.frag)
+
+        self.t['description'] = 'Now with a description.'
+
+        status, headers2, results2 = self.get('/by_frag/%s' % self.t.frag,
+            HTTP_IF_NONE_MATCH=headers['ETag'])
+
+        assert status == '200 OK', status
+        assert headers2['ETag'] != headers['ETag']
+        assert 'Now with a description.' in results2[0]
+
+    def test_legacy_routes(self):
+
+        status, headers, results = self.get('/Task/all/detailed_view')
+
+        assert status == '200 OK', status
+        assert 'ETag' in headers, headers
+
+        status, headers, results = self.get('/Task/all/detailed_view',
+            HTTP_IF_NONE_MATCH=headers['ETag'])
+
+        assert status == '304 Not Modified', status
+
+    def test_404s_are_not_cached(self):
+
+        status, headers, results = self.get('/nothing/here')
+
+        assert status == '404 NOT FOUND', status
+        assert 'ETag' not in headers
+        assert not self.webapp.render_cache.entries
+
+    def test_conditional_gets_for_missing_pages_still_404(self):
+
+        status, headers, results = self.get('/')
+
+        for path in ('/nothing/here', '/by_frag/zzzzzz'):
+
+            status, headers2, results = self.get(path,
+                HTTP_IF_NONE_MATCH='*',
+                HTTP_IF_MODIFIED_SINCE=headers['Last-Modified'])
+
+            assert status.startswith('404'), status
+
+
+class TestStreamingAndPaging(unittest.TestCase):
+
+    def setUp(self):
+
+        self.p = Project(title='Bogus project for testing paging')
+
+        # Enough tasks to fill a few chunks.
+        self.tasks = [Task(self.p, title='paged task %03d %s' % (i, id(self)))
+            for i in range(200)]
+
+        self.webapp = webapp.SimpleWSGIApp(self.p)
+
+    def get(self, path, qs=''):
+
+        environ = dict(PATH_INFO=path, QUERY_STRING=qs,
+            HTTP_ACCEPT='text/plain')
+
+        wsgiref.util.setup_testing_defaults(environ)
+
+        start_response = mock.Mock()
+        chunks = self.webapp(environ, start_response)
+
+        return start_response.call_args[0][0], chunks
+
+    def test_big_pages_come_in_chunks(self):
+
+        status, chunks = self.get('/Task/all/detailed_view')
+
+        assert status == '200 OK', status
+        assert not isinstance(chunks, list)
+
+        chunks = list(chunks)
+
+        assert len(chunks) > 1, len(chunks)
+        assert ''.join(chunks) == Task.all(self.p).detailed_view
+
+    def test_offset_and_limit(self):
+
+        status, chunks = self.get('/Task/all/detailed_view',
+            'offset=10&limit=5')
+
+        page = ''.join(chunks)
+
+        assert status == '200 OK', status
+        assert '(11-15 of %d)' % len(Task.all(self.p)) in page, page
+        assert page == Task.all(self.p).page(10, 5).detailed_view
+
+    def test_bad_limit(self):
+
+        status, chunks = self.get('/Task/all', 'limit=lots')
+
+        assert status == '400 BAD REQUEST', status
@@ -0,0 +1,127 @@
+# vim: set expandtab ts=4 sw=4 filetype=python:
+
+from __future__ import with_statement
+
+import threading
+import time
+import unittest
+import urllib2
+
+from pitz.webapp.loadtest import LoadTest
+from pitz.webapp.server import ReadWriteLock, ThreadPoolWSGIServer
+from wsgiref.simple_server import WSGIRequestHandler
+
+
+class QuietHandler(WSGIRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+
+class TestReadWriteLock(unittest.TestCase):
+
+    def test_writer_waits_for_readers(self):
+
+        lock = ReadWriteLock()
+        events = []
+
+        def write():
+            with lock.writing():
+                events.append('write')
+
+        lock.acquire_read()
+
+        t = threading.Thread(target=write)
+        t.start()
+
+        # The writer can't get in while I'm reading.
+        time.sleep(0.05)
+        events.append('read done')
+        lock.release_read()
+
+        t.join(5)
+
+        assert events == ['read done', 'write'], events
+
+    def test_waiting_writer_holds_off_new_readers(self):
+
+        lock = ReadWriteLock()
+
+        lock.acquire_read()
+
+        t = threading.Thread(target=lock.acquire_write)
+        t.start()
+
+        while not lock.writers_waiting:
+            time.sleep(0.001)
+
+        reader = threading.Thread(target=lock.acquire_read)
+        reader.start()
+        reader.join(0.05)
+
+        # The new reader is stuck behind the writer.
+        assert reader.is_alive()
+
+        lock.release_read()
+        t.join(5)
+
+        assert lock.writer
+        lock.release_write()
+
+        reader.join(5)
+        assert lock.readers == 1
+
+
+class TestThreadPoolServer(unittest.TestCase):
+
+    def setUp(self):
+
+        self.in_flight = 0
+        self.most_in_flight = 0
+        self.lock = threading.Lock()
+
+        def slow_app(environ, start_response):
+
+            with self.lock:
+                self.in_flight += 1
+                self.most_in_flight = max(self.most_in_flight,
+                    self.in_flight)
+
+            time.sleep(0.05)
+
+            with self.lock:
+                self.in_flight -= 1
+
+            start_response('200 OK', [('Content-Type', 'text/plain')])
+            return ['slow']
+
+        self.httpd = ThreadPoolWSGIServer(('localhost', 0), 4,
+            QuietHandler)
+
+        self.httpd.set_app(slow_app)
+
+        self.t = threading.Thread(target=self.httpd.serve_forever,
+            kwargs=dict(poll_interval=0.01))
+
+        self.t.start()
+
+        self.url = 'http://localhost:%d/' % self.httpd.server_port
+
+    def tearDown(self):
+
+        self.httpd.shutdown()
+        self.t.join(5)
+        self.httpd.server_close()
+
+    def test_requests_run_at_the_same_time(self):
+
+        lt = LoadTest([self.url], requests=8, concurrency=4).run()
+
+        assert lt.errors == 0, lt.errors
+        assert len(lt.latencies) == 8
+        assert self.most_in_flight > 1, self.most_in_flight
+
+        assert 'p99' in lt.report
+
+    def test_one_request(self):
+        assert urllib2.urlopen(self.url).read() == 'slow'
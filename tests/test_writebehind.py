@@ -0,0 +1,143 @@
+# vim: set expandtab ts=4 sw=4 filetype=python:
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import yaml
+
+from pitz.entity import Task
+from pitz.project import Project
+from pitz.webapp.server import ReadWriteLock
+from pitz.webapp.writebehind import WriteBehind
+
+
+class TestWriteBehind(unittest.TestCase):
+
+    def setUp(self):
+
+        self.pitzdir = tempfile.mkdtemp()
+
+        self.p = Project(title='write behind', pathname=self.pitzdir)
+
+        self.t = Task(self.p,
+            title='write behind %s' % os.path.basename(self.pitzdir))
+
+        self.p.save_entities_to_yaml_files()
+
+        self.wb = WriteBehind(self.p, ReadWriteLock(), interval=60,
+            batch_size=2)
+
+    def tearDown(self):
+
+        self.wb.stop()
+        shutil.rmtree(self.pitzdir)
+
+    def saved_title(self):
+
+        return yaml.load(open(os.path.join(
+            self.pitzdir, self.t.yaml_filename)))['title']
+
+    def test_mark_dirty_does_not_save(self):
+
+        self.t['title'] = 'changed in the webapp'
+        self.wb.mark_dirty(self.t)
+
+        assert self.saved_title() != 'changed in the webapp'
+        assert len(self.wb.dirty) == 1
+
+    def test_flush(self):
+
+        self.t['title'] = 'changed in the webapp'
+        self.wb.mark_dirty(self.t)
+
+        assert self.t in self.wb.flush()
+        assert self.saved_title() == 'changed in the webapp'
+        assert not self.wb.dirty
+
+        # Nothing left to do.
+        assert self.wb.flush() == []
+
+        # The pointers are still objects afterward.
+        assert self.t['status'].__class__.__name__ == 'Status'
+
+    def test_batch_size_wakes_up_the_thread(self):
+
+        self.wb.start()
+
+        t2 = Task(self.p, title='second %s' % self.pitzdir)
+
+        self.t['title'] = 'changed in the webapp'
+        self.wb.mark_dirty(self.t)
+        self.wb.mark_dirty(t2)
+
+        # The interval is a minute, so only the batch size could have
+        # woken the thread up.
+        for i in range(500):
+            if self.wb.flushes:
+                break
+            self.wb.thread.join(0.01)
+
+        assert self.wb.flushes == 1
+        assert self.saved_title() == 'changed in the webapp'
+
+    def test_stop_flushes(self):
+
+        self.wb.start()
+
+        self.t['title'] = 'changed in the webapp'
+        self.wb.mark_dirty(self.t)
+
+        self.wb.stop()
+
+        assert not self.wb.thread.is_alive()
+        assert self.saved_title() == 'changed in the webapp'
+
+    def test_write_does_not_read_the_project(self):
+
+        from pitz.fragindex import read_frag_index
+        from pitz.textindex import TextIndex
+
+        self.t['title'] = 'changed in the webapp'
+        pending = self.p.prepare_save()
+
+        # Somebody changes the project after the lock comes off.
+        Task(self.p, title='added later %s' % self.pitzdir)
+
+        pending.write()
+
+        titles = [r[2] for r in read_frag_index(self.pitzdir)]
+
+        assert 'changed in the webapp' in titles
+        assert 'added later %s' % self.pitzdir not in titles
+
+        assert len(TextIndex.load(self.pitzdir)) == len(titles)
+
+    def test_prepare_save_does_not_touch_the_disk(self):
+
+        self.p.pack()
+
+        def files():
+
+            return dict(
+                (os.path.join(root, f),
+                    os.path.getsize(os.path.join(root, f)))
+                for root, dirs, fs in os.walk(self.pitzdir) for f in fs)
+
+        before = files()
+
+        self.t['title'] = 'changed in the webapp'
+        self.p.journal.record(self.t, 'title', 'old', 'changed')
+        pending = self.p.prepare_save()
+
+        assert files() == before
+
+        pending.write()
+
+        after = files()
+
+        assert after[self.p.packfile.data_path] \
+        > before[self.p.packfile.data_path]
+
+        assert self.p.journal.segments()[0] in after